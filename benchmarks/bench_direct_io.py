@@ -0,0 +1,168 @@
+"""Compares buffered, memory-mapped and ``O_DIRECT`` reads of mytar and tar shards.
+
+For every read mode and access pattern, the bytes of one epoch of a synthetic dataset (see
+``generate_data.py``) are read through ``ShardCache``, as ``ImageFolder`` does, without decoding
+them, and the following is measured:
+
+- ``mb_per_s``: bytes read per second;
+- ``user_s`` and ``system_s``: CPU time of the reading process, which includes the copies of the
+  kernel out of the page cache;
+- ``page_cache_mb``: growth of the page cache over the run (``Cached`` of ``/proc/meminfo``, so
+  other processes add noise), i.e. how much of the rest of the cache the epoch evicts once memory
+  is full.
+
+Patterns are ``group`` (whole mytar groups, ``is_mytar``), ``sample`` (single images of mytar groups
+in ``GroupShuffleSampler`` order, ``per_sample=True``) and ``tar`` (all members of tar archives,
+``is_tar``). Results are printed and written as a JSON list of records::
+
+    python benchmarks/generate_data.py /tmp/loader-bench --group-sizes 16 --formats mytar tar
+    python benchmarks/bench_direct_io.py /tmp/loader-bench --group-sizes 16 --output direct_io.json
+
+The page cache is dropped before every run (use ``--warm`` to keep it): buffered reads of a cold
+cache are what an epoch over a dataset larger than memory costs. Run it on the storage tier the
+training data lives on; ``O_DIRECT`` reads of tmpfs go through the page cache.
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import torchvision
+from torchvision.datasets.samplers import GroupShuffleSampler
+from torchvision.datasets.shards import ShardCache
+
+from bench_loaders import drop_page_cache
+from generate_data import dataset_dir, generate
+
+
+READ_MODES = ('buffered', 'mmap', 'direct')
+PATTERNS = ('group', 'sample', 'tar')
+
+
+def page_cache_bytes():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('Cached:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def epoch_reads(pattern, data_root, group_size):
+    """Root of the dataset and list of the (path, [(offset, size), ...]) reads of one epoch."""
+    if pattern == 'tar':
+        root = dataset_dir(data_root, 'tar', group_size)
+        dataset = torchvision.datasets.ImageFolder(root, is_tar=True)
+        reads = []
+        for path, _ in dataset.samples:
+            reads.append((path, dataset.archive_indexes.get(path).ranges))
+        return root, reads
+    root = dataset_dir(data_root, 'mytar', group_size)
+    dataset = torchvision.datasets.ImageFolder(root, is_mytar=True, group_size=group_size,
+                                               per_sample=pattern == 'sample')
+    order = GroupShuffleSampler(dataset) if pattern == 'sample' else torch.randperm(len(dataset)).tolist()
+    reads = []
+    for index in order:
+        path, offset, size = dataset.byte_range(index)
+        reads.append((path, [(offset, size)]))
+    return root, reads
+
+
+def run(mode, pattern, group_size, args):
+    root, reads = epoch_reads(pattern, args.data_root, group_size)
+    if not args.warm:
+        drop_page_cache(root)
+    caches = [ShardCache(use_mmap=mode == 'mmap', direct_io=mode == 'direct') for _ in range(args.threads)]
+
+    def read_part(part):
+        cache = caches[part]
+        total = 0
+        for path, ranges in reads[part::args.threads]:
+            for view in cache.read_ranges(path, ranges, max_gap=args.max_gap):
+                # the bytes of a map are only read once they are touched
+                total += len(view.tobytes() if mode == 'mmap' else view)
+        return total
+
+    cache_start = page_cache_bytes()
+    times_start = os.times()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        total = sum(pool.map(read_part, range(args.threads)))
+    elapsed = time.perf_counter() - start
+    times_end = os.times()
+    cache_end = page_cache_bytes()
+    for cache in caches:
+        cache.close()
+    return {
+        'mode': mode,
+        'pattern': pattern,
+        'group_size': group_size,
+        'threads': args.threads,
+        'reads': len(reads),
+        'bytes': total,
+        'seconds': elapsed,
+        'mb_per_s': total / 2 ** 20 / elapsed if elapsed > 0 else 0.0,
+        'user_s': times_end.user - times_start.user,
+        'system_s': times_end.system - times_start.system,
+        'page_cache_mb': (cache_end - cache_start) / 2 ** 20,
+        'warm': args.warm,
+    }
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(description="Buffered, mmap and O_DIRECT shard read benchmark")
+    parser.add_argument('data_root', help="directory of the synthetic dataset, generated if missing")
+    parser.add_argument('--modes', default=list(READ_MODES), nargs='+', choices=READ_MODES,
+                        help="read modes to benchmark (default: all)")
+    parser.add_argument('--patterns', default=list(PATTERNS), nargs='+', choices=PATTERNS,
+                        help="access patterns to benchmark (default: all)")
+    parser.add_argument('--group-sizes', default=[16], type=int, nargs='+',
+                        help="group sizes of the shards (default: 16)")
+    parser.add_argument('--threads', default=1, type=int, help="concurrent readers, like workers (default: 1)")
+    parser.add_argument('--max-gap', default=0, type=int,
+                        help="largest hole read to merge the members of a tar archive (default: 0)")
+    parser.add_argument('--warm', action='store_true', help="do not drop the dataset from the page cache")
+    parser.add_argument('--output', default='direct_io_results.json', help="JSON file of the results")
+    # synthetic dataset
+    parser.add_argument('--classes', default=10, type=int, help="classes of a generated dataset (default: 10)")
+    parser.add_argument('--images-per-class', default=200, type=int,
+                        help="images per class of a generated dataset (default: 200)")
+    parser.add_argument('--image-size', default=400, type=int, help="mean side of generated images (default: 400)")
+    return parser
+
+
+def main(args):
+    formats = sorted(set('tar' if pattern == 'tar' else 'mytar' for pattern in args.patterns))
+    generate(args.data_root, args.classes, args.images_per_class, args.image_size,
+             group_sizes=args.group_sizes, formats=formats)
+
+    results = []
+    print("{:<10}{:<8}{:>6}{:>10}{:>10}{:>10}{:>12}".format(
+        'mode', 'pattern', 'group', 'MB/s', 'user s', 'sys s', 'cache MB'))
+    for pattern in args.patterns:
+        for group_size in args.group_sizes:
+            for mode in args.modes:
+                r = run(mode, pattern, group_size, args)
+                results.append(r)
+                print("{:<10}{:<8}{:>6}{:>10.1f}{:>10.2f}{:>10.2f}{:>12.1f}".format(
+                    mode, pattern, group_size, r['mb_per_s'], r['user_s'], r['system_s'], r['page_cache_mb']))
+
+    report = {
+        'config': {k: v for k, v in vars(args).items()},
+        'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                        'torchvision': torchvision.__version__, 'cpus': os.cpu_count()},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
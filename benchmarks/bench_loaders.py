@@ -0,0 +1,223 @@
+"""Compares the throughput of the storage formats of ``ImageFolder``.
+
+For every format, group size and worker count, one epoch of a synthetic dataset (see
+``generate_data.py``) is loaded with a ``DataLoader`` and the following is measured:
+
+- ``samples_per_s``: images per second over the epoch, start-up included;
+- ``bytes_read``: bytes returned by read calls in the loading processes (``rchar`` of
+  ``/proc/<pid>/io``, page cache hits included) and ``disk_bytes_read`` (``read_bytes``, what was
+  fetched from the block device);
+- ``max_rss_mb`` and ``mean_rss_mb``: peak resident memory of the loading processes;
+- ``first_batch_s``, ``p50_batch_ms`` and ``p99_batch_ms``: time to the first batch and
+  percentiles of the time between two batches.
+
+Results are printed and written as a JSON list of records::
+
+    python benchmarks/generate_data.py /tmp/loader-bench
+    python benchmarks/bench_loaders.py /tmp/loader-bench --workers 0 4 8 --group-sizes 4 16 --output results.json
+
+Use ``--cold`` to drop the dataset files from the page cache before every run.
+"""
+import argparse
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import torch
+import torch.utils.data
+from torch.utils.data import get_worker_info
+from torch.utils.data._utils.collate import default_collate
+
+import torchvision
+from torchvision import transforms
+from torchvision.datasets.samplers import GroupShuffleSampler
+
+from generate_data import GROUPED_FORMATS, dataset_dir, generate
+
+
+MODES = ('folder', 'async', 'mytar-sample') + GROUPED_FORMATS
+
+
+def process_counters():
+    """(rchar, read_bytes, peak RSS in bytes) of the calling process, zeros where /proc is missing."""
+    rchar = read_bytes = peak_rss = 0
+    try:
+        with open('/proc/self/io') as f:
+            io_counters = dict(line.split(': ') for line in f.read().splitlines())
+        rchar = int(io_counters['rchar'])
+        read_bytes = int(io_counters['read_bytes'])
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak_rss = int(line.split()[1]) * 1024
+    except (OSError, KeyError, ValueError):
+        pass
+    return rchar, read_bytes, peak_rss
+
+
+class MeasuredCollate(object):
+    """Collates a batch, flattening the samples of grouped items, and records the counters of the
+    loading process in its row of ``counters`` (row 0 is the main process, row i + 1 worker i)."""
+
+    def __init__(self, counters, grouped):
+        self.counters = counters
+        self.grouped = grouped
+
+    def __call__(self, batch):
+        if self.grouped:
+            flat = []
+            for samples, targets in batch:
+                if not isinstance(targets, list):
+                    targets = [targets] * len(samples)
+                flat.extend(zip(samples, targets))
+            batch = flat
+        out = default_collate(batch)
+        worker_info = get_worker_info()
+        row = 0 if worker_info is None else worker_info.id + 1
+        self.counters[row] = torch.tensor(process_counters(), dtype=torch.int64)
+        return out
+
+
+def drop_page_cache(root):
+    for dirpath, _, fnames in os.walk(root):
+        for fname in fnames:
+            fd = os.open(os.path.join(dirpath, fname), os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def build_loader(mode, data_root, group_size, workers, batch_size, transform, collate_fn):
+    if mode in ('folder', 'async'):
+        root = dataset_dir(data_root, 'folder')
+        dataset = torchvision.datasets.ImageFolder(root, transform=transform)
+        if mode == 'async':
+            loader = torchvision.datasets.AsyncPrefetchLoader(dataset, batch_size, shuffle=True,
+                                                              collate_fn=collate_fn)
+            if workers == 0:
+                return root, loader
+            return root, torch.utils.data.DataLoader(loader, batch_size=None, num_workers=workers)
+        return root, torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True,
+                                                 num_workers=workers, collate_fn=collate_fn)
+
+    if mode == 'mytar-sample':
+        root = dataset_dir(data_root, 'mytar', group_size)
+        dataset = torchvision.datasets.ImageFolder(root, transform=transform, is_mytar=True,
+                                                   group_size=group_size, per_sample=True)
+        return root, torch.utils.data.DataLoader(dataset, batch_size=batch_size, sampler=GroupShuffleSampler(dataset),
+                                                 num_workers=workers, collate_fn=collate_fn)
+
+    root = dataset_dir(data_root, mode, group_size)
+    kwargs = {'zip': dict(is_zip=True), 'tar': dict(is_tar=True), 'pickle': dict(is_meng=True),
+              'imgpack': dict(is_imgpack=True), 'mytar': dict(is_mytar=True, group_size=group_size)}[mode]
+    dataset = torchvision.datasets.ImageFolder(root, transform=transform, **kwargs)
+    # every item holds group_size images
+    return root, torch.utils.data.DataLoader(dataset, batch_size=max(1, batch_size // group_size), shuffle=True,
+                                             num_workers=workers, collate_fn=collate_fn)
+
+
+def run(mode, group_size, workers, args):
+    counters = torch.zeros(workers + 1, 3, dtype=torch.int64).share_memory_()
+    collate_fn = MeasuredCollate(counters, grouped=mode in GROUPED_FORMATS)
+    transform = transforms.Compose([transforms.RandomResizedCrop(args.crop_size), transforms.PILToTensor()])
+    root, loader = build_loader(mode, args.data_root, group_size, workers, args.batch_size, transform, collate_fn)
+    if args.cold:
+        drop_page_cache(root)
+
+    main_start = process_counters()
+    samples = 0
+    arrivals = []
+    start = time.perf_counter()
+    for _, targets in loader:
+        samples += len(targets)
+        arrivals.append(time.perf_counter())
+        if args.max_batches and len(arrivals) >= args.max_batches:
+            break
+    elapsed = time.perf_counter() - start
+
+    if workers == 0:
+        # the main process did the loading, only count what it read during the epoch
+        counters[0, :2] -= torch.tensor(main_start[:2])
+        rows = counters[:1]
+    else:
+        rows = counters[1:]
+    rows = rows[rows[:, 2] > 0]
+    intervals = np.diff([start] + arrivals)
+    return {
+        'mode': mode,
+        'group_size': group_size if mode not in ('folder', 'async') else None,
+        'workers': workers,
+        'batch_size': args.batch_size,
+        'batches': len(arrivals),
+        'samples': samples,
+        'seconds': elapsed,
+        'samples_per_s': samples / elapsed if elapsed > 0 else 0.0,
+        'bytes_read': int(rows[:, 0].sum()),
+        'disk_bytes_read': int(rows[:, 1].sum()),
+        'max_rss_mb': float(rows[:, 2].max()) / 2 ** 20 if len(rows) else 0.0,
+        'mean_rss_mb': float(rows[:, 2].double().mean()) / 2 ** 20 if len(rows) else 0.0,
+        'first_batch_s': float(intervals[0]) if len(intervals) else 0.0,
+        'p50_batch_ms': float(np.percentile(intervals[1:], 50)) * 1e3 if len(intervals) > 1 else 0.0,
+        'p99_batch_ms': float(np.percentile(intervals[1:], 99)) * 1e3 if len(intervals) > 1 else 0.0,
+        'cold': args.cold,
+    }
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(description="ImageFolder storage format benchmark")
+    parser.add_argument('data_root', help="directory of the synthetic dataset, generated if missing")
+    parser.add_argument('--modes', default=list(MODES), nargs='+', choices=MODES,
+                        help="formats to benchmark (default: all)")
+    parser.add_argument('--workers', default=[0, 4], type=int, nargs='+',
+                        help="DataLoader worker counts (default: 0 4)")
+    parser.add_argument('--group-sizes', default=[4, 16], type=int, nargs='+',
+                        help="group sizes of the grouped formats (default: 4 16)")
+    parser.add_argument('-b', '--batch-size', default=64, type=int, help="images per batch (default: 64)")
+    parser.add_argument('--crop-size', default=224, type=int, help="RandomResizedCrop size (default: 224)")
+    parser.add_argument('--max-batches', default=0, type=int, help="stop an epoch after that many batches")
+    parser.add_argument('--cold', action='store_true', help="drop the dataset from the page cache before every run")
+    parser.add_argument('--output', default='loader_results.json', help="JSON file of the results")
+    # synthetic dataset
+    parser.add_argument('--classes', default=10, type=int, help="classes of a generated dataset (default: 10)")
+    parser.add_argument('--images-per-class', default=200, type=int,
+                        help="images per class of a generated dataset (default: 200)")
+    parser.add_argument('--image-size', default=400, type=int, help="mean side of generated images (default: 400)")
+    return parser
+
+
+def main(args):
+    grouped = [mode for mode in args.modes if mode in GROUPED_FORMATS or mode == 'mytar-sample']
+    formats = sorted(set('mytar' if mode == 'mytar-sample' else mode for mode in grouped))
+    generate(args.data_root, args.classes, args.images_per_class, args.image_size,
+             group_sizes=args.group_sizes, formats=formats)
+
+    results = []
+    header = "{:<14}{:>6}{:>8}{:>12}{:>12}{:>10}{:>12}".format(
+        'mode', 'group', 'workers', 'samples/s', 'MB read', 'RSS MB', 'p99 ms')
+    print(header)
+    for mode in args.modes:
+        group_sizes = args.group_sizes if mode in grouped else [None]
+        for group_size in group_sizes:
+            for workers in args.workers:
+                r = run(mode, group_size, workers, args)
+                results.append(r)
+                print("{:<14}{:>6}{:>8}{:>12.1f}{:>12.1f}{:>10.1f}{:>12.2f}".format(
+                    mode, group_size or '-', workers, r['samples_per_s'], r['bytes_read'] / 2 ** 20,
+                    r['max_rss_mb'], r['p99_batch_ms']))
+
+    report = {
+        'config': {k: v for k, v in vars(args).items()},
+        'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                        'torchvision': torchvision.__version__, 'cpus': os.cpu_count()},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
@@ -0,0 +1,136 @@
+"""Generates a synthetic JPEG dataset in every storage format ``ImageFolder`` reads.
+
+Layout of the output directory::
+
+    <data-root>/folder/class0000/img000000.jpg      plain files
+    <data-root>/zip-g<G>/class0000/group00000.zip    G images per archive (is_zip)
+    <data-root>/tar-g<G>/class0000/group00000.tar    G images per archive (is_tar)
+    <data-root>/pickle-g<G>/class0000/group00000.pickle   G decoded images (is_meng)
+    <data-root>/imgpack-g<G>/class0000/group00000.imgpack G encoded images (is_imgpack)
+    <data-root>/mytar-g<G>/group0000000.mytar        G images per group (is_mytar)
+
+Usage::
+
+    python benchmarks/generate_data.py /tmp/loader-bench --classes 10 --images-per-class 200 --group-sizes 4 16
+"""
+import argparse
+import os
+import pickle
+import tarfile
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from torchvision.datasets.imgpack import write_imgpack
+from torchvision.datasets.pack import write_mytar_shards
+
+
+GROUPED_FORMATS = ('zip', 'tar', 'pickle', 'imgpack', 'mytar')
+_DONE = ".done"
+
+
+def dataset_dir(data_root, fmt, group_size=None):
+    if fmt == 'folder':
+        return os.path.join(data_root, 'folder')
+    return os.path.join(data_root, '{}-g{}'.format(fmt, group_size))
+
+
+def synthetic_image(rng, height, width):
+    # smooth colour gradients with noise compress roughly like photos, unlike pure noise
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.uniform(0, 255, 3).astype(np.float32)
+    gx = rng.uniform(-0.5, 0.5, 3).astype(np.float32)
+    gy = rng.uniform(-0.5, 0.5, 3).astype(np.float32)
+    img = base + x[..., None] * gx + y[..., None] * gy + rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def write_folder(output_dir, num_classes, images_per_class, image_size, quality, seed):
+    rng = np.random.RandomState(seed)
+    for c in range(num_classes):
+        class_dir = os.path.join(output_dir, 'class{:04d}'.format(c))
+        os.makedirs(class_dir, exist_ok=True)
+        for i in range(images_per_class):
+            # sizes vary by +-25% like the images of ImageNet
+            height, width = (int(image_size * rng.uniform(0.75, 1.25)) for _ in range(2))
+            synthetic_image(rng, height, width).save(os.path.join(class_dir, 'img{:06d}.jpg'.format(i)),
+                                                      quality=quality)
+
+
+def _write_archive(fmt, path, members):
+    if fmt == 'zip':
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            for member in members:
+                archive.write(member, arcname=os.path.basename(member))
+    elif fmt == 'tar':
+        with tarfile.open(path, 'w') as archive:
+            for member in members:
+                archive.add(member, arcname=os.path.basename(member))
+    elif fmt == 'imgpack':
+        buffers = []
+        for member in members:
+            with open(member, 'rb') as f:
+                buffers.append(f.read())
+        write_imgpack(path, buffers, [os.path.basename(member) for member in members])
+    else:
+        # the pickled format stores decoded images
+        imgs = []
+        for member in members:
+            with open(member, 'rb') as f:
+                imgs.append(Image.open(f).convert('RGB'))
+        with open(path, 'wb') as f:
+            pickle.dump(imgs, f)
+
+
+def write_grouped(folder, output_dir, fmt, group_size):
+    if fmt == 'mytar':
+        write_mytar_shards(folder, output_dir, group_size)
+        return
+    for class_name in sorted(d.name for d in os.scandir(folder) if d.is_dir()):
+        names = sorted(os.listdir(os.path.join(folder, class_name)))
+        os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
+        for g, start in enumerate(range(0, len(names), group_size)):
+            members = [os.path.join(folder, class_name, name) for name in names[start:start + group_size]]
+            _write_archive(fmt, os.path.join(output_dir, class_name, 'group{:05d}.{}'.format(g, fmt)), members)
+
+
+def generate(data_root, num_classes=10, images_per_class=200, image_size=400, quality=90, group_sizes=(4, 16),
+             formats=GROUPED_FORMATS, seed=0):
+    """Writes every format that does not exist yet; a format is complete once its ``.done`` marker exists."""
+    folder = dataset_dir(data_root, 'folder')
+    if not os.path.exists(os.path.join(folder, _DONE)):
+        write_folder(folder, num_classes, images_per_class, image_size, quality, seed)
+        open(os.path.join(folder, _DONE), 'w').close()
+    for fmt in formats:
+        for group_size in group_sizes:
+            output_dir = dataset_dir(data_root, fmt, group_size)
+            if os.path.exists(os.path.join(output_dir, _DONE)):
+                continue
+            os.makedirs(output_dir, exist_ok=True)
+            write_grouped(folder, output_dir, fmt, group_size)
+            open(os.path.join(output_dir, _DONE), 'w').close()
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(description="Generate a synthetic JPEG dataset in every ImageFolder format")
+    parser.add_argument('data_root', help="output directory")
+    parser.add_argument('--classes', default=10, type=int, help="number of classes (default: 10)")
+    parser.add_argument('--images-per-class', default=200, type=int, help="images per class (default: 200)")
+    parser.add_argument('--image-size', default=400, type=int, help="mean image side in pixels (default: 400)")
+    parser.add_argument('--quality', default=90, type=int, help="JPEG quality (default: 90)")
+    parser.add_argument('--group-sizes', default=[4, 16], type=int, nargs='+',
+                        help="images per archive or group (default: 4 16)")
+    parser.add_argument('--formats', default=list(GROUPED_FORMATS), nargs='+', choices=GROUPED_FORMATS,
+                        help="grouped formats to write besides the plain folder (default: all)")
+    parser.add_argument('--seed', default=0, type=int, help="seed of the images (default: 0)")
+    return parser
+
+
+def main(args):
+    generate(args.data_root, args.classes, args.images_per_class, args.image_size, args.quality,
+             args.group_sizes, args.formats, args.seed)
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
@@ -1,3 +1,4 @@
+import torch
 from torchvision.transforms import autoaugment, transforms
 
 
@@ -35,3 +36,33 @@ class ClassificationPresetEval:
 
     def __call__(self, img):
         return self.transforms(img)
+
+
+class ClassificationPresetEvalPreprocess:
+    """Deterministic part of ClassificationPresetEval, returning uint8 tensors that can be stored once."""
+
+    def __init__(self, crop_size, resize_size=256):
+
+        self.transforms = transforms.Compose([
+            transforms.Resize(resize_size),
+            transforms.CenterCrop(crop_size),
+            transforms.PILToTensor(),
+        ])
+
+    def __call__(self, img):
+        return self.transforms(img)
+
+
+class ClassificationPresetEvalNormalize:
+    """Rest of ClassificationPresetEval, applied to the uint8 tensors of ClassificationPresetEvalPreprocess
+    (single images or whole batches)."""
+
+    def __init__(self, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+
+        self.transforms = transforms.Compose([
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize(mean=mean, std=std),
+        ])
+
+    def __call__(self, img):
+        return self.transforms(img)
@@ -6,6 +6,8 @@ import torch
 import torch.utils.data
 from torch import nn
 import torchvision
+from torchvision.datasets.folder import grouped_collate
+from torchvision.datasets.preprocessed import write_preprocessed_tensors
 
 import presets
 import utils
@@ -71,6 +73,17 @@ def evaluate(model, criterion, data_loader, device, print_freq=100):
     return metric_logger.acc1.global_avg
 
 
+# ImageFolder arguments of the grouped formats written by benchmarks/generate_data.py, whose items are
+# lists of images
+GROUPED_FORMATS = {
+    'mytar': lambda args: dict(is_mytar=True, group_size=args.group_size),
+    'tar': lambda args: dict(is_tar=True),
+    'zip': lambda args: dict(is_zip=True),
+    'imgpack': lambda args: dict(is_imgpack=True),
+    'pickle': lambda args: dict(is_meng=True),
+}
+
+
 def _get_cache_path(filepath):
     import hashlib
     h = hashlib.sha1(filepath.encode()).hexdigest()
@@ -79,6 +92,23 @@ def _get_cache_path(filepath):
     return cache_path
 
 
+def load_preprocessed_data(valdir, preprocessed_dir, crop_size, resize_size, args):
+    # the validation images are resized and cropped once, evaluation then only reads uint8 tensors
+    preprocessed_dir = os.path.join(preprocessed_dir, "{}-{}".format(resize_size, crop_size))
+    if not torchvision.datasets.PreprocessedTensorDataset.exists(preprocessed_dir):
+        if utils.is_main_process():
+            print("Preprocessing validation data to {}".format(preprocessed_dir))
+            dataset_test = torchvision.datasets.ImageFolder(
+                valdir,
+                presets.ClassificationPresetEvalPreprocess(crop_size=crop_size, resize_size=resize_size))
+            write_preprocessed_tensors(dataset_test, preprocessed_dir, batch_size=args.batch_size,
+                                       num_workers=args.workers)
+        if args.distributed:
+            torch.distributed.barrier()
+    return torchvision.datasets.PreprocessedTensorDataset(
+        preprocessed_dir, transform=presets.ClassificationPresetEvalNormalize())
+
+
 def load_data(traindir, valdir, args):
     # Data loading code
     print("Loading data")
@@ -92,10 +122,12 @@ def load_data(traindir, valdir, args):
         print("Loading dataset_train from {}".format(cache_path))
         dataset, _ = torch.load(cache_path)
     else:
+        format_kwargs = GROUPED_FORMATS[args.train_format](args) if args.train_format in GROUPED_FORMATS else {}
         dataset = torchvision.datasets.ImageFolder(
             traindir,
             presets.ClassificationPresetTrain(crop_size=crop_size, auto_augment_policy=args.auto_augment,
-                                              random_erase_prob=args.random_erase))
+                                              random_erase_prob=args.random_erase),
+            **format_kwargs)
         if args.cache_dataset:
             print("Saving dataset_train to {}".format(cache_path))
             utils.mkdir(os.path.dirname(cache_path))
@@ -104,7 +136,9 @@ def load_data(traindir, valdir, args):
 
     print("Loading validation data")
     cache_path = _get_cache_path(valdir)
-    if args.cache_dataset and os.path.exists(cache_path):
+    if args.preprocessed_val_dir:
+        dataset_test = load_preprocessed_data(valdir, args.preprocessed_val_dir, crop_size, resize_size, args)
+    elif args.cache_dataset and os.path.exists(cache_path):
         # Attention, as the transforms are also cached!
         print("Loading dataset_test from {}".format(cache_path))
         dataset_test, _ = torch.load(cache_path)
@@ -146,13 +180,26 @@ def main(args):
     train_dir = os.path.join(args.data_path, 'train')
     val_dir = os.path.join(args.data_path, 'val')
     dataset, dataset_test, train_sampler, test_sampler = load_data(train_dir, val_dir, args)
-    data_loader = torch.utils.data.DataLoader(
-        dataset, batch_size=args.batch_size,
-        sampler=train_sampler, num_workers=args.workers, pin_memory=True)
-
-    data_loader_test = torch.utils.data.DataLoader(
-        dataset_test, batch_size=args.batch_size,
-        sampler=test_sampler, num_workers=args.workers, pin_memory=True)
+    if args.train_format in GROUPED_FORMATS:
+        # every item is a group of images, flattened into batches of about batch_size images
+        data_loader = torch.utils.data.DataLoader(
+            dataset, batch_size=max(1, args.batch_size // args.group_size),
+            sampler=train_sampler, num_workers=args.workers, pin_memory=True, collate_fn=grouped_collate)
+    else:
+        data_loader = torch.utils.data.DataLoader(
+            dataset, batch_size=args.batch_size,
+            sampler=train_sampler, num_workers=args.workers, pin_memory=True)
+
+    if isinstance(dataset_test, torchvision.datasets.PreprocessedTensorDataset):
+        # whole batches are sliced out of the memory map, there is nothing to collate
+        data_loader_test = torch.utils.data.DataLoader(
+            dataset_test, batch_size=None,
+            sampler=torch.utils.data.BatchSampler(test_sampler, args.batch_size, drop_last=False),
+            num_workers=args.workers, pin_memory=True)
+    else:
+        data_loader_test = torch.utils.data.DataLoader(
+            dataset_test, batch_size=args.batch_size,
+            sampler=test_sampler, num_workers=args.workers, pin_memory=True)
 
     print("Creating model")
     model = torchvision.models.__dict__[args.model](pretrained=args.pretrained)
@@ -272,6 +319,14 @@ def parse_args():
         help="Use pre-trained models from the modelzoo",
         action="store_true",
     )
+    parser.add_argument('--preprocessed-val-dir', default='',
+                        help='directory where the resized and cropped validation images are stored once, '
+                             'so that evaluation does not decode them every epoch (default: disabled)')
+    parser.add_argument('--train-format', default='folder', choices=['folder'] + sorted(GROUPED_FORMATS),
+                        help='layout of the training images: one file per image, or groups of images '
+                             '(default: folder)')
+    parser.add_argument('--group-size', default=1, type=int,
+                        help='number of images per group of the grouped training formats (default: 1)')
     parser.add_argument('--auto-augment', default=None, help='auto augment policy (default: None)')
     parser.add_argument('--random-erase', default=0.0, type=float, help='random erasing probability (default: 0.0)')
 
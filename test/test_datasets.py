@@ -5,6 +5,7 @@ from unittest import mock
 import numpy as np
 import PIL
 from PIL import Image
+import torch
 from torch._utils_internal import get_file_path_2
 import torchvision
 from common_utils import get_tmp_dir
@@ -12,7 +13,10 @@ from fakedata_generation import mnist_root, cifar_root, imagenet_root, \
     cityscapes_root, svhn_root, voc_root, ucf101_root, places365_root, widerface_root
 import xml.etree.ElementTree as ET
 from urllib.request import Request, urlopen
+import functools
 import itertools
+import threading
+import time
 
 
 try:
@@ -28,6 +32,14 @@ except ImportError:
     HAS_PYAV = False
 
 
+def make_image_tree(root, num_images=(('a', 3), ('b', 4)), ext='png'):
+    # images of class ``cls`` are 8 pixels high and 8 + i pixels wide
+    for cls, count in num_images:
+        os.makedirs(os.path.join(root, cls))
+        for i in range(count):
+            Image.new('RGB', (8 + i, 8)).save(os.path.join(root, cls, '{}{}.{}'.format(cls, i, ext)))
+
+
 class Tester(unittest.TestCase):
     def generic_classification_dataset_test(self, dataset, num_images=1):
         self.assertEqual(len(dataset), num_images)
@@ -102,6 +114,760 @@ class Tester(unittest.TestCase):
                     root, loader=lambda x: x, is_valid_file=lambda x: False
                 )
 
+    def test_mytar_pack(self):
+        from torchvision.datasets.pack import write_mytar_shards
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root)
+
+            group_names = write_mytar_shards(root, packed, group_size=3, num_workers=2)
+            self.assertEqual(len(group_names), 3)
+            self.assertTrue(os.path.exists(os.path.join(packed, 'metadata.txt')))
+
+            dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3)
+            self.assertEqual(len(dataset), 3)
+            images, targets = zip(*[dataset[i] for i in range(len(dataset))])
+            widths = sorted((target, img.size[0]) for group in zip(images, targets) for img, target in zip(*group))
+            self.assertEqual(widths, [(0, 8), (0, 9), (0, 10), (1, 8), (1, 9), (1, 10), (1, 11)])
+
+    def test_mytar_index(self):
+        from torchvision.datasets.mytar import MytarIndex
+        from torchvision.datasets.pack import convert_metadata, write_mytar_shards
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root)
+
+            write_mytar_shards(root, packed, group_size=3, write_index=False)
+            self.assertFalse(MytarIndex.exists(packed))
+            parsed = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3).mytar_index
+
+            convert_metadata(packed, group_size=3)
+            self.assertTrue(MytarIndex.exists(packed))
+            dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3)
+            self.assertIsInstance(dataset.mytar_index.samples, np.memmap)
+            self.assertEqual(dataset.classes, ['a', 'b'])
+            self.assertTrue(np.array_equal(parsed.samples, dataset.mytar_index.samples))
+            self.assertTrue(np.array_equal(parsed.group_offsets, [0, 3, 6, 7]))
+
+            # an index older than metadata.txt is not used
+            metadata = os.path.join(packed, 'metadata.txt')
+            with open(metadata) as f:
+                lines = f.read().splitlines()
+            with open(metadata, 'w') as f:
+                f.write('\n'.join(lines[:-1] + ['renamed_' + lines[-1]]) + '\n')
+            self.assertFalse(MytarIndex.exists(packed))
+            with self.assertWarns(UserWarning):
+                dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3)
+            self.assertNotIsInstance(dataset.mytar_index.samples, np.memmap)
+            convert_metadata(packed, group_size=3)
+            self.assertTrue(MytarIndex.exists(packed))
+
+            # packing again without an index deletes the previous one
+            write_mytar_shards(root, packed, group_size=2, write_index=False)
+            self.assertFalse(any(name.endswith('.npy') for name in os.listdir(packed)))
+            self.assertEqual(len(torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=2)), 4)
+
+    def test_mytar_mmap(self):
+        from torchvision.datasets.pack import write_mytar_shards
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root, num_images=(('a', 3), ('b', 3)), ext='jpg')
+            write_mytar_shards(root, packed, group_size=3)
+
+            for read_group_size in (3, 1):
+                datasets = [torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3,
+                                                             read_group_size=read_group_size, use_mmap=use_mmap,
+                                                             max_open_shards=1)
+                            for use_mmap in (False, True)]
+                for i in range(len(datasets[0])):
+                    (buffered, _), (mapped, _) = datasets[0][i], datasets[1][i]
+                    self.assertEqual([np.asarray(img).tolist() for img in buffered],
+                                     [np.asarray(img).tolist() for img in mapped])
+                self.assertEqual(len(datasets[1].shard_cache), 1)
+
+    def test_mytar_per_sample(self):
+        import asyncio
+        from torchvision.datasets.pack import write_mytar_shards
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root)
+            write_mytar_shards(root, packed, group_size=3)
+
+            for use_mmap in (False, True):
+                dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3,
+                                                           per_sample=True, use_mmap=use_mmap)
+                self.assertEqual(len(dataset), 7)
+                samples = [dataset[i] for i in range(len(dataset))]
+                self.assertTrue(all(isinstance(target, int) for _, target in samples))
+                self.assertEqual([target for _, target in samples], dataset.targets.tolist())
+                self.assertEqual(sorted((target, img.size[0]) for img, target in samples),
+                                 [(0, 8), (0, 9), (0, 10), (1, 8), (1, 9), (1, 10), (1, 11)])
+                group_index, img_info = dataset.mytar_index.locate(4)
+                path = dataset.root + '/' + dataset.mytar_index.group_name(group_index)
+                self.assertEqual(dataset.byte_range(4), (path, int(img_info['start']), int(img_info['img_size'])))
+                offsets = dataset.group_offsets
+                self.assertEqual(dataset.group_bytes.tolist(),
+                                 [int(dataset.mytar_index.samples['img_size'][offsets[i]:offsets[i + 1]].sum())
+                                  for i in range(len(offsets) - 1)])
+
+            # packs of a group carry the labels of their images, the last group only holds one
+            dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3, read_group_size=1)
+            self.assertEqual(len(dataset), 7)
+            self.assertEqual([dataset[i][1][0] for i in range(7)], dataset.targets.tolist())
+            with self.assertRaises(IndexError):
+                dataset[7]
+            dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3, read_group_size=2)
+            self.assertEqual([len(dataset[i][0]) for i in range(len(dataset))], [2, 1, 2, 1, 1])
+            self.assertEqual(sum((dataset[i][1] for i in range(len(dataset))), []), dataset.targets.tolist())
+            # the packs of a group file form one group, read whole or in packs it holds the same bytes
+            self.assertEqual(dataset.group_offsets.tolist(), [0, 2, 4, 5])
+            group_bytes = [sum(dataset.byte_range(i)[2] for i in range(start, stop))
+                           for start, stop in ((0, 2), (2, 4), (4, 5))]
+            self.assertEqual(dataset.group_bytes.tolist(), group_bytes)
+            dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3)
+            self.assertIsNone(dataset.group_offsets)
+            # the public pack loaders return the images of the pack
+            path, group_metadata = dataset._group_slice(2)
+            images = torchvision.datasets.folder.mytar_loader_pack(path, group_metadata, 2, 0)
+            self.assertEqual([img.size for img in images], [img.size for img in dataset[2][0]])
+            path, group_metadata = dataset._group_slice(0)
+            images = asyncio.get_event_loop().run_until_complete(
+                torchvision.datasets.folder.async_mytar_loader_pack(path, group_metadata, 2, 1))
+            self.assertEqual([img.size for img in images], [img.size for img in dataset[0][0][2:]])
+            self.assertEqual(dataset.group_bytes.tolist(), [dataset.byte_range(i)[2] for i in range(3)])
+
+    def test_direct_io(self):
+        from torchvision.datasets.pack import write_mytar_shards
+        from torchvision.datasets.shards import ShardCache
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            path = os.path.join(root, 'shard')
+            data = os.urandom(3 * 4096 + 123)
+            with open(path, 'wb') as f:
+                f.write(data)
+            cache = ShardCache(use_mmap=False, direct_io=True)
+            ranges = [(5, 10), (4090, 20), (8192, 4096), (12300, 111)]
+            self.assertEqual([bytes(view) for view in cache.read_ranges(path, ranges, max_gap=4096)],
+                             [data[offset:offset + size] for offset, size in ranges])
+            self.assertEqual(bytes(cache.read(path, len(data) - 7, 7)), data[-7:])
+            with self.assertRaises(EOFError):
+                cache.read(path, len(data) - 7, 8)
+            with self.assertRaises(ValueError):
+                ShardCache(use_mmap=True, direct_io=True)
+
+            os.remove(path)
+            make_image_tree(root)
+            write_mytar_shards(root, packed, group_size=3)
+            for kwargs in (dict(), dict(per_sample=True)):
+                buffered = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3, **kwargs)
+                direct = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3, direct_io=True, **kwargs)
+                for i in range(len(buffered)):
+                    (expected, expected_target), (images, target) = buffered[i], direct[i]
+                    self.assertEqual(target, expected_target)
+                    if not isinstance(images, list):
+                        expected, images = [expected], [images]
+                    self.assertEqual([np.asarray(img).tolist() for img in images],
+                                     [np.asarray(img).tolist() for img in expected])
+
+    def test_mytar_getitems(self):
+        from torchvision.datasets.pack import write_mytar_shards
+        from torchvision.datasets.shards import plan_reads
+
+        self.assertEqual(plan_reads([(0, 5), (5, 5), (12, 3), (100, 1)], max_gap=2),
+                         [[(0, 5), (5, 5), (12, 3)], [(100, 1)]])
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root)
+            write_mytar_shards(root, packed, group_size=3)
+
+            indices = [6, 0, 2, 2, 4, 1]
+            for use_mmap in (False, True):
+                dataset = torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3,
+                                                           per_sample=True, use_mmap=use_mmap)
+                expected = [(img.size, target) for img, target in (dataset[i] for i in indices)]
+                for max_gap in (0, 1 << 20):
+                    dataset.batch_read_max_gap = max_gap
+                    batch = dataset.__getitems__(indices)
+                    self.assertEqual([(img.size, target) for img, target in batch], expected)
+                self.assertEqual([(img.size, target) for img, target in dataset[indices]], expected)
+
+    def test_shared_bytes_cache(self):
+        from torchvision.datasets.pack import write_mytar_shards
+        from torchvision.datasets.shm_cache import SharedBytesCache
+
+        cache = SharedBytesCache(4, 6144, block_size=1024)
+        try:
+            for i in range(3):
+                self.assertTrue(cache.put(i, bytes([i]) * 1500))
+            self.assertEqual(bytes(cache.get(0)), bytes([0]) * 1500)
+            # sample 1 is the least recently used one
+            self.assertTrue(cache.put(3, b'x' * 100))
+            self.assertIsNone(cache.get(1))
+            self.assertEqual(bytes(cache.get(0)), bytes([0]) * 1500)
+            self.assertEqual(bytes(cache.get(3)), b'x' * 100)
+        finally:
+            cache.close()
+
+        cache = SharedBytesCache(4, 2048, policy='pin', block_size=1024)
+        try:
+            self.assertTrue(cache.put(0, b'a' * 2000))
+            self.assertFalse(cache.put(1, b'b'))
+            self.assertEqual(bytes(cache.get(0)), b'a' * 2000)
+        finally:
+            cache.close()
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root)
+            write_mytar_shards(root, packed, group_size=3)
+            for dataset in (torchvision.datasets.ImageFolder(root, cache_bytes=1 << 20),
+                            torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3,
+                                                             per_sample=True, cache_bytes=1 << 20)):
+                expected = [(img.size, target) for img, target in (dataset[i] for i in range(len(dataset)))]
+                self.assertEqual(dataset.bytes_cache.stats()['cached_samples'], len(dataset))
+                self.assertEqual([(img.size, target) for img, target in (dataset[i] for i in range(len(dataset)))],
+                                 expected)
+                self.assertEqual(dataset.bytes_cache.stats()['hits'], len(dataset))
+                dataset.bytes_cache.close()
+
+            with self.assertRaises(ValueError):
+                torchvision.datasets.ImageFolder(packed, is_mytar=True, group_size=3, cache_bytes=1 << 20)
+            with self.assertRaises(ValueError):
+                torchvision.datasets.ImageFolder(root, loader=lambda path: path, cache_bytes=1 << 20)
+
+    def test_draft_size(self):
+        from torchvision.datasets.pack import write_mytar_shards
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            for cls in ('a', 'b'):
+                os.makedirs(os.path.join(root, cls))
+                for i in range(2):
+                    Image.new('RGB', (64, 48), color=(i, 100, 200)).save(
+                        os.path.join(root, cls, '{}.jpg'.format(i)))
+            write_mytar_shards(root, packed, group_size=2)
+
+            for kwargs in (dict(), dict(is_mytar=True, group_size=2, per_sample=True)):
+                path = packed if kwargs else root
+                dataset = torchvision.datasets.ImageFolder(path, **kwargs)
+                self.assertEqual(dataset[0][0].size, (64, 48))
+                # shorter side 48 covers 16 at 1/2 scale but not at 1/4
+                dataset = torchvision.datasets.ImageFolder(path, draft_size=16, **kwargs)
+                self.assertEqual([dataset[i][0].size for i in range(4)], [(32, 24)] * 4)
+                self.assertEqual(dataset[0][0].mode, 'RGB')
+                dataset = torchvision.datasets.ImageFolder(path, draft_size=40, **kwargs)
+                self.assertEqual(dataset[0][0].size, (64, 48))
+
+            # cached bytes are decoded as the loader decodes files
+            loader = functools.partial(torchvision.datasets.folder.pil_loader, draft_size=16)
+            dataset = torchvision.datasets.ImageFolder(root, loader=loader, cache_bytes=1 << 20)
+            for _ in range(2):
+                self.assertEqual([dataset[i][0].size for i in range(4)], [(32, 24)] * 4)
+            self.assertEqual(dataset.bytes_cache.stats()['hits'], 4)
+            dataset.bytes_cache.close()
+
+    def test_tensor_decode_backend(self):
+        from torchvision.datasets.pack import write_mytar_shards
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root)
+            write_mytar_shards(root, packed, group_size=3)
+
+            for path, kwargs in ((root, dict()), (packed, dict(is_mytar=True, group_size=3, per_sample=True))):
+                images = torchvision.datasets.ImageFolder(path, **kwargs)
+                tensors = torchvision.datasets.ImageFolder(path, decode_backend='tensor', **kwargs)
+                for i in range(len(images)):
+                    img, target = images[i]
+                    tensor, tensor_target = tensors[i]
+                    self.assertEqual(tensor.dtype, torch.uint8)
+                    self.assertEqual(tensor.shape, (3, img.size[1], img.size[0]))
+                    self.assertTrue(torch.equal(tensor, torch.from_numpy(np.array(img)).permute(2, 0, 1)))
+                    self.assertEqual(tensor_target, target)
+
+            with self.assertRaises(ValueError):
+                torchvision.datasets.ImageFolder(root, decode_backend='accimage')
+
+    def test_loader_profiler(self):
+        profiler = torchvision.datasets.LoaderProfiler()
+        for _ in range(99):
+            profiler.record('decode', 1e-3)
+        profiler.record('decode', 1.0)
+        stats = profiler.stats()['decode']
+        self.assertEqual(stats['count'], 100)
+        self.assertAlmostEqual(stats['total'], 1.099)
+        self.assertTrue(1e-3 <= stats['p50'] <= 1.1e-3)
+        self.assertTrue(1e-3 <= stats['p99'] <= 1.1e-3)
+        self.assertEqual(profiler.stats(worker=-1), profiler.stats())
+        profiler.reset()
+        self.assertEqual(profiler.stats(), {})
+
+        with get_tmp_dir() as root:
+            make_image_tree(root)
+            dataset = torchvision.datasets.ImageFolder(root, transform=lambda img: np.array(img)[:8, :8],
+                                                       profiler=profiler)
+            collate_fn = profiler.timed_collate()
+            batch = collate_fn([dataset[i] for i in range(len(dataset))])
+            self.assertEqual(batch[0].shape, (7, 8, 8, 3))
+            counts = {stage: s['count'] for stage, s in profiler.stats().items()}
+            self.assertEqual(counts, {'load': 7, 'transform': 7, 'collate': 1})
+
+        # threads of a new process create its row once and lose no count
+        profiler = torchvision.datasets.LoaderProfiler()
+        barrier = threading.Barrier(8)
+
+        def record():
+            barrier.wait()
+            for _ in range(100):
+                profiler.record('decode', 1e-3)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(profiler.stats()['decode']['count'], 800)
+
+        # every DataLoader worker counts in its own row
+        with get_tmp_dir() as root:
+            make_image_tree(root)
+            profiler = torchvision.datasets.LoaderProfiler(num_workers=2)
+            dataset = torchvision.datasets.ImageFolder(root, transform=lambda img: np.array(img)[:8, :8],
+                                                       profiler=profiler)
+            loader = torch.utils.data.DataLoader(dataset, batch_size=2, num_workers=2,
+                                                 collate_fn=profiler.timed_collate())
+            self.assertEqual(sum(len(targets) for _, targets in loader), 7)
+            self.assertEqual(profiler.stats()['load']['count'], 7)
+            self.assertEqual([profiler.stats(worker=w)['collate']['count'] for w in (0, 1)], [2, 2])
+            self.assertEqual(profiler.stats(worker=-1), {})
+
+            dataset.profiler = torchvision.datasets.LoaderProfiler()
+            with self.assertRaisesRegex(ValueError, "num_workers"):
+                list(torch.utils.data.DataLoader(dataset, batch_size=2, num_workers=2))
+
+    def test_scan_cache(self):
+        def backdate(root):
+            past = time.time() - 60
+            for dirpath, _, _ in os.walk(root):
+                os.utime(dirpath, (past, past))
+
+        with get_tmp_dir() as root, get_tmp_dir() as cache_dir:
+            make_image_tree(root)
+            backdate(root)
+            expected = torchvision.datasets.ImageFolder(root).samples
+            dataset = torchvision.datasets.ImageFolder(root, scan_cache_dir=cache_dir)
+            self.assertEqual(dataset.samples, expected)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            with mock.patch('torchvision.datasets.folder._scan_class_dirs', side_effect=AssertionError):
+                dataset = torchvision.datasets.ImageFolder(root, scan_cache_dir=cache_dir)
+            self.assertEqual(dataset.samples, expected)
+            self.assertEqual(dataset.targets, [0, 0, 0, 1, 1, 1, 1])
+
+            # adding a file modifies its directory, which invalidates the cache
+            Image.new('RGB', (8, 8)).save(os.path.join(root, 'b', 'new.png'))
+            dataset = torchvision.datasets.ImageFolder(root, scan_cache_dir=cache_dir)
+            self.assertEqual(dataset.samples, torchvision.datasets.ImageFolder(root).samples)
+            self.assertEqual(len(dataset), 8)
+
+            # directories modified right before the scan are not trusted
+            with mock.patch('torchvision.datasets.folder._scan_class_dirs',
+                            wraps=torchvision.datasets.folder._scan_class_dirs) as scan:
+                torchvision.datasets.ImageFolder(root, scan_cache_dir=cache_dir)
+            self.assertEqual(scan.call_count, 1)
+
+    def test_parallel_scan(self):
+        from torchvision.datasets.folder import make_dataset
+
+        def walk_scan(directory, class_to_idx, is_valid_file):
+            # reference: the os.walk based scan
+            instances = []
+            for target_class in sorted(class_to_idx):
+                target_dir = os.path.join(directory, target_class)
+                for root, _, fnames in sorted(os.walk(target_dir, followlinks=True)):
+                    for fname in sorted(fnames):
+                        path = os.path.join(root, fname)
+                        if is_valid_file(path):
+                            instances.append((path, class_to_idx[target_class]))
+            return instances
+
+        with get_tmp_dir() as root:
+            make_image_tree(root, num_images=(('a', 3), ('b', 2), ('c', 4)))
+            os.makedirs(os.path.join(root, 'a', 'sub', 'deeper'))
+            os.makedirs(os.path.join(root, 'a', 'sub-x'))
+            for name in ('a/sub/1.png', 'a/sub/deeper/2.png', 'a/sub-x/3.png', 'a/sub/notes.txt', 'b/0.PNG'):
+                Image.new('RGB', (8, 8)).save(os.path.join(root, name), format='PNG')
+            os.symlink(os.path.join(root, 'c'), os.path.join(root, 'b', 'link'))
+            class_to_idx = {'a': 0, 'b': 1, 'c': 2, 'missing': 3}
+
+            def is_png(path):
+                return path.lower().endswith('.png')
+
+            expected = walk_scan(root, class_to_idx, is_png)
+            for num_workers in (0, 1, 4):
+                self.assertEqual(make_dataset(root, class_to_idx, extensions=('.png',), num_workers=num_workers),
+                                 expected)
+                self.assertEqual(make_dataset(root, class_to_idx, is_valid_file=is_png, num_workers=num_workers),
+                                 expected)
+
+            dataset = torchvision.datasets.ImageFolder(root, scan_workers=4)
+            self.assertEqual(dataset.samples, torchvision.datasets.ImageFolder(root).samples)
+
+    def test_compact_samples(self):
+        import pickle
+        from torchvision.datasets.sample_list import CompactSamples
+
+        with get_tmp_dir() as root:
+            make_image_tree(root)
+            os.makedirs(os.path.join(root, 'b', '\u00e9t\u00e9'))
+            Image.new('RGB', (8, 8)).save(os.path.join(root, 'b', '\u00e9t\u00e9', 'x.png'))
+            expected = torchvision.datasets.ImageFolder(root)
+            dataset = torchvision.datasets.ImageFolder(root, compact_samples=True)
+            self.assertIsInstance(dataset.samples, CompactSamples)
+            self.assertIs(dataset.imgs, dataset.samples)
+            self.assertEqual(dataset.samples, expected.samples)
+            self.assertEqual(list(dataset.samples), expected.imgs)
+            self.assertEqual(dataset.samples[1:-1:2], expected.samples[1:-1:2])
+            self.assertEqual(dataset.samples[-1], expected.samples[-1])
+            self.assertEqual(dataset.targets.dtype, np.int32)
+            self.assertEqual(dataset.targets.tolist(), expected.targets)
+            with self.assertRaises(IndexError):
+                dataset.samples[len(dataset)]
+            for i in range(len(dataset)):
+                self.assertEqual(dataset[i][1], expected[i][1])
+                self.assertTrue(np.array_equal(np.asarray(dataset[i][0]), np.asarray(expected[i][0])))
+
+            samples = pickle.loads(pickle.dumps(dataset.samples))
+            self.assertEqual(samples, expected.samples)
+            self.assertEqual(len(CompactSamples.from_list([])), 0)
+
+    def test_tar_index(self):
+        import asyncio
+        import tarfile
+        from torchvision.datasets import archive_index
+        from torchvision.datasets.folder import tar_loader, async_tar_loader
+
+        with get_tmp_dir() as root, get_tmp_dir() as archives:
+            make_image_tree(root, num_images=(('a', 3), ('b', 2)))
+            for cls in ('a', 'b'):
+                os.makedirs(os.path.join(archives, cls))
+                with tarfile.open(os.path.join(archives, cls, 'group.tar'), 'w') as archive:
+                    archive.add(os.path.join(root, cls), arcname=cls)
+            path = os.path.join(archives, 'a', 'group.tar')
+
+            index = archive_index.load_tar_index(path)
+            self.assertTrue(os.path.exists(path + archive_index.SIDECAR_SUFFIX))
+            self.assertEqual(index.names, ['a/' + name for name in sorted(os.listdir(os.path.join(root, 'a')))])
+            with open(path, 'rb') as f:
+                data = f.read()
+            for name, (offset, size) in zip(index.names, index.ranges):
+                with open(os.path.join(root, name), 'rb') as f:
+                    self.assertEqual(data[offset:offset + size], f.read())
+
+            # the sidecar is used as long as it describes the archive
+            with mock.patch.object(archive_index, 'build_tar_index', side_effect=AssertionError):
+                self.assertEqual(archive_index.load_tar_index(path).ranges, index.ranges)
+            with tarfile.open(path, 'w') as archive:
+                archive.add(os.path.join(root, 'a', sorted(os.listdir(os.path.join(root, 'a')))[0]), arcname='x.png')
+            self.assertEqual(archive_index.load_tar_index(path).names, ['x.png'])
+
+            expected = [np.asarray(img) for img in tar_loader(path)]
+            self.assertEqual(len(expected), 1)
+            images = asyncio.get_event_loop().run_until_complete(async_tar_loader(path))
+            self.assertTrue(np.array_equal(np.asarray(images[0]), expected[0]))
+
+            for kwargs in (dict(), dict(use_mmap=True), dict(archive_sidecars=False)):
+                dataset = torchvision.datasets.ImageFolder(archives, is_tar=True, **kwargs)
+                images, target = dataset[1]
+                self.assertEqual(target, 1)
+                self.assertEqual(len(images), 2)
+                for image, name in zip(images, sorted(os.listdir(os.path.join(root, 'b')))):
+                    with Image.open(os.path.join(root, 'b', name)) as reference:
+                        self.assertTrue(np.array_equal(np.asarray(image), np.asarray(reference.convert('RGB'))))
+
+    def test_zip_index(self):
+        import asyncio
+        import zipfile
+        from torchvision.datasets import archive_index
+        from torchvision.datasets.folder import zip_loader
+
+        with get_tmp_dir() as root, get_tmp_dir() as archives:
+            make_image_tree(root, num_images=(('a', 3), ('b', 2)))
+            references = {}
+            for cls in ('a', 'b'):
+                os.makedirs(os.path.join(archives, cls))
+                names = sorted(os.listdir(os.path.join(root, cls)))
+                with zipfile.ZipFile(os.path.join(archives, cls, 'group.zip'), 'w') as archive:
+                    archive.writestr(zipfile.ZipInfo('dir/'), b'')
+                    for i, name in enumerate(names):
+                        # stored and deflated members
+                        compression = zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED
+                        archive.write(os.path.join(root, cls, name), arcname=name, compress_type=compression)
+                references[cls] = []
+                for name in names:
+                    with Image.open(os.path.join(root, cls, name)) as img:
+                        references[cls].append(np.asarray(img.convert('RGB')))
+            path = os.path.join(archives, 'a', 'group.zip')
+
+            index = archive_index.load_zip_index(path)
+            self.assertEqual(index.names, sorted(os.listdir(os.path.join(root, 'a'))))
+            self.assertEqual(index.methods.tolist(), [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+            with open(path, 'rb') as f:
+                data = f.read()
+            with zipfile.ZipFile(path) as archive:
+                for i, (offset, size) in enumerate(index.ranges):
+                    self.assertEqual(bytes(index.extract(i, data[offset:offset + size], path)),
+                                     archive.read(index.names[i]))
+            with mock.patch.object(archive_index, 'build_zip_index', side_effect=AssertionError):
+                self.assertEqual(archive_index.load_zip_index(path).methods.tolist(), index.methods.tolist())
+
+            for image, reference in zip(zip_loader(path), references['a']):
+                self.assertTrue(np.array_equal(np.asarray(image), reference))
+
+            for kwargs in (dict(), dict(use_mmap=True), dict(archive_sidecars=False)):
+                dataset = torchvision.datasets.ImageFolder(archives, is_zip=True, **kwargs)
+                images, target = dataset[0]
+                self.assertEqual(target, 0)
+                self.assertEqual(len(images), 3)
+                for image, reference in zip(images, references['a']):
+                    self.assertTrue(np.array_equal(np.asarray(image), reference))
+
+            # one item per member
+            flat = [(image, i) for i, cls in enumerate('ab') for image in references[cls]]
+            for is_tar in (False, True):
+                if is_tar:
+                    import tarfile
+                    for cls in ('a', 'b'):
+                        with tarfile.open(os.path.join(archives, cls, 'group.tar'), 'w') as archive:
+                            for name in sorted(os.listdir(os.path.join(root, cls))):
+                                archive.add(os.path.join(root, cls, name), arcname=name)
+                kwargs = dict(is_tar=True, is_valid_file=lambda x: x.endswith('.tar')) if is_tar else dict(is_zip=True)
+                for extra in (dict(), dict(cache_bytes=1 << 20)):
+                    dataset = torchvision.datasets.ImageFolder(archives, per_sample=True, **kwargs, **extra)
+                    self.assertEqual(len(dataset), 5)
+                    self.assertEqual(dataset.group_offsets.tolist(), [0, 3, 5])
+                    for _ in range(2):
+                        for i, (reference, target) in enumerate(flat):
+                            image, image_target = dataset[i]
+                            self.assertEqual(image_target, target)
+                            self.assertTrue(np.array_equal(np.asarray(image), reference))
+                    image, target = asyncio.get_event_loop().run_until_complete(dataset.async_get_item(-1))
+                    self.assertEqual(target, 1)
+                    self.assertTrue(np.array_equal(np.asarray(image), flat[-1][0]))
+
+    def test_imgpack(self):
+        import pickle
+        from PIL import ImageFile
+        from torchvision.datasets import imgpack
+        from torchvision.datasets.folder import imgpack_loader
+
+        with get_tmp_dir() as root, get_tmp_dir() as pickles, get_tmp_dir() as packs:
+            make_image_tree(root, num_images=(('a', 3), ('b', 2)))
+            for cls in ('a', 'b'):
+                os.makedirs(os.path.join(pickles, cls))
+                imgs = []
+                for name in sorted(os.listdir(os.path.join(root, cls))):
+                    with Image.open(os.path.join(root, cls, name)) as img:
+                        imgs.append(img.convert('RGB'))
+                with open(os.path.join(pickles, cls, 'group.pickle'), 'wb') as f:
+                    pickle.dump(imgs, f)
+            paths = imgpack.convert_pickle_tree(pickles, packs, image_format='PNG', num_workers=2)
+            self.assertEqual(paths, [os.path.join(packs, cls, 'group.imgpack') for cls in ('a', 'b')])
+
+            index = imgpack.load_imgpack_index(paths[0])
+            self.assertEqual(index.names, ['000000.png', '000001.png', '000002.png'])
+            images = imgpack_loader(paths[0])
+            self.assertIsInstance(images[0], ImageFile.ImageFile)
+            reference = torchvision.datasets.ImageFolder(pickles, is_meng=True, loader=lambda x: x)
+            for image, expected in zip(images, reference[0][0]):
+                self.assertTrue(np.array_equal(np.asarray(image), np.asarray(expected)))
+
+            dataset = torchvision.datasets.ImageFolder(packs, is_imgpack=True, transform=np.asarray)
+            self.assertEqual(len(dataset), 2)
+            for i in range(2):
+                (images, target), (expected_images, expected_target) = dataset[i], reference[i]
+                self.assertEqual(target, expected_target)
+                self.assertEqual(len(images), len(expected_images))
+                for image, expected in zip(images, expected_images):
+                    self.assertTrue(np.array_equal(image, np.asarray(expected)))
+
+            dataset = torchvision.datasets.ImageFolder(packs, is_imgpack=True, per_sample=True)
+            self.assertEqual(len(dataset), 5)
+            image, target = dataset[3]
+            self.assertEqual(target, 1)
+            self.assertTrue(np.array_equal(np.asarray(image), np.asarray(reference[1][0][0])))
+
+            imgpack.write_imgpack(os.path.join(packs, 'empty.imgpack'), [])
+            self.assertEqual(len(imgpack.load_imgpack_index(os.path.join(packs, 'empty.imgpack'))), 0)
+
+    def test_preprocessed_tensor_dataset(self):
+        from torchvision import transforms
+        from torchvision.datasets.preprocessed import write_preprocessed_tensors
+
+        with get_tmp_dir() as root, get_tmp_dir() as out:
+            make_image_tree(root)
+            preprocess = transforms.Compose([transforms.Resize(6), transforms.CenterCrop(4), transforms.PILToTensor()])
+            source = torchvision.datasets.ImageFolder(root, transform=preprocess)
+            self.assertFalse(torchvision.datasets.PreprocessedTensorDataset.exists(out))
+            write_preprocessed_tensors(source, out, batch_size=3)
+
+            normalize = transforms.ConvertImageDtype(torch.float)
+            dataset = torchvision.datasets.PreprocessedTensorDataset(out, transform=normalize)
+            self.assertEqual(len(dataset), len(source))
+            self.assertEqual(dataset.images.shape, (len(source), 3, 4, 4))
+            for i in range(len(source)):
+                image, target = dataset[i]
+                expected_image, expected_target = source[i]
+                self.assertEqual(target, expected_target)
+                self.assertTrue(torch.equal(image, normalize(expected_image)))
+
+            for indices in ([1, 2, 3], [4, 0, 2], slice(2, 6)):
+                images, targets = dataset[indices]
+                expected = [source[i] for i in range(len(source))[indices]] if isinstance(indices, slice) \
+                    else [source[i] for i in indices]
+                self.assertTrue(torch.equal(images, normalize(torch.stack([image for image, _ in expected]))))
+                self.assertEqual(targets.tolist(), [target for _, target in expected])
+
+            sampler = torch.utils.data.BatchSampler(torch.utils.data.SequentialSampler(dataset), 4, drop_last=False)
+            loader = torch.utils.data.DataLoader(dataset, batch_size=None, sampler=sampler)
+            self.assertEqual([len(targets) for _, targets in loader], [4, 3])
+
+            with self.assertRaises(TypeError):
+                write_preprocessed_tensors(torchvision.datasets.ImageFolder(root), out)
+
+    def test_grouped_collate(self):
+        from torchvision import transforms
+        from torchvision.datasets.folder import grouped_collate
+        from torchvision.datasets.pack import write_mytar_shards
+
+        preprocess = transforms.Compose([transforms.Resize(6), transforms.CenterCrop(4), transforms.PILToTensor()])
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root, num_images=(('a', 3), ('b', 4)))
+            write_mytar_shards(root, packed, group_size=2)
+            dataset = torchvision.datasets.ImageFolder(packed, transform=preprocess, is_mytar=True, group_size=2)
+            expected = [(image, target) for i in range(len(dataset)) for image, target in zip(*dataset[i])]
+
+            for num_workers in (0, 2):
+                loader = torch.utils.data.DataLoader(dataset, batch_size=2, num_workers=num_workers,
+                                                     collate_fn=grouped_collate)
+                batches = list(loader)
+                # the last group of each class holds a single image
+                self.assertEqual(sum(len(targets) for _, targets in batches), len(expected))
+                images = torch.cat([images for images, _ in batches])
+                targets = torch.cat([targets for _, targets in batches])
+                self.assertEqual(images.dtype, torch.uint8)
+                self.assertTrue(torch.equal(images, torch.stack([image for image, _ in expected])))
+                self.assertEqual(targets.tolist(), [target for _, target in expected])
+
+            single = torchvision.datasets.ImageFolder(root, transform=preprocess)
+            images, targets = grouped_collate([single[0], single[4]])
+            self.assertEqual(images.shape, (2, 3, 4, 4))
+            self.assertEqual(targets.tolist(), [0, 1])
+            with self.assertRaises(TypeError):
+                grouped_collate([torchvision.datasets.ImageFolder(root)[0]])
+
+    def test_shared_batch_ring(self):
+        from torchvision import transforms
+        from torchvision.datasets.pack import write_mytar_shards
+
+        preprocess = transforms.Compose([transforms.Resize(6), transforms.CenterCrop(4), transforms.PILToTensor()])
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root, num_images=(('a', 4), ('b', 4)))
+            write_mytar_shards(root, packed, group_size=2)
+            dataset = torchvision.datasets.ImageFolder(root, transform=preprocess)
+            expected = list(torch.utils.data.DataLoader(dataset, batch_size=3))
+
+            for num_workers in (0, 2):
+                ring = torchvision.datasets.SharedBatchRing(3, (3, 4, 4), num_workers=num_workers, slots_per_worker=2)
+                loader = torch.utils.data.DataLoader(dataset, batch_size=3, num_workers=num_workers,
+                                                     collate_fn=ring.collate)
+                for epoch in range(2):
+                    batches = [(images.clone(), targets.clone()) for images, targets in ring.batches(loader)]
+                    self.assertEqual(len(batches), len(expected))
+                    for (images, targets), (expected_images, expected_targets) in zip(batches, expected):
+                        self.assertTrue(torch.equal(images, expected_images))
+                        self.assertTrue(torch.equal(targets, expected_targets))
+
+            # groups are flattened into the batch
+            grouped = torchvision.datasets.ImageFolder(packed, transform=preprocess, is_mytar=True, group_size=2)
+            ring = torchvision.datasets.SharedBatchRing(4, (3, 4, 4), dtype=torch.float)
+            loader = torch.utils.data.DataLoader(grouped, batch_size=2, collate_fn=ring.collate)
+            images, targets = next(iter(ring.batches(loader)))
+            self.assertEqual(images.shape, (4, 3, 4, 4))
+            self.assertEqual(images.dtype, torch.float)
+            for i in range(2):
+                group_images, group_targets = grouped[i]
+                self.assertTrue(torch.equal(images[2 * i:2 * i + 2], torch.stack(group_images).float()))
+                self.assertEqual(targets[2 * i:2 * i + 2].tolist(), list(group_targets))
+
+            ring = torchvision.datasets.SharedBatchRing(3, (3, 2, 2))
+            with self.assertRaises(ValueError):
+                ring.collate([dataset[0]])
+
+    def test_grouped_decode_threads(self):
+        import tarfile
+        import zipfile
+        from torchvision.datasets.pack import write_mytar_shards
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed, get_tmp_dir() as archives:
+            make_image_tree(root, num_images=(('a', 4), ('b', 4)))
+            write_mytar_shards(root, packed, group_size=4)
+            for cls in ('a', 'b'):
+                os.makedirs(os.path.join(archives, cls))
+                names = sorted(os.listdir(os.path.join(root, cls)))
+                with tarfile.open(os.path.join(archives, cls, 'group.tar'), 'w') as archive:
+                    for name in names:
+                        archive.add(os.path.join(root, cls, name), arcname=name)
+                with zipfile.ZipFile(os.path.join(archives, cls, 'group.zip'), 'w') as archive:
+                    for name in names:
+                        archive.write(os.path.join(root, cls, name), arcname=name)
+
+            kwargs = [
+                (packed, dict(is_mytar=True, group_size=4)),
+                (packed, dict(is_mytar=True, group_size=4, read_group_size=2)),
+                (archives, dict(is_tar=True, is_valid_file=lambda x: x.endswith('.tar'))),
+                (archives, dict(is_zip=True, is_valid_file=lambda x: x.endswith('.zip'))),
+            ]
+            for path, kw in kwargs:
+                serial = torchvision.datasets.ImageFolder(path, **kw)
+                threaded = torchvision.datasets.ImageFolder(path, decode_threads=3, **kw)
+                for i in range(len(serial)):
+                    (images, targets), (threaded_images, threaded_targets) = serial[i], threaded[i]
+                    self.assertEqual(targets, threaded_targets)
+                    self.assertEqual([img.size for img in images], [img.size for img in threaded_images])
+                    self.assertTrue(all(img.mode == 'RGB' for img in threaded_images))
+
+    def test_async_prefetch_loader(self):
+        from torchvision.datasets.pack import write_mytar_shards
+
+        def transform(img):
+            return np.array(img.resize((4, 4)))
+
+        with get_tmp_dir() as root, get_tmp_dir() as packed:
+            make_image_tree(root)
+            write_mytar_shards(root, packed, group_size=3)
+            for path, kwargs in ((root, {}), (packed, dict(is_mytar=True, group_size=3, per_sample=True))):
+                dataset = torchvision.datasets.ImageFolder(path, transform=transform, **kwargs)
+                loader = torchvision.datasets.AsyncPrefetchLoader(dataset, batch_size=3, shuffle=True,
+                                                                  num_inflight=2, prefetch_batches=2)
+                self.assertEqual(len(loader), 3)
+                batches = list(loader)
+                self.assertEqual([len(targets) for _, targets in batches], [3, 3, 1])
+                self.assertEqual(tuple(batches[0][0].shape), (3, 4, 4, 3))
+                self.assertEqual(sorted(t for _, targets in batches for t in targets.tolist()),
+                                 sorted(dataset.targets))
+
+                loader.set_epoch(1)
+                self.assertEqual(sum(len(targets) for _, targets in loader), 7)
+
+                # an iterator abandoned early stops its producer, whose pending batches finish cleanly
+                import asyncio
+                import gc
+                loader = torchvision.datasets.AsyncPrefetchLoader(dataset, batch_size=1, num_inflight=1,
+                                                                  prefetch_batches=3)
+                with mock.patch.object(asyncio.log.logger, 'error') as log_error:
+                    it = iter(loader)
+                    next(it)
+                    del it
+                    gc.collect()
+                self.assertFalse(log_error.called)
+
     @mock.patch('torchvision.datasets.mnist.download_and_extract_archive')
     def test_mnist(self, mock_download_extract):
         num_examples = 30
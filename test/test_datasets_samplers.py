@@ -3,11 +3,15 @@ import sys
 import os
 import torch
 import unittest
+from unittest import mock
 
 from torchvision import io
 from torchvision.datasets.samplers import (
     DistributedSampler,
+    GroupShuffleSampler,
+    DistributedGroupSampler,
     RandomClipSampler,
+    ReadaheadSampler,
     UniformClipSampler,
 )
 from torchvision.datasets.video_utils import VideoClips, unfold
@@ -113,5 +117,130 @@ class Tester(unittest.TestCase):
             self.assertTrue(indices.equal(torch.tensor([5, 7, 9, 0, 2, 4])))
 
 
+class GroupSamplerTester(unittest.TestCase):
+    def test_group_shuffle_sampler(self):
+        group_offsets = [0, 3, 6, 9, 10]
+        sampler = GroupShuffleSampler(range(10), buffer_groups=2, group_offsets=group_offsets)
+        self.assertEqual(len(sampler), 10)
+        indices = list(iter(sampler))
+        self.assertEqual(sorted(indices), list(range(10)))
+        # the first buffer only holds the samples of two groups
+        groups = [sum(i >= o for o in group_offsets[1:]) for i in indices]
+        self.assertEqual(len(set(groups[:6])), 2)
+        self.assertEqual(sampler.last_epoch_stats["samples"], 10)
+        self.assertGreaterEqual(sampler.last_epoch_stats["group_switches"], 4)
+        self.assertEqual(sampler.io_requests_per_sample, sampler.last_epoch_stats["group_switches"] / 10)
+
+        # deterministic for a given epoch
+        self.assertEqual(indices, list(iter(sampler)))
+        sampler.set_epoch(1)
+        self.assertEqual(sorted(iter(sampler)), list(range(10)))
+
+        sampler = GroupShuffleSampler(range(10), shuffle=False, group_offsets=group_offsets)
+        self.assertEqual(list(iter(sampler)), list(range(10)))
+        self.assertEqual(sampler.last_epoch_stats["group_switches"], 4)
+
+    def test_distributed_group_sampler(self):
+        # 8 groups of 4 samples, the first two hold as many bytes as the other six
+        group_offsets = list(range(0, 33, 4))
+        group_bytes = [30, 30, 10, 10, 10, 10, 10, 10]
+        samplers = [DistributedGroupSampler(range(32), num_replicas=2, rank=rank, buffer_groups=2,
+                                            group_offsets=group_offsets, group_bytes=group_bytes)
+                    for rank in range(2)]
+        for epoch in range(3):
+            groups = []
+            for sampler in samplers:
+                sampler.set_epoch(epoch)
+                indices = list(sampler)
+                self.assertEqual(len(indices), len(sampler))
+                groups.append(set(i // 4 for i in indices))
+                # padded with samples of its own groups
+                self.assertEqual(set(sampler.rank_groups[sampler.rank]), groups[-1])
+            self.assertEqual(len(samplers[0]), len(samplers[1]))
+            # whole groups, every group on one rank, ranks within one group of equal bytes
+            self.assertEqual(groups[0] & groups[1], set())
+            self.assertEqual(groups[0] | groups[1], set(range(8)))
+            rank_bytes = [sum(group_bytes[i] for i in g) for g in groups]
+            self.assertLessEqual(abs(rank_bytes[0] - rank_bytes[1]), 30)
+        # groups are reassigned every epoch
+        assignments = set()
+        for epoch in range(5):
+            samplers[0].set_epoch(epoch)
+            assignments.add(tuple(sorted(samplers[0].rank_groups[0])))
+        self.assertGreater(len(assignments), 1)
+
+        sampler = DistributedGroupSampler(range(10), num_replicas=2, rank=1, shuffle=False,
+                                          group_offsets=[0, 3, 6, 9, 10])
+        self.assertEqual(sampler.rank_groups, [[0, 1], [2, 3]])
+        self.assertEqual(list(sampler), [6, 7, 8, 9, 6, 7])
+        with self.assertRaises(ValueError):
+            DistributedGroupSampler(range(10), num_replicas=5, rank=0, group_offsets=[0, 3, 6, 9, 10])
+        with self.assertRaises(ValueError):
+            DistributedGroupSampler(range(3), num_replicas=3, rank=0, group_offsets=[0, 0, 3, 3, 3])
+
+        # empty and very uneven groups: every rank gets samples of its own groups, as many as the others
+        g = torch.Generator()
+        g.manual_seed(0)
+        for trial in range(20):
+            counts = torch.randint(0, 4, (12,), generator=g) * torch.randint(0, 2, (12,), generator=g)
+            counts[trial % 12] = 40
+            counts[(trial + 1) % 12] = max(1, int(counts[(trial + 1) % 12]))
+            num_replicas = 2 + trial % 3
+            if int((counts > 0).sum()) < num_replicas:
+                continue
+            group_offsets = [0] + torch.cumsum(counts, 0).tolist()
+            group_bytes = (counts * torch.randint(1, 100, (12,), generator=g)).tolist()
+            samplers = [DistributedGroupSampler(range(group_offsets[-1]), num_replicas=num_replicas, rank=rank,
+                                                seed=trial, group_offsets=group_offsets, group_bytes=group_bytes)
+                        for rank in range(num_replicas)]
+            seen = set()
+            for sampler in samplers:
+                indices = list(sampler)
+                self.assertGreater(len(indices), 0)
+                self.assertEqual(len(indices), len(samplers[0]))
+                groups = set(sum(i >= o for o in group_offsets[1:]) for i in indices)
+                self.assertEqual(groups, set(sampler.rank_groups[sampler.rank]))
+                seen |= set(indices)
+            self.assertEqual(seen, set(range(group_offsets[-1])))
+
+    def test_readahead_sampler(self):
+        from torchvision.datasets.samplers import readahead
+
+        # two samples per file, the second one of "c" is the whole file
+        ranges = [("a", 0, 10), ("a", 10, 10), ("b", 0, 5), ("b", 20, 5), ("c", 0, 8), ("c", 0, 0)]
+
+        def locate(index):
+            return ranges[index]
+
+        order = [2, 0, 3, 1, 4, 5]
+        sampler = ReadaheadSampler(order, locate, lookahead=1)
+        self.assertEqual(len(sampler), 6)
+        self.assertEqual(list(sampler), order)
+
+        # walks the whole epoch as if every index had been returned already
+        progress = readahead._Progress()
+        progress.position = len(order)
+        sampler = ReadaheadSampler(order, locate, lookahead=1, drop_behind=0)
+        with mock.patch.object(readahead, '_willneed') as willneed, \
+                mock.patch.object(readahead, '_dontneed') as dontneed:
+            sampler._run(order, progress)
+        hints = [("b", 0, 5), ("a", 0, 10), ("b", 20, 5), ("a", 10, 10), ("c", 0, 8), ("c", 0, 0)]
+        self.assertEqual([c[0] for c in willneed.call_args_list], hints)
+        # every file is dropped as soon as no index ahead reads it
+        self.assertEqual([c[0] for c in dontneed.call_args_list], hints)
+
+        # the hints of a file are merged while it is ahead
+        hinted = {}
+        with mock.patch.object(readahead, '_willneed') as willneed:
+            for hint in [("a", 0, 10), ("a", 2, 5), ("a", 10, 10), ("c", 0, 8), ("c", 0, 0), ("c", 4, 4)]:
+                readahead._hint(hinted, *hint)
+        self.assertEqual([c[0] for c in willneed.call_args_list],
+                         [("a", 0, 10), ("a", 10, 10), ("c", 0, 8), ("c", 0, 0)])
+        self.assertEqual(hinted, {"a": (0, 20), "c": (0, None)})
+
+        with self.assertRaises(ValueError):
+            ReadaheadSampler(order, locate, lookahead=0)
+
+
 if __name__ == '__main__':
     unittest.main()
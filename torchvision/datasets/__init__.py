@@ -1,5 +1,9 @@
 from .lsun import LSUN, LSUNClass
 from .folder import ImageFolder, DatasetFolder
+from .async_loader import AsyncPrefetchLoader
+from .profiling import LoaderProfiler
+from .preprocessed import PreprocessedTensorDataset
+from .batch_ring import SharedBatchRing
 from .coco import CocoCaptions, CocoDetection
 from .cifar import CIFAR10, CIFAR100
 from .stl10 import STL10
@@ -26,7 +30,9 @@ from .ucf101 import UCF101
 from .places365 import Places365
 
 __all__ = ('LSUN', 'LSUNClass',
-           'ImageFolder', 'DatasetFolder', 'FakeData',
+           'ImageFolder', 'DatasetFolder', 'AsyncPrefetchLoader', 'LoaderProfiler', 'PreprocessedTensorDataset',
+           'SharedBatchRing',
+           'FakeData',
            'CocoCaptions', 'CocoDetection',
            'CIFAR10', 'CIFAR100', 'EMNIST', 'FashionMNIST', 'QMNIST',
            'MNIST', 'KMNIST', 'STL10', 'SVHN', 'PhotoTour', 'SEMEION',
@@ -0,0 +1,224 @@
+import os
+import struct
+import tarfile
+import zipfile
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .scan_cache import _join, _split
+
+
+_VERSION = 1
+SIDECAR_SUFFIX = ".idx.npz"
+# compression method of the members that are read with zipfile (e.g. encrypted ones)
+METHOD_ZIPFILE = -1
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+_ZIP_LOCAL_MAGIC = b'PK\x03\x04'
+
+
+class ArchiveIndex(object):
+    """Location of the members of an archive: name, offset of the data in the archive file and size.
+
+    Members are listed in archive order. A member is read with a single ``pread`` of
+    ``(offsets[i], sizes[i])``, without parsing any header of the archive, and turned into its
+    content by :meth:`extract` (which only decompresses compressed zip members).
+
+    Args:
+        names (list): Member names.
+        offsets (np.ndarray): ``int64`` offset of the data of every member in the archive file.
+        sizes (np.ndarray): ``int64`` size of the data of every member, compressed size for zip members.
+        methods (np.ndarray, optional): ``int16`` zip compression method of every member, or
+            ``METHOD_ZIPFILE``. Default: None, the data of all members is stored as is.
+    """
+
+    def __init__(self, names: List[str], offsets: np.ndarray, sizes: np.ndarray,
+                 methods: Optional[np.ndarray] = None) -> None:
+        self.names = names
+        self.offsets = offsets
+        self.sizes = sizes
+        if methods is not None and not (methods != zipfile.ZIP_STORED).any():
+            methods = None
+        self.methods = methods
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def ranges(self) -> List[Tuple[int, int]]:
+        """(offset, size) of every member, in archive order."""
+        return list(zip(self.offsets.tolist(), self.sizes.tolist()))
+
+    @property
+    def span(self) -> Tuple[int, int]:
+        """(offset, size) of the smallest byte range holding the data of all members."""
+        if len(self) == 0:
+            return 0, 0
+        start = int(self.offsets.min())
+        return start, int((self.offsets + self.sizes).max()) - start
+
+    def extract(self, member: int, data: Any, path: str) -> Any:
+        """Content of ``member`` given ``data``, the ``sizes[member]`` bytes at ``offsets[member]`` of
+        the archive at ``path``. Stored members are returned as is."""
+        if self.methods is None:
+            return data
+        method = int(self.methods[member])
+        if method == zipfile.ZIP_STORED:
+            return data
+        if method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -15)
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(self.names[member])
+
+
+def build_tar_index(path: str) -> ArchiveIndex:
+    """Parses the headers of an uncompressed tar archive and indexes its regular files.
+
+    Raises:
+        tarfile.ReadError: if the archive is compressed, its members cannot be read in place.
+        ValueError: if the archive holds sparse files, whose data is not contiguous.
+    """
+    names = []
+    ranges = []
+    with tarfile.open(path, 'r:') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if member.issparse():
+                raise ValueError("{}: sparse member {} cannot be indexed".format(path, member.name))
+            names.append(member.name)
+            ranges.append((member.offset_data, member.size))
+    offsets = np.array([offset for offset, _ in ranges], dtype=np.int64)
+    sizes = np.array([size for _, size in ranges], dtype=np.int64)
+    return ArchiveIndex(names, offsets, sizes)
+
+
+def build_zip_index(path: str) -> ArchiveIndex:
+    """Parses the central directory of a zip archive and indexes the data of its files.
+
+    The data of a member starts after its local header, whose variable-length fields may differ
+    from the central directory, so every local header is read once here.
+    """
+    names = []
+    ranges = []
+    methods = []
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            header = os.pread(f.fileno(), _ZIP_LOCAL_HEADER.size, info.header_offset)
+            if len(header) != _ZIP_LOCAL_HEADER.size:
+                raise zipfile.BadZipFile("{}: truncated local header of {}".format(path, info.filename))
+            magic, name_size, extra_size = _ZIP_LOCAL_HEADER.unpack(header)
+            if magic != _ZIP_LOCAL_MAGIC:
+                raise zipfile.BadZipFile("{}: bad local header of {}".format(path, info.filename))
+            names.append(info.filename)
+            offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_size + extra_size
+            ranges.append((offset, info.compress_size))
+            # encrypted members are left to zipfile
+            methods.append(METHOD_ZIPFILE if info.flag_bits & 0x1 else info.compress_type)
+    offsets = np.array([offset for offset, _ in ranges], dtype=np.int64)
+    sizes = np.array([size for _, size in ranges], dtype=np.int64)
+    return ArchiveIndex(names, offsets, sizes, np.array(methods, dtype=np.int16))
+
+
+def _load_sidecar(path: str, stat: os.stat_result) -> Any:
+    try:
+        with np.load(path + SIDECAR_SUFFIX) as index:
+            if int(index['version']) != _VERSION or int(index['archive_size']) != stat.st_size \
+                    or int(index['archive_mtime']) != stat.st_mtime_ns:
+                return None
+            methods = index['methods'] if 'methods' in index.files else None
+            return ArchiveIndex(_split(index['names']), index['offsets'], index['sizes'], methods)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save_sidecar(path: str, stat: os.stat_result, index: ArchiveIndex) -> None:
+    sidecar = path + SIDECAR_SUFFIX
+    tmp_path = "{}.{}.tmp".format(sidecar, os.getpid())
+    arrays = {
+        'version': np.array(_VERSION),
+        'archive_size': np.array(stat.st_size, dtype=np.int64),
+        'archive_mtime': np.array(stat.st_mtime_ns, dtype=np.int64),
+        'names': _join(index.names),
+        'offsets': index.offsets,
+        'sizes': index.sizes,
+    }
+    if index.methods is not None:
+        arrays['methods'] = index.methods
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, sidecar)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _load_index(path: str, build: Callable[[str], ArchiveIndex], sidecar: bool) -> ArchiveIndex:
+    if not sidecar:
+        return build(path)
+    stat = os.stat(path)
+    index = _load_sidecar(path, stat)
+    if index is None:
+        index = build(path)
+        _save_sidecar(path, stat, index)
+    return index
+
+
+def load_tar_index(path: str, sidecar: bool = True) -> ArchiveIndex:
+    """Index of the regular files of a tar archive, see :func:`build_tar_index`.
+
+    With ``sidecar``, the index is read from ``<path>.idx.npz`` when that file describes the current
+    archive (same size and modification time), otherwise the headers are parsed and the index is
+    saved there for the next reader. Errors while saving are ignored, e.g. on a read-only file system.
+    """
+    return _load_index(path, build_tar_index, sidecar)
+
+
+def load_zip_index(path: str, sidecar: bool = True) -> ArchiveIndex:
+    """Index of the files of a zip archive, see :func:`build_zip_index`. ``sidecar`` is used as by
+    :func:`load_tar_index`."""
+    return _load_index(path, build_zip_index, sidecar)
+
+
+class ArchiveIndexCache(object):
+    """Keeps the indexes of the most recently read archives of a process in memory.
+
+    Args:
+        load (callable): Function returning the :class:`ArchiveIndex` of an archive path.
+        max_entries (int): Number of indexes kept; the least recently used one is dropped beyond.
+    """
+
+    def __init__(self, load: Callable[[str], ArchiveIndex], max_entries: int = 4096) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries should be a positive integer, got {}".format(max_entries))
+        self.load = load
+        self.max_entries = max_entries
+        self._indexes: "OrderedDict[str, ArchiveIndex]" = OrderedDict()
+
+    def get(self, path: str) -> ArchiveIndex:
+        index = self._indexes.get(path)
+        if index is not None:
+            self._indexes.move_to_end(path)
+            return index
+        index = self.load(path)
+        self._indexes[path] = index
+        if len(self._indexes) > self.max_entries:
+            self._indexes.popitem(last=False)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'load': self.load, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
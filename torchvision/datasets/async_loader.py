@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from torch.utils.data._utils.collate import default_collate
+
+
+_DONE = object()
+# interval at which a producer blocked on a full queue checks whether the consumer went away
+_PUT_INTERVAL = 0.1
+
+
+class _Failure(object):
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+def _put(out: "queue.Queue[Any]", item: Any, stop: threading.Event) -> bool:
+    # blocks while the queue is full, gives up once the consumer has stopped
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=_PUT_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class AsyncPrefetchLoader(IterableDataset):
+    """Loads batches of a :class:`~torchvision.datasets.DatasetFolder` with an asyncio event loop.
+
+    The event loop keeps up to ``num_inflight`` reads in flight with ``aiofiles``
+    (:meth:`~torchvision.datasets.DatasetFolder.async_read_item`) and hands decoding and transforms
+    (:meth:`~torchvision.datasets.DatasetFolder.decode_item`) to a thread pool, so a worker waiting on
+    high-latency storage keeps decoding what already arrived. At most ``prefetch_batches`` batches
+    are being loaded or waiting to be consumed, which bounds memory when the consumer is slower.
+
+    The loader can be iterated directly, or wrapped in a :class:`~torch.utils.data.DataLoader`
+    with ``batch_size=None`` so that every DataLoader worker runs its own event loop on a disjoint
+    subset of the batches::
+
+        loader = AsyncPrefetchLoader(dataset, batch_size=256, shuffle=True, num_inflight=64)
+        data_loader = torch.utils.data.DataLoader(loader, batch_size=None, num_workers=4, pin_memory=True)
+        for epoch in range(epochs):
+            loader.set_epoch(epoch)
+            for images, targets in data_loader:
+                ...
+
+    Since every worker draws the sample order itself, ``sampler`` must yield the same order in every
+    worker, e.g. a :class:`~torchvision.datasets.samplers.GroupShuffleSampler` or a
+    :class:`~torch.utils.data.distributed.DistributedSampler`, not a ``RandomSampler``.
+
+    Args:
+        dataset (DatasetFolder): dataset to load from.
+        batch_size (int): number of samples per batch.
+        sampler (iterable, optional): order of the sample indices. Defaults to index order, or to a
+            permutation seeded by ``seed`` and the epoch if ``shuffle`` is True.
+        shuffle (bool, optional): shuffle the samples when no ``sampler`` is given. Default: False.
+        seed (int, optional): seed of the shuffle. Default: 0.
+        drop_last (bool, optional): drop the last incomplete batch. Default: False.
+        collate_fn (callable, optional): merges a list of samples into a batch. Default: ``default_collate``.
+        num_inflight (int, optional): maximum number of reads in flight per event loop. Default: 16.
+        decode_threads (int, optional): number of threads decoding and transforming samples. Default: 4.
+        prefetch_batches (int, optional): maximum number of batches being loaded or waiting to be
+            consumed. Default: 2.
+    """
+
+    def __init__(
+            self,
+            dataset: Any,
+            batch_size: int,
+            sampler: Optional[Iterable[int]] = None,
+            shuffle: bool = False,
+            seed: int = 0,
+            drop_last: bool = False,
+            collate_fn: Callable[[List[Any]], Any] = default_collate,
+            num_inflight: int = 16,
+            decode_threads: int = 4,
+            prefetch_batches: int = 2,
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError("batch_size should be a positive integer, got {}".format(batch_size))
+        if num_inflight < 1 or prefetch_batches < 1:
+            raise ValueError("num_inflight and prefetch_batches should be positive integers")
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.drop_last = drop_last
+        self.collate_fn = collate_fn
+        self.num_inflight = num_inflight
+        self.decode_threads = decode_threads
+        self.prefetch_batches = prefetch_batches
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)  # type: ignore[union-attr]
+
+    def _indices(self) -> List[int]:
+        if self.sampler is not None:
+            return list(self.sampler)
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            return torch.randperm(len(self.dataset), generator=g).tolist()
+        return list(range(len(self.dataset)))
+
+    def _batches(self) -> List[List[int]]:
+        indices = self._indices()
+        batches = [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            batches = batches[worker_info.id::worker_info.num_workers]
+        return batches
+
+    def __len__(self) -> int:
+        num_samples = len(self.sampler) if self.sampler is not None else len(self.dataset)  # type: ignore[arg-type]
+        if self.drop_last:
+            return num_samples // self.batch_size
+        return (num_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self) -> Iterator[Any]:
+        batches = self._batches()
+        out: "queue.Queue[Any]" = queue.Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._run_loop, args=(batches, out, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = out.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            stop.set()
+            # unblock the producer if it waits on a full queue
+            while thread.is_alive():
+                try:
+                    out.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+    def _run_loop(self, batches: List[List[int]], out: "queue.Queue[Any]", stop: threading.Event) -> None:
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=max(1, self.decode_threads))
+        try:
+            loop.run_until_complete(self._produce(batches, out, stop, executor))
+        except BaseException as e:
+            _put(out, _Failure(e), stop)
+        else:
+            _put(out, _DONE, stop)
+        finally:
+            executor.shutdown(wait=False)
+            if hasattr(loop, 'shutdown_default_executor'):
+                loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+    async def _produce(self, batches: List[List[int]], out: "queue.Queue[Any]", stop: threading.Event,
+                       executor: ThreadPoolExecutor) -> None:
+        loop = asyncio.get_event_loop()
+        inflight = asyncio.Semaphore(self.num_inflight)
+
+        async def load_sample(index: int) -> Any:
+            async with inflight:
+                raw = await self.dataset.async_read_item(index)
+            return await loop.run_in_executor(executor, self.dataset.decode_item, raw)
+
+        async def load_batch(batch: List[int]) -> Any:
+            samples = await asyncio.gather(*[load_sample(index) for index in batch])
+            return await loop.run_in_executor(executor, self.collate_fn, list(samples))
+
+        pending: "collections.deque[asyncio.Future]" = collections.deque()
+        batch_iter = iter(batches)
+        try:
+            while not stop.is_set():
+                # keep the reads of the next batches going while the oldest one completes
+                while len(pending) < self.prefetch_batches:
+                    batch = next(batch_iter, None)
+                    if batch is None:
+                        break
+                    pending.append(asyncio.ensure_future(load_batch(batch)))
+                if len(pending) == 0:
+                    break
+                result = await pending.popleft()
+                # blocks while the consumer is prefetch_batches behind
+                if not await loop.run_in_executor(None, _put, out, result, stop):
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+            # the cancelled batches are awaited so that their tasks finish before the loop is closed
+            await asyncio.gather(*pending, return_exceptions=True)
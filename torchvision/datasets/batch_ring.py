@@ -0,0 +1,156 @@
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import torch
+from torch.utils.data import get_worker_info
+
+from .folder import flatten_groups
+
+
+# state of a slot: written by its worker, or holding a batch the main process has not released yet
+_FREE = 0
+_FILLED = 1
+# interval at which a worker polls for a released slot
+_POLL_INTERVAL = 0.0005
+
+
+class SlotRef(NamedTuple):
+    """What a worker sends back for a batch: the slot holding it and its number of samples."""
+    slot: int
+    count: int
+
+
+class SharedBatchRing(object):
+    """Batch slots in shared memory that DataLoader workers collate into, in place of pickled batches.
+
+    A DataLoader worker normally sends its batch to the main process by moving every tensor to a new
+    shared memory segment and pickling the batch, and a grouped dataset sends Python lists of
+    images. With a ring, the images and targets of a batch are written by :meth:`collate` straight
+    into a slot preallocated before the workers start, and only a :class:`SlotRef` (two integers) is
+    pickled. :meth:`batches` turns these references back into tensors::
+
+        ring = SharedBatchRing(256, (3, 224, 224), dtype=torch.uint8, num_workers=8)
+        loader = DataLoader(dataset, batch_size=256, num_workers=8, collate_fn=ring.collate)
+        for images, targets in ring.batches(loader):
+            ...
+
+    The samples have to be tensors of shape ``sample_shape`` (they are cast to ``dtype``). Items of
+    the grouped formats, ``(images, target)`` with a list of images, are flattened into the batch,
+    so a slot has to hold ``batch_size`` times the images of a group for them.
+
+    Every worker owns ``slots_per_worker`` slots. A batch is valid until the next one is requested
+    from :meth:`batches`, its slot is then handed back to the worker; tensors kept longer have to
+    be cloned. A worker whose slots all hold batches waits for one to be released, which bounds its
+    prefetching to ``slots_per_worker`` batches. The ring takes
+    ``max(1, num_workers) * slots_per_worker * batch_size`` samples of shared memory.
+
+    Args:
+        batch_size (int): Maximum number of samples of a batch.
+        sample_shape (sequence): Shape of every sample, e.g. ``(3, 224, 224)``.
+        dtype (torch.dtype): Type of the samples in the slots, e.g. ``torch.uint8`` for images
+            normalized on the GPU, or ``torch.float``. Default: ``torch.uint8``.
+        num_workers (int): Number of DataLoader workers, 0 to collate in the main process.
+        slots_per_worker (int): Batches a worker can have in flight, at least the ``prefetch_factor``
+            of the DataLoader plus one to keep all of them busy. Default: 3.
+        timeout (float): Seconds a worker waits for a free slot before failing. Default: 300.
+    """
+
+    def __init__(
+            self,
+            batch_size: int,
+            sample_shape: Sequence[int],
+            dtype: torch.dtype = torch.uint8,
+            num_workers: int = 0,
+            slots_per_worker: int = 3,
+            timeout: float = 300.0,
+    ) -> None:
+        if batch_size < 1 or slots_per_worker < 1:
+            raise ValueError("batch_size and slots_per_worker should be positive integers, got {} and {}".format(
+                batch_size, slots_per_worker))
+        self.batch_size = batch_size
+        self.sample_shape = tuple(sample_shape)
+        self.num_workers = num_workers
+        self.slots_per_worker = slots_per_worker
+        self.timeout = timeout
+        num_slots = max(1, num_workers) * slots_per_worker
+        self.images = torch.empty((num_slots, batch_size) + self.sample_shape, dtype=dtype).share_memory_()
+        self.targets = torch.empty(num_slots, batch_size, dtype=torch.int64).share_memory_()
+        self._states = torch.zeros(num_slots, dtype=torch.uint8).share_memory_()
+        self._pid: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _worker_slots(self) -> None:
+        # slots of this process, recomputed after fork or spawn
+        worker_info = get_worker_info()
+        worker = 0 if worker_info is None else worker_info.id % max(1, self.num_workers)
+        self._first = worker * self.slots_per_worker
+        self._next = 0
+        self._pid = os.getpid()
+
+    def _acquire(self) -> int:
+        if self._pid != os.getpid():
+            self._worker_slots()
+        states = self._states.numpy()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            # the slots are tried in turn, the oldest batch is the likeliest to have been released
+            for i in range(self.slots_per_worker):
+                slot = self._first + (self._next + i) % self.slots_per_worker
+                if states[slot] == _FREE:
+                    self._next = (slot - self._first + 1) % self.slots_per_worker
+                    return slot
+            if time.monotonic() > deadline:
+                raise RuntimeError("No batch slot was released for {} seconds, batches should be read "
+                                   "with SharedBatchRing.batches".format(self.timeout))
+            time.sleep(_POLL_INTERVAL)
+
+    def collate(self, batch: List[Any]) -> SlotRef:
+        """``collate_fn`` of the DataLoader: writes ``batch`` into a free slot of the calling worker."""
+        slot = self._acquire()
+        images = self.images[slot]
+        targets = self.targets[slot]
+        count = 0
+        for image, target in flatten_groups(batch):
+            if count == self.batch_size:
+                raise ValueError("The batch does not fit in a slot of {} samples".format(self.batch_size))
+            if tuple(image.shape) != self.sample_shape:
+                raise ValueError("Samples should have the shape {}, got {}".format(
+                    self.sample_shape, tuple(image.shape)))
+            images[count].copy_(image)
+            targets[count] = int(target)
+            count += 1
+        self._states[slot] = _FILLED
+        return SlotRef(slot, count)
+
+    def get(self, ref: SlotRef) -> Tuple[torch.Tensor, torch.Tensor]:
+        """``(images, targets)`` of the batch of ``ref``, views of its slot."""
+        return self.images[ref.slot, :ref.count], self.targets[ref.slot, :ref.count]
+
+    def release(self, ref: SlotRef) -> None:
+        """Hands the slot of ``ref`` back to its worker."""
+        self._states[ref.slot] = _FREE
+
+    def batches(self, refs: Iterable[SlotRef]) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        """Iterates over the batches of a DataLoader collating with :meth:`collate`, releasing the slot
+        of every batch when the next one is requested."""
+        # slots left filled by an interrupted iteration
+        self._states.zero_()
+        previous = None
+        refs = iter(refs)
+        while True:
+            if previous is not None:
+                self.release(previous)
+                previous = None
+            ref = next(refs, None)
+            if ref is None:
+                return
+            previous = ref
+            yield self.get(ref)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state['_pid'] = None
+        return state
@@ -1,16 +1,28 @@
 import aiofiles
 import asyncio
-import io
+import functools
+import itertools
+import math
 
-from zipfile import ZipFile
 import tarfile
 import pickle
 from .vision import VisionDataset
-
+from .archive_index import ArchiveIndex, ArchiveIndexCache, load_tar_index, load_zip_index
+from .imgpack import load_imgpack_index
+from .mytar import load_mytar_index
+from .shards import MemoryViewReader, ShardCache
+from .profiling import LoaderProfiler, NO_TIMING
+from .sample_list import CompactSamples
+from .scan_cache import load_scan_index, save_scan_index, scan_cache_path
+from .shm_cache import SharedBytesCache
+
+import numpy as np
+import torch
 from PIL import Image
 
 import os
 import os.path
+from concurrent.futures import Executor, ThreadPoolExecutor
 from typing import Any, Callable, cast, Dict, List, Optional, Tuple
 import time
 
@@ -45,6 +57,7 @@ def make_dataset(
     class_to_idx: Dict[str, int],
     extensions: Optional[Tuple[str, ...]] = None,
     is_valid_file: Optional[Callable[[str], bool]] = None,
+    num_workers: int = 0,
 ) -> List[Tuple[str, int]]:
     """Generates a list of samples of a form (path_to_sample, class).
 
@@ -57,6 +70,10 @@ def make_dataset(
             and checks if the file is a valid file
             (used to check of corrupt files) both extensions and
             is_valid_file should not be passed. Defaults to None.
+        num_workers (int, optional): Number of threads listing the class directories
+            concurrently, which hides the latency of network file systems. ``is_valid_file``
+            is then called from these threads. The samples are the same, in the same order.
+            Defaults to 0, the directories are listed one after the other.
 
     Raises:
         ValueError: In case ``extensions`` and ``is_valid_file`` are None or both are not None.
@@ -64,7 +81,6 @@ def make_dataset(
     Returns:
         List[Tuple[str, int]]: samples of a form (path_to_sample, class)
     """
-    instances = []
     directory = os.path.expanduser(directory)
     both_none = extensions is None and is_valid_file is None
     both_something = extensions is not None and is_valid_file is not None
@@ -74,17 +90,104 @@ def make_dataset(
         def is_valid_file(x: str) -> bool:
             return has_file_allowed_extension(x, cast(Tuple[str, ...], extensions))
     is_valid_file = cast(Callable[[str], bool], is_valid_file)
+    return _scan_class_dirs(directory, class_to_idx, is_valid_file, num_workers=num_workers)[0]
+
+
+def _walk_class_dir(
+    target_dir: str,
+    class_index: int,
+    is_valid_file: Callable[[str], bool],
+    with_mtimes: bool,
+) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+    # lists the same files in the same order as sorted(os.walk(target_dir, followlinks=True)): the
+    # types of the entries come from the directory listings, only symlinks cost a stat
+    listed = []
+    pending = [target_dir]
+    while pending:
+        root = pending.pop()
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            # os.walk skips the directories it cannot list
+            continue
+        fnames = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                pending.append(entry.path)
+            else:
+                fnames.append(entry.name)
+        listed.append((root, fnames))
+    listed.sort(key=lambda x: x[0])
+
+    instances = []
+    dirs = []
+    for root, fnames in listed:
+        if with_mtimes:
+            dirs.append((root, os.stat(root).st_mtime_ns))
+        for fname in sorted(fnames):
+            path = os.path.join(root, fname)
+            if is_valid_file(path):
+                instances.append((path, class_index))
+    return instances, dirs
+
+
+def _scan_class_dirs(
+    directory: str,
+    class_to_idx: Dict[str, int],
+    is_valid_file: Callable[[str], bool],
+    with_mtimes: bool = False,
+    num_workers: int = 0,
+) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+    # also returns (path, mtime_ns) of every directory listed when with_mtimes is True
+    dirs = [(directory, os.stat(directory).st_mtime_ns)] if with_mtimes else []
+    targets = []
     for target_class in sorted(class_to_idx.keys()):
-        class_index = class_to_idx[target_class]
         target_dir = os.path.join(directory, target_class)
-        if not os.path.isdir(target_dir):
-            continue
-        for root, _, fnames in sorted(os.walk(target_dir, followlinks=True)):
-            for fname in sorted(fnames):
-                path = os.path.join(root, fname)
-                if is_valid_file(path):
-                    item = path, class_index
-                    instances.append(item)
+        if os.path.isdir(target_dir):
+            targets.append((target_dir, class_to_idx[target_class]))
+
+    def scan(target: Tuple[str, int]) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        return _walk_class_dir(target[0], target[1], is_valid_file, with_mtimes)
+
+    if num_workers > 0 and len(targets) > 1:
+        with ThreadPoolExecutor(max_workers=min(num_workers, len(targets))) as pool:
+            results = list(pool.map(scan, targets))
+    else:
+        results = [scan(target) for target in targets]
+
+    instances = [item for class_instances, _ in results for item in class_instances]
+    dirs.extend(d for _, class_dirs in results for d in class_dirs)
+    return instances, dirs
+
+
+def cached_make_dataset(
+    directory: str,
+    class_to_idx: Dict[str, int],
+    extensions: Tuple[str, ...],
+    cache_dir: str,
+    num_workers: int = 0,
+) -> List[Tuple[str, int]]:
+    """Same as :func:`make_dataset` with ``extensions``, but the result is cached in ``cache_dir``.
+
+    The cache of a root directory is reused as long as none of the directories it lists has been
+    modified (their modification times are checked), so building the dataset again (another rank,
+    a restart) costs one ``stat`` per directory instead of a listing of every file. ``num_workers``
+    threads scan the class directories when the cache cannot be used, see :func:`make_dataset`.
+    """
+    directory = os.path.expanduser(directory)
+    path = scan_cache_path(cache_dir, directory, extensions)
+    instances = load_scan_index(path, directory, class_to_idx)
+    if instances is None:
+        scan_time = time.time_ns()
+        instances, dirs = _scan_class_dirs(
+            directory, class_to_idx, lambda x: has_file_allowed_extension(x, extensions),
+            with_mtimes=True, num_workers=num_workers)
+        save_scan_index(path, directory, class_to_idx, instances, dirs, scan_time)
     return instances
 
 
@@ -104,15 +207,18 @@ def get_metadata_mytar(
             class_name = reader.readline().strip()
             classes.append(class_name)
         classes.sort()
-        class_to_idx = {cls_name: i for i, cls_name in enumerate(classes)} 
-        print(class_to_idx)
+        class_to_idx = {cls_name: i for i, cls_name in enumerate(classes)}
         # then get all groups metadata
         while reader:
-            groupname = reader.readline().strip().split(',')[0]
+            header = reader.readline().strip().split(',')
+            groupname = header[0]
             if(groupname == ''):
                 break
+            # groups written by torchvision.datasets.pack record their own size,
+            # so that the last group may be shorter than group_size
+            count = int(header[1]) if len(header) > 1 and header[1] != '' else group_size
             group = []
-            for i in range(group_size):
+            for i in range(count):
                 values = reader.readline().strip().split(',')
                 idx = values[0]
                 img_class = values[1]
@@ -121,10 +227,33 @@ def get_metadata_mytar(
                 img_class_idx = class_to_idx[img_class]
                 group.append({'idx':idx, 'img_class':img_class, 'img_class_idx':img_class_idx, 'start':start, 'img_size':img_size})
             metadata.append({'groupname':groupname, 'metadata':group})
-    print(class_to_idx)
     return metadata
 
 
+class _DecodePool(object):
+    """Thread pool used to decode the images of a group, created by each worker on first use."""
+
+    def __init__(self, num_threads: int = 0) -> None:
+        self.num_threads = num_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+
+    def get(self) -> Optional[ThreadPoolExecutor]:
+        if self.num_threads <= 0:
+            return None
+        if self._executor is None or self._pid != os.getpid():
+            # the threads of a pool do not survive fork
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+            self._pid = os.getpid()
+        return self._executor
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'num_threads': self.num_threads}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
+
+
 class DatasetFolder(VisionDataset):
     """A generic data loader where the samples are arranged in this way: ::
 
@@ -149,14 +278,47 @@ class DatasetFolder(VisionDataset):
         is_valid_file (callable, optional): A function that takes path of a file
             and check if the file is a valid file (used to check of corrupt files)
             both extensions and is_valid_file should not be passed.
+        scan_cache_dir (string, optional): If given, the list of files found in ``root`` is saved in
+            that directory and reused by the next datasets built on ``root`` as long as no directory
+            of ``root`` is modified, see :func:`cached_make_dataset`. Only used with ``extensions``
+            and the default ``make_dataset``.
+        scan_workers (int, optional): Number of threads listing the class directories of ``root``
+            concurrently, see :func:`make_dataset`. Only used with the default ``make_dataset``.
+        compact_samples (bool, optional): If True, ``samples`` is a :class:`CompactSamples` and
+            ``targets`` an ``int32`` numpy array, which forked DataLoader workers share instead of
+            copying. Default: False, Python lists.
 
      Attributes:
         classes (list): List of the class names sorted alphabetically.
         class_to_idx (dict): Dict with items (class_name, class_index).
-        samples (list): List of (sample path, class_index) tuples
+        samples (list): List of (sample path, class_index) tuples, or a :class:`CompactSamples`
+            with ``compact_samples``
         targets (list): The class_index value for each image in the dataset
+        mytar_index (MytarIndex): Index of the groups and images of a mytar dataset. The
+            memory-mapped binary index is used when present, ``metadata.txt`` is parsed otherwise.
+            ``targets`` then holds the class index of every image of the groups, in index order.
     """
 
+    # largest hole between two images of a batch that is read to merge their reads
+    batch_read_max_gap = 64 * 1024
+    # encoded bytes of single-image items shared by the workers, see ImageFolder's cache_bytes
+    bytes_cache: Optional[SharedBytesCache] = None
+    # shorter side JPEGs are allowed to be scaled down to while decoding, see ImageFolder's draft_size
+    draft_size: Optional[int] = None
+    # 'PIL' for PIL images, 'tensor' for CHW uint8 tensors, see ImageFolder's decode_backend
+    decode_backend = 'PIL'
+    # per-stage timings, see ImageFolder's profiler
+    profiler: Optional[LoaderProfiler] = None
+    # member offsets of the tar and zip archives read by this process
+    archive_indexes: Optional[ArchiveIndexCache] = None
+    # per-sample archives: the members of archive a are the samples member_offsets[a] to member_offsets[a + 1] - 1
+    member_offsets: Optional[np.ndarray] = None
+    # items are .imgpack files, whose images are decoded lazily
+    is_imgpack = False
+    # mytar groups read in packs of read_group_size images: the packs of group g are the items
+    # pack_offsets[g] to pack_offsets[g + 1] - 1
+    pack_offsets: Optional[np.ndarray] = None
+
     def __init__(
             self,
             root: str,
@@ -165,15 +327,37 @@ class DatasetFolder(VisionDataset):
             transform: Optional[Callable] = None,
             target_transform: Optional[Callable] = None,
             is_valid_file: Optional[Callable[[str], bool]] = None,
+            scan_cache_dir: Optional[str] = None,
+            scan_workers: int = 0,
+            compact_samples: bool = False,
     ) -> None:
         super(DatasetFolder, self).__init__(root, transform=transform,
                                             target_transform=target_transform)
 
         if hasattr(self, 'is_mytar') and self.is_mytar:
-            self.metadata = get_metadata_mytar(root, self.group_size)
+            self.mytar_index = load_mytar_index(self.root, self.group_size)
+            self.classes = self.mytar_index.classes
+            self.class_to_idx = self.mytar_index.class_to_idx
+            self.targets = self.mytar_index.samples['img_class_idx']
+            if self.per_sample:
+                # built before the workers fork so that they share it
+                self.mytar_index.sample_groups
+            elif self.read_group_size < self.group_size:
+                # the packs of group g are the items pack_offsets[g] to pack_offsets[g + 1] - 1, a short
+                # group (the last one written by pack.py) has fewer of them
+                counts = np.diff(self.mytar_index.group_offsets)
+                self.pack_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+                np.cumsum(-(-counts // self.read_group_size), out=self.pack_offsets[1:])
         else:
             classes, class_to_idx = self._find_classes(self.root)
-            samples = self.make_dataset(self.root, class_to_idx, extensions, is_valid_file)
+            if type(self).make_dataset is not DatasetFolder.make_dataset:
+                samples = self.make_dataset(self.root, class_to_idx, extensions, is_valid_file)
+            elif scan_cache_dir is not None and extensions is not None and is_valid_file is None:
+                samples = cached_make_dataset(self.root, class_to_idx, extensions, scan_cache_dir,
+                                              num_workers=scan_workers)
+            else:
+                samples = make_dataset(self.root, class_to_idx, extensions=extensions,
+                                       is_valid_file=is_valid_file, num_workers=scan_workers)
             if len(samples) == 0:
                 msg = "Found 0 files in subfolders of: {}\n".format(self.root)
                 if extensions is not None:
@@ -181,8 +365,12 @@ class DatasetFolder(VisionDataset):
                 raise RuntimeError(msg)
             self.classes = classes
             self.class_to_idx = class_to_idx
+            if compact_samples:
+                samples = CompactSamples.from_list(samples)
+                self.targets = samples.targets
+            else:
+                self.targets = [s[1] for s in samples]
             self.samples = samples
-            self.targets = [s[1] for s in samples]
         self.loader = loader
         self.extensions = extensions
 
@@ -221,432 +409,584 @@ class DatasetFolder(VisionDataset):
         Returns:
             tuple: (sample, target) where target is class_index of the target class.
         """
-        if self.is_zip:
-            path, target = self.samples[index]
-            end = time.time()
-            samples = zip_loader(path)
-            load_time = time.time() - end
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
-                target = self.target_transform(target)
-            res = samples, target
-            return res
-
-        if self.is_mytar and self.read_group_size < self.group_size:
-            rg_count = int(self.group_size / self.read_group_size)
-            group_index = int(index / rg_count)
-            pack_index = index % rg_count
-            path = self.root + '/' + self.metadata[group_index]['groupname']
-            group_metadata = self.metadata[group_index]['metadata']
-            target = 0
-            end = time.time()
-            samples = mytar_loader_pack(path, group_metadata, self.read_group_size, pack_index)
-            load_time = time.time() - end
-          #  print('load 4 images in a file time:{}'.format(load_time))
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
-                target = self.target_transform(target)
-            res = samples, target
-            return res
+        if isinstance(index, (list, tuple)):
+            return self.__getitems__(index)
+
+        if self.is_mytar and self.per_sample:
+            group_index, img_info = self.mytar_index.locate(index)
+            path = self.root + '/' + self.mytar_index.group_name(group_index)
+            with self._timed('read'):
+                data = self._read_encoded(index, lambda: _read_range(
+                    path, int(img_info['start']), int(img_info['img_size']), self.shard_cache))
+            with self._timed('decode'):
+                sample = _decode_image(data, self.draft_size, self.decode_backend)
+            return self._transform_sample(sample, int(img_info['img_class_idx']))
 
+        if self.is_mytar:
+            path, group_metadata = self._group_slice(index)
+            offset, size = _pack_range(group_metadata, 0, len(group_metadata))
+            with self._timed('read'):
+                data = _read_range(path, offset, size, self.shard_cache)
+            with self._timed('extract'):
+                buffers = _split_pack(data, offset, group_metadata)
+            with self._timed('decode'):
+                samples = _decode_all(buffers, self.decode_pool.get(), self.draft_size, self.decode_backend)
+            return self._transform_group(samples, [int(target) for target in group_metadata['img_class_idx']])
+
+        if self.member_offsets is not None:
+            path, target, members, member = self._locate_member(index)
+            offset, size = int(members.offsets[member]), int(members.sizes[member])
+            with self._timed('read'):
+                data = self._read_encoded(index, lambda: _read_range(path, offset, size, self.shard_cache))
+            if members.methods is not None:
+                with self._timed('extract'):
+                    data = members.extract(member, data, path)
+            with self._timed('decode'):
+                sample = _decode_image(data, self.draft_size, self.decode_backend)
+            return self._transform_sample(sample, target)
 
+        path, target = self.samples[index]
+        if self.archive_indexes is not None:
+            with self._timed('extract'):
+                members = self.archive_indexes.get(path)
+            with self._timed('read'):
+                buffers = self._read_members(path, members)
+            if members.methods is not None:
+                with self._timed('extract'):
+                    buffers = [members.extract(i, data, path) for i, data in enumerate(buffers)]
+            with self._timed('decode'):
+                samples = self._decode_members(buffers, self.decode_pool.get())
+            return self._transform_group(samples, target)
 
-        if self.is_mytar:
-            path = self.root + '/' + self.metadata[index]['groupname']
-            group_metadata = self.metadata[index]['metadata']
-            end = time.time()
-            samples, targets = mytar_loader(path, group_metadata)
-            load_time = time.time() - end
-          #  print('load 4 images in a file time:{}'.format(load_time))
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
-                targets = [self.target_transform(target) for target in targets]
-            res = samples, targets
-            return res
-            
-
-        if self.is_tar:
-            path, target = self.samples[index]
-            end = time.time()
-            samples = tar_loader(path)
-            load_time = time.time() - end
-          #  print('load 4 images in a file time:{}'.format(load_time))
+        if self.is_meng:
+            with self._timed('read'):
+                data = _read_range(path, 0, -1)
+            with self._timed('decode'):
+                samples = pickle.loads(data)
+            return self._transform_group(samples, target)
+
+        # the loader itself is timed as a whole unless the cache needs the bytes apart
+        decode_file = _bytes_loader(self.loader) if self.bytes_cache is not None else None
+        if decode_file is not None:
+            with self._timed('read'):
+                data = self._read_encoded(index, lambda: _read_range(path, 0, -1))
+            with self._timed('decode'):
+                sample = decode_file(data)
+        else:
+            with self._timed('load'):
+                sample = self.loader(path)
+        return self._transform_sample(sample, target)
+
+    def _timed(self, stage: str) -> Any:
+        if self.profiler is None:
+            return NO_TIMING
+        return self.profiler.time(stage)
+
+    def _transform_sample(self, sample: Any, target: Any) -> Tuple[Any, Any]:
+        with self._timed('transform'):
             if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
+                sample = self.transform(sample)
             if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
                 target = self.target_transform(target)
-            res = samples, target
-#            print(res)
-            return res
-            
+        return sample, target
 
-        if self.is_meng:
-            path, target = self.samples[index]
-            end = time.time()
-            samples = meng_loader(path)
-            load_time = time.time() - end
-            print('load 4 images in a file time:{}'.format(load_time))
+    def _decode_members(self, buffers: List[Any], executor: Optional[Executor] = None) -> List[Any]:
+        if self.is_imgpack and self.decode_backend == 'PIL':
+            # decoded by the first transform that reads the pixels
+            return [_open_lazy(buffer, self.draft_size) for buffer in buffers]
+        return _decode_all(buffers, executor, self.draft_size, self.decode_backend)
+
+    def _transform_group(self, samples: List[Any], target: Any) -> Tuple[List[Any], Any]:
+        # grouped formats return a list of samples, and a list of targets for mytar groups
+        with self._timed('transform'):
             if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
+                transformed = []
+                for i in range(len(samples)):
+                    transformed.append(self.transform(samples[i]))
+                    # the decoded image is released before the next one is decoded
+                    samples[i] = None
+                samples = transformed
             if self.target_transform is not None:
-                target = self.target_transform(target)
-            res = samples, target
-#            print(res)
-            return res
-        path, target = self.samples[index]
-        end = time.time()
-        sample = self.loader(path)
-        load_time = time.time() - end
-#        print("load one image time: {}".format(load_time))
-        if self.transform is not None:
-            end = time.time()
-            sample = self.transform(sample)
-            transform_time = time.time() - end
-            # print("    transform one image time: {}".format(transform_time))
-        if self.target_transform is not None:
-            target = self.target_transform(target)
+                if isinstance(target, list):
+                    target = [self.target_transform(t) for t in target]
+                else:
+                    target = self.target_transform(target)
+        return samples, target
+
+    def _locate_member(self, index: int) -> Tuple[str, int, ArchiveIndex, int]:
+        # archive path, class index, archive index and member number of a per-sample archive item
+        if index < 0:
+            index += len(self)
+        archive = int(np.searchsorted(self.member_offsets, index, side='right')) - 1
+        path, target = self.samples[archive]
+        return path, target, self.archive_indexes.get(path), index - int(self.member_offsets[archive])
+
+    def _read_members(self, path: str, members: ArchiveIndex) -> List[memoryview]:
+        # the data of every member, with as few reads as possible; zip members may be out of order
+        ranges = members.ranges
+        order = sorted(range(len(ranges)), key=ranges.__getitem__)
+        views = self.shard_cache.read_ranges(path, [ranges[i] for i in order], self.batch_read_max_gap)
+        buffers: List[memoryview] = [None] * len(ranges)  # type: ignore[list-item]
+        for i, view in zip(order, views):
+            buffers[i] = view
+        return buffers
+
+    def _group_slice(self, index: int) -> Tuple[str, Any]:
+        # path and image records of the group, or of the pack of the group, at `index`
+        if self.pack_offsets is not None:
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("index {} is out of range".format(index))
+            group_index = int(np.searchsorted(self.pack_offsets, index, side='right')) - 1
+            pack_start = (index - int(self.pack_offsets[group_index])) * self.read_group_size
+            pack_size = self.read_group_size
+        else:
+            group_index = index
+            pack_start = 0
+            pack_size = len(self.mytar_index.group(group_index))
+        path = self.root + '/' + self.mytar_index.group_name(group_index)
+        return path, self.mytar_index.group(group_index)[pack_start:pack_start + pack_size]
 
-        return sample, target
+    def __getitems__(self, indices: List[int]) -> List[Tuple[Any, Any]]:
+        """Loads a whole batch of samples.
+
+        For per-sample mytar datasets, the requested images are grouped by group file and
+        neighbouring byte ranges (at most ``batch_read_max_gap`` bytes apart) are fetched with one
+        vectored read, so a batch costs a few large reads instead of one read per image; images
+        found in ``bytes_cache`` are not read at all. Other datasets load their samples one by one.
+
+        ``torch.utils.data.DataLoader`` calls this method for every batch when it is defined (recent
+        PyTorch releases). With older releases, pass a ``BatchSampler`` as ``sampler`` with
+        ``batch_size=None`` and ``collate_fn=default_collate``: ``dataset[list_of_indices]`` is
+        routed here.
+
+        Args:
+            indices (list): Indices of the batch
+
+        Returns:
+            list: (sample, target) for every index, in the order of ``indices``.
+        """
+        if not (getattr(self, 'is_mytar', False) and self.per_sample):
+            return [self[index] for index in indices]
+
+        buffers: Dict[int, Any] = {}
+        missing = []
+        with self._timed('read'):
+            for index in sorted(set(int(index) for index in indices)):
+                data = self.bytes_cache.get(index) if self.bytes_cache is not None else None
+                if data is None:
+                    missing.append(index)
+                else:
+                    buffers[index] = data
+        sample_groups = self.mytar_index.sample_groups[missing]
+        records = self.mytar_index.samples[missing]
+        order = np.lexsort((records['start'], sample_groups))
+        start = 0
+        while start < len(order):
+            group_index = sample_groups[order[start]]
+            stop = start
+            while stop < len(order) and sample_groups[order[stop]] == group_index:
+                stop += 1
+            positions = order[start:stop]
+            path = self.root + '/' + self.mytar_index.group_name(int(group_index))
+            ranges = [(int(records['start'][i]), int(records['img_size'][i])) for i in positions]
+            with self._timed('read'):
+                views = self.shard_cache.read_ranges(path, ranges, max_gap=self.batch_read_max_gap)
+                for i, view in zip(positions, views):
+                    buffers[missing[i]] = view
+                    if self.bytes_cache is not None:
+                        self.bytes_cache.put(missing[i], view)
+            start = stop
+
+        indices = [int(index) for index in indices]
+        with self._timed('decode'):
+            samples = _decode_all([buffers[index] for index in indices], self.decode_pool.get(), self.draft_size,
+                                  self.decode_backend)
+        targets = [int(self.mytar_index.samples['img_class_idx'][index]) for index in indices]
+        return [self._transform_sample(sample, target) for sample, target in zip(samples, targets)]
+
+    @property
+    def group_offsets(self) -> Optional[Any]:
+        """Group boundaries in index space: samples (or packs of ``read_group_size`` images)
+        ``group_offsets[g]`` to ``group_offsets[g + 1] - 1`` come from group file ``g``. None when
+        every index is read on its own."""
+        if getattr(self, 'is_mytar', False) and self.per_sample:
+            return self.mytar_index.group_offsets
+        if self.pack_offsets is not None:
+            return self.pack_offsets
+        return self.member_offsets
+
+    @property
+    def group_bytes(self) -> Optional[np.ndarray]:
+        """``int64`` number of bytes of every group of :attr:`group_offsets`, or of every item when
+        items are whole groups: the encoded images of a mytar group (``img_size`` of the metadata),
+        or the size of an archive. None for image folders and archives read whole."""
+        if getattr(self, 'is_mytar', False):
+            offsets = self.mytar_index.group_offsets
+            sizes = np.zeros(len(self.mytar_index.samples) + 1, dtype=np.int64)
+            np.cumsum(self.mytar_index.samples['img_size'], out=sizes[1:])
+            return sizes[offsets[1:]] - sizes[offsets[:-1]]
+        if self.member_offsets is not None:
+            return np.array([os.path.getsize(path) for path, _ in self.samples], dtype=np.int64)
+        return None
+
+    def byte_range(self, index: int) -> Tuple[str, int, int]:
+        """``(path, offset, size)`` of the bytes read by the item at ``index``, with ``size`` 0 when the
+        whole file is read. Used by :class:`~torchvision.datasets.samplers.ReadaheadSampler`."""
+        is_mytar = getattr(self, 'is_mytar', False)
+        if is_mytar and self.per_sample:
+            group_index, img_info = self.mytar_index.locate(index)
+            return (self.root + '/' + self.mytar_index.group_name(group_index),
+                    int(img_info['start']), int(img_info['img_size']))
+        if is_mytar:
+            path, group_metadata = self._group_slice(index)
+            offset, size = _pack_range(group_metadata, 0, len(group_metadata))
+            return path, offset, size
+        if self.member_offsets is not None:
+            path, _, members, member = self._locate_member(index)
+            return path, int(members.offsets[member]), int(members.sizes[member])
+        return self.samples[index][0], 0, 0
 
     def __len__(self) -> int:
-        # print("!!!!!!!!!!!!!!!calling len for folder")
+        if self.is_mytar and self.per_sample:
+            return self.mytar_index.num_samples
+        if self.member_offsets is not None:
+            return int(self.member_offsets[-1])
+        if self.pack_offsets is not None:
+            return int(self.pack_offsets[-1])
         if self.is_mytar:
-            return len(self.metadata) * int(self.group_size / self.read_group_size)
+            return len(self.mytar_index)
         else:
             return len(self.samples)
 
 
-    async def async_get_item(self, index: int) -> Tuple[Any, Any]:
-        """
+    async def async_read_item(self, index: int) -> Tuple[str, Any, Any]:
+        """Reads the encoded bytes of an item without blocking the event loop.
+
         Args:
             index (int): Index
 
         Returns:
-            tuple: (sample, target) where target is class_index of the target class.
+            tuple: (kind, payload, target) to be passed to :meth:`decode_item`.
         """
-        if self.is_zip:
-            path, target = self.samples[index]
-            end = time.time()
-            samples = zip_loader(path)
-            load_time = time.time() - end
-#            print('load 4 images in a file time:{}'.format(load_time))
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
-                target = self.target_transform(target)
-            res = samples, target
-#            print(res)
-            return res
-            
-        if self.is_mytar and self.read_group_size < self.group_size:
-            rg_count = int(self.group_size / self.read_group_size)
-            group_index = int(index / rg_count)
-            pack_index = index % rg_count
-            path = self.root + '/' + self.metadata[group_index]['groupname']
-            group_metadata = self.metadata[group_index]['metadata']
-            target = 0
-            end = time.time()
-            samples = await async_mytar_loader_pack(path, group_metadata, self.read_group_size, pack_index)
-            load_time = time.time() - end
-          #  print('load 4 images in a file time:{}'.format(load_time))
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
-                target = self.target_transform(target)
-            res = samples, target
-#            print(res)
-            return res
-
+        if self.is_mytar and self.per_sample:
+            group_index, img_info = self.mytar_index.locate(index)
+            path = self.root + '/' + self.mytar_index.group_name(group_index)
+            with self._timed('read'):
+                data = await self._async_read_encoded(index, path, int(img_info['start']), int(img_info['img_size']))
+            return 'image', data, int(img_info['img_class_idx'])
 
         if self.is_mytar:
-            path = self.root + '/' + self.metadata[index]['groupname']
-            group_metadata = self.metadata[index]['metadata']
-            target = 0
-            end = time.time()
-            samples = await async_mytar_loader(path, group_metadata)
-            load_time = time.time() - end
-          #  print('load 4 images in a file time:{}'.format(load_time))
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
-                target = self.target_transform(target)
-            res = samples, target
-#            print(res)
-            return res
+            path, group_metadata = self._group_slice(index)
+            offset, size = _pack_range(group_metadata, 0, len(group_metadata))
+            with self._timed('read'):
+                data = await _async_read(path, offset, size)
+            return 'group', _split_pack(data, offset, group_metadata), \
+                [int(target) for target in group_metadata['img_class_idx']]
+
+        if self.member_offsets is not None:
+            path, target, members, member = self._locate_member(index)
+            with self._timed('read'):
+                data = await self._async_read_encoded(index, path, int(members.offsets[member]),
+                                                      int(members.sizes[member]))
+            if members.methods is not None:
+                with self._timed('extract'):
+                    data = members.extract(member, data, path)
+            return 'image', data, target
 
-
-        if self.is_tar:
-            path, target = self.samples[index]
-            end = time.time()
-            samples = await async_tar_loader(path)
-            load_time = time.time() - end
-          #  print('load 4 images in a file time:{}'.format(load_time))
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                print("\n\nself.target_transform.....\n\n")
-                target = self.target_transform(target)
-            res = samples, target
-#            print(res)
-            return res
-            
+        path, target = self.samples[index]
+        if self.archive_indexes is not None:
+            with self._timed('extract'):
+                members = self.archive_indexes.get(path)
+            offset, size = members.span
+            with self._timed('read'):
+                data = await _async_read(path, offset, size)
+            buffers = _split_ranges(data, offset, members.ranges)
+            if members.methods is not None:
+                # only compressed zip members, rare for images, are inflated on the event loop
+                with self._timed('extract'):
+                    buffers = [members.extract(i, data, path) for i, data in enumerate(buffers)]
+            return 'group', buffers, target
 
         if self.is_meng:
-            path, target = self.samples[index]
-            end = time.time()
-            samples = meng_loader(path)
-            load_time = time.time() - end
-            print('load 4 images in a file time:{}'.format(load_time))
-            if self.transform is not None:
-                samples = [self.transform(sample) for sample in samples]
-            if self.target_transform is not None:
-                target = self.target_transform(target)
-            res = samples, target
-#            print(res)
-            return res
-        path, target = self.samples[index]
-        end = time.time()
-        sample = await async_pil_loader(path)
-        load_time = time.time() - end
-#        print("load one image time: {}".format(load_time))
-        if self.transform is not None:
-            end = time.time()
-            sample = self.transform(sample)
-            transform_time = time.time() - end
-            # print("    transform one image time: {}".format(transform_time))
-        if self.target_transform is not None:
-            target = self.target_transform(target)
+            with self._timed('read'):
+                return 'meng', await _async_read(path), target
+        if _bytes_loader(self.loader) is None:
+            # the loader only opens paths, it reads the file in decode_item
+            return 'path', path, target
+        with self._timed('read'):
+            return 'file', await self._async_read_encoded(index, path), target
+
+    def _read_encoded(self, index: int, read: Callable[[], Any]) -> Any:
+        # encoded bytes of a single-image item, looked up in the shared cache first
+        if self.bytes_cache is None:
+            return read()
+        data = self.bytes_cache.get(index)
+        if data is None:
+            data = read()
+            self.bytes_cache.put(index, data)
+        return data
+
+    async def _async_read_encoded(self, index: int, path: str, offset: int = 0, size: int = -1) -> Any:
+        data = self.bytes_cache.get(index) if self.bytes_cache is not None else None
+        if data is None:
+            data = await _async_read(path, offset, size)
+            if self.bytes_cache is not None:
+                self.bytes_cache.put(index, data)
+        return data
+
+    def decode_item(self, raw: Tuple[str, Any, Any]) -> Tuple[Any, Any]:
+        """Decodes and transforms an item read by :meth:`async_read_item`; this is CPU-bound work."""
+        kind, payload, target = raw
+        if kind == 'image':
+            with self._timed('decode'):
+                sample = _decode_image(payload, self.draft_size, self.decode_backend)
+            return self._transform_sample(sample, target)
+        if kind == 'file':
+            with self._timed('decode'):
+                sample = _bytes_loader(self.loader)(payload)
+            return self._transform_sample(sample, target)
+        if kind == 'path':
+            with self._timed('load'):
+                sample = self.loader(payload)
+            return self._transform_sample(sample, target)
+
+        with self._timed('decode'):
+            if kind == 'meng':
+                samples = pickle.loads(payload)
+            else:
+                samples = self._decode_members(payload)
+        return self._transform_group(samples, target)
+
+    async def async_get_item(self, index: int, executor: Optional[Executor] = None) -> Tuple[Any, Any]:
+        """
+        Args:
+            index (int): Index
+            executor (Executor, optional): Executor running the decoding and the transforms,
+                the default executor of the event loop if None.
 
-        return sample, target
+        Returns:
+            tuple: (sample, target) where target is class_index of the target class.
+        """
+        raw = await self.async_read_item(index)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, self.decode_item, raw)
+
+
+IMAGE_DECODE_BACKENDS = ('PIL', 'tensor')
+_JPEG_MAGIC = b'\xff\xd8\xff'
+_PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
 
-    
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif',
-                  '.tiff', '.webp', '.pickle', '.zip', 'tar', 'mytar')
+                  '.tiff', '.webp', '.pickle', '.zip', 'tar', 'mytar', '.imgpack')
 
 
-def pil_loader(path: str) -> Image.Image:
+def pil_loader(path: str, draft_size: Optional[int] = None) -> Image.Image:
     # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
-    end = time.time()
     with open(path, 'rb') as f:
-        f = f.read()
-        f = io.BytesIO(f)
-        io_read_time = time.time() - end
-        end = time.time()
         img = Image.open(f)
-        res = img.convert('RGB')
-        pil_img_decode_time = time.time() - end
-        # print("    io_read_time: {}  pil_img_decode_time: {}".format(io_read_time, pil_img_decode_time))
-        return res
+        _draft(img, draft_size)
+        return img.convert('RGB')
 
-async def async_pil_loader(path: str) -> Image.Image:
-    # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
-    end = time.time()
+async def _async_read(path: str, offset: int = 0, size: int = -1) -> memoryview:
     async with aiofiles.open(path, 'rb') as f:
-        f = await f.read()
-        f = io.BytesIO(f)
-        io_read_time = time.time() - end
-        end = time.time()
-        img = Image.open(f)
-        res = img.convert('RGB')
-        pil_img_decode_time = time.time() - end
-        print("    io_read_time: {}  pil_img_decode_time: {}".format(io_read_time, pil_img_decode_time))
-        return res
-    
-    
- 
+        if offset:
+            await f.seek(offset)
+        return memoryview(await f.read(size))
+
+
+async def async_pil_loader(path: str, executor: Optional[Executor] = None) -> Image.Image:
+    data = await _async_read(path)
+    return await asyncio.get_event_loop().run_in_executor(executor, _decode_rgb, data)
+
+
 def meng_loader(path: str) -> [Image.Image]:
     with open(path, 'rb') as f:
         imgs = pickle.load(f)
         return imgs
 
-def zip_loader(path: str) -> Image.Image:
-    # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
-    imgs = []
-    with ZipFile(path) as archive:
-        for entry in archive.infolist():
-            with archive.open(entry) as file:
-                img = Image.open(file)
-                imgs.append(img.convert('RGB'))
-    return imgs
 
+def imgpack_loader(path: str, draft_size: Optional[int] = None) -> List[Image.Image]:
+    """Loads the images of an ``.imgpack`` file (see :mod:`torchvision.datasets.imgpack`), which
+    replaces the pickled files of :func:`meng_loader`. The images are PIL images that are only
+    decoded once their pixels are used."""
+    members = load_imgpack_index(path)
+    offset, size = members.span
+    data = _read_range(path, offset, size)
+    return [_open_lazy(buffer, draft_size) for buffer in _split_ranges(data, offset, members.ranges)]
 
-def tar_loader(path: str) -> Image.Image:
-    # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
-    imgs = []
-    end = time.time()
-    with open(path, 'rb') as f:
-        f = f.read()
-        iobytes = io.BytesIO(f)
-        tar_read_time = time.time() - end
-        print("    tar_read_time: {}".format(tar_read_time))
-        with tarfile.open(fileobj=iobytes) as archive:
-            for entry in archive.getmembers():
-                end = time.time()
-                with archive.extractfile(entry) as file:
-                    per_img_extract_tile = time.time() - end
-                    end = time.time()
-                    img = Image.open(file)
-                    imgs.append(img.convert('RGB'))
-                    pil_img_decode_time = time.time() - end
-                    #print("        per_img_extract_tile: {}  pil_img_decode_time: {}".format(per_img_extract_tile, pil_img_decode_time))
-    return imgs
+def _split_ranges(data: Any, offset: int, ranges: List[Tuple[int, int]]) -> List[memoryview]:
+    # slices of `data`, the bytes of the file from `offset` on, holding every (start, size) range
+    view = memoryview(data)
+    return [view[start - offset:start - offset + size] for start, size in ranges]
 
 
+# member indexes of the archives read by the loaders below
+_tar_indexes = ArchiveIndexCache(load_tar_index)
+_zip_indexes = ArchiveIndexCache(load_zip_index)
 
-def mytar_loader(path: str, group_metadata):
-    imgs = []
-    targets = []
-    end = time.time()
-    with open(path, 'rb') as f:
-        f = f.read()
-        tar_read_time = time.time() - end
-        # print("    mytar_read_time: {}".format(tar_read_time))
- #       print("size of f:{}  last offset:{}".format(len(f), group_metadata[-1]['start'] + group_metadata[-1]['img_size']))
-        for img_info in group_metadata:
-                end = time.time()
-                img_start = img_info['start']
-                img_end = img_start + img_info['img_size']
-                img_class_idx = img_info['img_class_idx']
-
-                # print('img_class_idx:{}'.format(img_class_idx))
-                img_data = f[img_start:img_end]
-                iobytes = io.BytesIO(img_data)
-
-                per_img_extract_tile = time.time() - end
-                end = time.time()
-                img = Image.open(iobytes)
-                imgs.append(img.convert('RGB'))
-                targets.append(img_class_idx)
-                pil_img_decode_time = time.time() - end
-                #print("    start:{} end:{} per_img_extract_tile: {}  pil_img_decode_time: {}".format(
-                 #         img_start, img_end, per_img_extract_tile, pil_img_decode_time))
-    return imgs, targets
 
-def mytar_loader_pack(path: str, group_metadata, pack_size, pack_index):
-    imgs = []
-    end = time.time()
+def zip_loader(path: str, executor: Optional[Executor] = None, draft_size: Optional[int] = None,
+               backend: str = 'PIL') -> List[Any]:
+    members = _zip_indexes.get(path)
+    offset, size = members.span
+    data = _read_range(path, offset, size)
+    buffers = [members.extract(i, member, path)
+               for i, member in enumerate(_split_ranges(data, offset, members.ranges))]
+    return _decode_all(buffers, executor, draft_size, backend)
+
+
+def tar_loader(path: str, executor: Optional[Executor] = None, draft_size: Optional[int] = None,
+               backend: str = 'PIL') -> List[Any]:
+    members = _tar_indexes.get(path)
+    offset, size = members.span
+    data = _read_range(path, offset, size)
+    return _decode_all(_split_ranges(data, offset, members.ranges), executor, draft_size, backend)
+
+
+def _read_range(path: str, offset: int, size: int, shard_cache: Optional[ShardCache] = None) -> memoryview:
+    if shard_cache is not None:
+        return shard_cache.read(path, offset, size)
     with open(path, 'rb') as f:
-        pack_start = pack_size * pack_index
-        pack_skip_size = 0
-        pack_read_size = 0
-        for i in range(0, pack_start):
-            pack_skip_size += group_metadata[i]['img_size']
-        for i in range(pack_start, pack_start + pack_size):
-            pack_read_size += group_metadata[i]['img_size']
-        f.seek(pack_skip_size)
-        f = f.read(pack_read_size)
-        tar_read_time = time.time() - end
-        print("    mytar_read_time: {}".format(tar_read_time))
- #       print("size of f:{}  last offset:{}".format(len(f), group_metadata[-1]['start'] + group_metadata[-1]['img_size']))
-        for i in range(pack_start, pack_start + pack_size):
-                img_info = group_metadata[i]
-                end = time.time()
-                img_start = img_info['start'] - pack_skip_size
-                img_end = img_start + img_info['img_size']
-                img_data = f[img_start:img_end]
-                iobytes = io.BytesIO(img_data)
-
-                per_img_extract_tile = time.time() - end
-                end = time.time()
-                img = Image.open(iobytes)
-                imgs.append(img.convert('RGB'))
-                pil_img_decode_time = time.time() - end
-                #print("    start:{} end:{} per_img_extract_tile: {}  pil_img_decode_time: {}".format(
-                 #         img_start, img_end, per_img_extract_tile, pil_img_decode_time))
-    return imgs
+        f.seek(offset)
+        return memoryview(f.read(size))
 
 
+def _pack_range(group_metadata, pack_start: int, pack_size: int) -> Tuple[int, int]:
+    # images of a group are stored back to back, so a pack is a single byte range
+    first = group_metadata[pack_start]
+    last = group_metadata[pack_start + pack_size - 1]
+    offset = int(first['start'])
+    return offset, int(last['start']) + int(last['img_size']) - offset
 
 
-async def async_tar_loader(path: str) -> Image.Image:
-    # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
-    imgs = []
-    end = time.time()
-    async with aiofiles.open(path, 'rb') as f:
-        f = await f.read()
-        iobytes = io.BytesIO(f)
-        tar_read_time = time.time() - end
-        print("    async tar_read_time: {}".format(tar_read_time))
-        with tarfile.open(fileobj=iobytes) as archive:
-            for entry in archive.getmembers():
-                end = time.time()
-                with archive.extractfile(entry) as file:
-                    per_img_extract_tile = time.time() - end
-                    end = time.time()
-                    img = Image.open(file)
-                    imgs.append(img.convert('RGB'))
-                    pil_img_decode_time = time.time() - end
-                    #print("        per_img_extract_tile: {}  pil_img_decode_time: {}".format(per_img_extract_tile, pil_img_decode_time))
-    return imgs
+def _draft(img: Image.Image, draft_size: Optional[int]) -> None:
+    """Lets the JPEG decoder scale ``img`` down by 2, 4 or 8 (DCT scaling) while its shorter side
+    stays at least ``draft_size`` pixels long. Other formats are decoded at full resolution."""
+    if draft_size is None or img.format != 'JPEG':
+        return
+    width, height = img.size
+    scale = min(width, height) / draft_size
+    if scale >= 2:
+        # PIL picks the largest scale whose output still covers the requested size
+        img.draft('RGB', (int(math.ceil(width / scale)), int(math.ceil(height / scale))))
 
 
-async def async_mytar_loader(path: str, group_metadata):
-    imgs = []
-    end = time.time()
-    async with aiofiles.open(path, 'rb') as f:
-        f = await f.read()
-        tar_read_time = time.time() - end
-        print("    async mytar_read_time: {}".format(tar_read_time))
-#        print("size of f:{}  last offset:{}".format(len(f), group_metadata[-1]['start'] + group_metadata[-1]['img_size']))
-        for img_info in group_metadata:
-                end = time.time()
-                img_start = img_info['start']
-                img_end = img_start + img_info['img_size']
-                img_data = f[img_start:img_end]
-                iobytes = io.BytesIO(img_data)
-
-                per_img_extract_tile = time.time() - end
-                end = time.time()
-                img = Image.open(iobytes)
-                imgs.append(img.convert('RGB'))
-                pil_img_decode_time = time.time() - end
-                #print("    start:{} end:{} per_img_extract_tile: {}  pil_img_decode_time: {}".format(
-                 #         img_start, img_end, per_img_extract_tile, pil_img_decode_time))
-    return imgs
+def _decode_rgb(data: memoryview, draft_size: Optional[int] = None) -> Image.Image:
+    # slices of the group are decoded in place instead of being copied into a BytesIO
+    with MemoryViewReader(data) as reader:
+        img = Image.open(reader)
+        _draft(img, draft_size)
+        return img.convert('RGB')
 
-async def async_mytar_loader_pack(path: str, group_metadata, pack_size, pack_index):
-    imgs = []
-    end = time.time()
-    async with aiofiles.open(path, 'rb') as f:
-        pack_start = pack_size * pack_index
-        pack_skip_size = 0
-        pack_read_size = 0
-        for i in range(0, pack_start):
-            pack_skip_size += group_metadata[i]['img_size']
-        for i in range(pack_start, pack_start + pack_size):
-            pack_read_size += group_metadata[i]['img_size']
-        await f.seek(pack_skip_size)
-        f = await f.read(pack_read_size)
-        tar_read_time = time.time() - end
-        print("    async mytar pack read_time: {}".format(tar_read_time))
- #       print("size of f:{}  last offset:{}".format(len(f), group_metadata[-1]['start'] + group_metadata[-1]['img_size']))
-        for i in range(pack_start, pack_start + pack_size):
-                img_info = group_metadata[i]
-                end = time.time()
-                img_start = img_info['start'] - pack_skip_size
-                img_end = img_start + img_info['img_size']
-                img_data = f[img_start:img_end]
-                iobytes = io.BytesIO(img_data)
-
-                per_img_extract_tile = time.time() - end
-                end = time.time()
-                img = Image.open(iobytes)
-                imgs.append(img.convert('RGB'))
-                pil_img_decode_time = time.time() - end
-                #print("    start:{} end:{} per_img_extract_tile: {}  pil_img_decode_time: {}".format(
-                 #         img_start, img_end, per_img_extract_tile, pil_img_decode_time))
-    print(len(imgs))
-    return imgs
+
+def _open_lazy(data: Any, draft_size: Optional[int] = None) -> Image.Image:
+    # only the header is parsed here, PIL decodes the image when its pixels are first accessed;
+    # the reader is not closed, the image reads from it when it is loaded
+    img = Image.open(MemoryViewReader(data))
+    _draft(img, draft_size)
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _pil_to_uint8_tensor(img: Image.Image) -> torch.Tensor:
+    return torch.from_numpy(np.array(img, dtype=np.uint8)).permute(2, 0, 1).contiguous()
+
+
+def _decode_tensor(data: Any, draft_size: Optional[int] = None) -> torch.Tensor:
+    """Decodes an encoded image into a CHW ``uint8`` RGB tensor.
+
+    JPEG and PNG images are decoded by ``torchvision.io.decode_image`` when the image extension of
+    torchvision is available. PIL decodes the other formats, the images libjpeg/libpng refuse (e.g.
+    CMYK JPEGs) and the JPEGs decoded at reduced resolution for ``draft_size``.
+    """
+    from torchvision.io import image as io_image
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    magic = buffer[:8].tobytes()
+    is_jpeg = magic.startswith(_JPEG_MAGIC)
+    if io_image._HAS_IMAGE_OPT and ((is_jpeg and draft_size is None) or magic.startswith(_PNG_MAGIC)):
+        if not buffer.flags.writeable:
+            # torch warns about read-only arrays, copying the encoded bytes is cheap next to decoding
+            buffer = buffer.copy()
+        try:
+            return io_image.decode_image(torch.from_numpy(buffer), io_image.ImageReadMode.RGB)
+        except RuntimeError:
+            pass
+    return _pil_to_uint8_tensor(_decode_rgb(data, draft_size))
+
+
+def _decode_image(data: Any, draft_size: Optional[int] = None, backend: str = 'PIL') -> Any:
+    if backend == 'tensor':
+        return _decode_tensor(data, draft_size)
+    return _decode_rgb(data, draft_size)
+
+
+def _decode_all(buffers: List[Any], executor: Optional[Executor] = None,
+                draft_size: Optional[int] = None, backend: str = 'PIL') -> List[Any]:
+    if executor is None:
+        return [_decode_image(buffer, draft_size, backend) for buffer in buffers]
+    # PIL and torchvision.io release the GIL while decoding, so the images of a group overlap
+    return list(executor.map(_decode_image, buffers, itertools.repeat(draft_size), itertools.repeat(backend)))
+
+
+def _split_pack(data: memoryview, offset: int, group_metadata) -> List[memoryview]:
+    buffers = []
+    for img_info in group_metadata:
+        img_start = int(img_info['start']) - offset
+        buffers.append(data[img_start:img_start + int(img_info['img_size'])])
+    return buffers
+
+
+def _decode_pack(data: memoryview, offset: int, group_metadata, executor: Optional[Executor] = None,
+                 draft_size: Optional[int] = None, backend: str = 'PIL'):
+    targets = [int(img_info['img_class_idx']) for img_info in group_metadata]
+    return _decode_all(_split_pack(data, offset, group_metadata), executor, draft_size, backend), targets
+
+
+def mytar_loader(path: str, group_metadata, shard_cache: Optional[ShardCache] = None,
+                 executor: Optional[Executor] = None, draft_size: Optional[int] = None, backend: str = 'PIL'):
+    offset, size = _pack_range(group_metadata, 0, len(group_metadata))
+    data = _read_range(path, offset, size, shard_cache)
+    return _decode_pack(data, offset, group_metadata, executor, draft_size, backend)
+
+
+def mytar_loader_pack(path: str, group_metadata, pack_size, pack_index, shard_cache: Optional[ShardCache] = None,
+                      executor: Optional[Executor] = None, draft_size: Optional[int] = None, backend: str = 'PIL'):
+    pack_start = pack_size * pack_index
+    # the last pack of a short group holds the remaining images
+    pack_size = min(pack_size, len(group_metadata) - pack_start)
+    offset, size = _pack_range(group_metadata, pack_start, pack_size)
+    data = _read_range(path, offset, size, shard_cache)
+    return _decode_all(_split_pack(data, offset, group_metadata[pack_start:pack_start + pack_size]), executor,
+                       draft_size, backend)
+
+
+async def async_tar_loader(path: str, executor: Optional[Executor] = None) -> List[Image.Image]:
+    members = _tar_indexes.get(path)
+    offset, size = members.span
+    data = await _async_read(path, offset, size)
+    buffers = _split_ranges(data, offset, members.ranges)
+    return await asyncio.get_event_loop().run_in_executor(executor, _decode_all, buffers)
+
+
+async def async_mytar_loader(path: str, group_metadata, executor: Optional[Executor] = None):
+    offset, size = _pack_range(group_metadata, 0, len(group_metadata))
+    data = await _async_read(path, offset, size)
+    return await asyncio.get_event_loop().run_in_executor(executor, _decode_all,
+                                                          _split_pack(data, offset, group_metadata))
+
+
+async def async_mytar_loader_pack(path: str, group_metadata, pack_size, pack_index,
+                                  executor: Optional[Executor] = None):
+    pack_start = pack_size * pack_index
+    # the last pack of a short group holds the remaining images
+    pack_size = min(pack_size, len(group_metadata) - pack_start)
+    offset, size = _pack_range(group_metadata, pack_start, pack_size)
+    data = await _async_read(path, offset, size)
+    return await asyncio.get_event_loop().run_in_executor(
+        executor, _decode_all, _split_pack(data, offset, group_metadata[pack_start:pack_start + pack_size]))
 
 
 def old_tar_loader(path: str) -> Image.Image:
@@ -670,12 +1010,99 @@ def accimage_loader(path: str) -> Any:
         return pil_loader(path)
 
 
-def default_loader(path: str) -> Any:
+def tensor_loader(path: str, draft_size: Optional[int] = None) -> torch.Tensor:
+    """Loads an image as a CHW ``uint8`` RGB tensor, decoded by ``torchvision.io`` when possible."""
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    return _decode_tensor(data, draft_size)
+
+
+def default_loader(path: str, draft_size: Optional[int] = None) -> Any:
     from torchvision import get_image_backend
     if get_image_backend() == 'accimage':
         return accimage_loader(path)
     else:
-        return pil_loader(path)
+        return pil_loader(path, draft_size)
+
+
+def _bytes_loader(loader: Callable[[str], Any]) -> Optional[Callable[[Any], Any]]:
+    # decodes the encoded bytes of an image file as `loader` loads the file, so that the bytes can be read
+    # (and cached) apart; None for loaders that only open paths: custom loaders and the accimage backend
+    func = getattr(loader, 'func', loader)
+    keywords = {}
+    if func is not loader:
+        # a functools.partial, which may only set draft_size
+        keywords = loader.keywords or {}  # type: ignore[attr-defined]
+        if loader.args or set(keywords) - {'draft_size'}:  # type: ignore[attr-defined]
+            return None
+    draft_size = keywords.get('draft_size')
+    if func is default_loader:
+        from torchvision import get_image_backend
+        if get_image_backend() == 'accimage':
+            return None
+        func = pil_loader
+    if func is pil_loader:
+        return functools.partial(_decode_rgb, draft_size=draft_size)
+    if func is tensor_loader:
+        return functools.partial(_decode_tensor, draft_size=draft_size)
+    return None
+
+
+def flatten_groups(batch: List[Any]) -> List[Tuple[Any, Any]]:
+    """(sample, target) pairs of a list of dataset items, where the items of the grouped formats,
+    ``(samples, target)`` or ``(samples, targets)`` with a list of samples, give one pair per sample."""
+    pairs = []
+    for samples, target in batch:
+        if not isinstance(samples, (list, tuple)):
+            pairs.append((samples, target))
+            continue
+        targets = target if isinstance(target, (list, tuple)) else [target] * len(samples)
+        if len(targets) != len(samples):
+            raise ValueError("Got {} targets for a group of {} samples".format(len(targets), len(samples)))
+        pairs.extend(zip(samples, targets))
+    return pairs
+
+
+def _new_batch(sample: torch.Tensor, size: int) -> torch.Tensor:
+    shape = (size,) + tuple(sample.shape)
+    if torch.utils.data.get_worker_info() is None:
+        return sample.new_empty(shape)
+    # in a worker, the batch is allocated in shared memory so that sending it to the main process
+    # does not copy it again
+    if hasattr(sample, 'untyped_storage'):
+        storage = sample.untyped_storage()._new_shared(size * sample.numel() * sample.element_size())
+    else:
+        storage = sample.storage()._new_shared(size * sample.numel())
+    return sample.new_empty(0).set_(storage).view(shape)
+
+
+def grouped_collate(batch: List[Any]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """``collate_fn`` of a DataLoader over a grouped dataset (``is_mytar``, ``is_tar``, ``is_zip``,
+    ``is_imgpack`` or ``is_meng``), whose items are lists of samples.
+
+    The samples of all the groups of ``batch`` are copied once into a single ``N x ...`` tensor, with
+    ``N`` the total number of samples (which varies with the size of the groups), and their targets
+    into an ``int64`` tensor of ``N`` entries, so the batches look like those of a dataset of single
+    samples with ``batch_size=N``::
+
+        dataset = ImageFolder(root, transform=transform, is_mytar=True, group_size=16)
+        loader = DataLoader(dataset, batch_size=256 // 16, collate_fn=grouped_collate)
+        for images, targets in loader:
+            ...
+
+    Items of single samples are collated as well. The transform has to return tensors of the same
+    shape for all the samples.
+    """
+    pairs = flatten_groups(batch)
+    if len(pairs) == 0:
+        raise ValueError("Cannot collate an empty batch")
+    first = pairs[0][0]
+    if not isinstance(first, torch.Tensor):
+        raise TypeError("grouped_collate needs the transform to return tensors, got {}".format(type(first)))
+    images = _new_batch(first, len(pairs))
+    torch.stack([sample for sample, _ in pairs], 0, out=images)
+    targets = torch.tensor([int(target) for _, target in pairs], dtype=torch.int64)
+    return images, targets
 
 
 class ImageFolder(DatasetFolder):
@@ -698,6 +1125,77 @@ class ImageFolder(DatasetFolder):
         loader (callable, optional): A function to load an image given its path.
         is_valid_file (callable, optional): A function that takes path of an Image file
             and check if the file is a valid file (used to check of corrupt files)
+        per_sample (bool, optional): If True, a mytar, tar, zip or imgpack dataset is indexed by image
+            instead of by group or archive: ``dataset[i]`` reads the ``i``-th image with a single read and
+            returns ``(image, class_index)``, so any sampler shuffles at image granularity. The
+            members of every archive are indexed when the dataset is built.
+        use_mmap (bool, optional): If True, mytar groups and tar and zip archives are memory-mapped
+            once per worker and images are decoded straight from the map instead of reading them
+            into memory.
+        max_open_shards (int, optional): Number of group files or archives each worker keeps open
+            (or mapped when ``use_mmap`` is True); the least recently used ones are closed first.
+        decode_threads (int, optional): If positive, the images of a group (mytar, tar or zip) are
+            decoded and converted to RGB concurrently on a thread pool of that size in every worker.
+            Default: 0, decode them one after another.
+        cache_bytes (int, optional): If positive, the encoded bytes of the images read are kept in a
+            :class:`~torchvision.datasets.shm_cache.SharedBytesCache` of that many bytes, in shared
+            memory, so that the DataLoader workers of this dataset find there the images any of them
+            read in the previous epochs. Every dataset instance allocates its own cache, e.g. every
+            distributed rank of a node takes ``cache_bytes`` of memory. Only for datasets whose items are single images: image folders read
+            with ``default_loader``, ``pil_loader`` or ``tensor_loader`` (possibly with ``draft_size``
+            set through ``functools.partial``), whose cached bytes are decoded as the loader does,
+            and per-sample mytar, tar, zip and imgpack datasets.
+            Default: 0, no cache.
+        cache_policy (string, optional): What happens once ``cache_bytes`` are used: ``'lru'`` evicts
+            the least recently used images, ``'pin'`` keeps the images cached first and does not
+            cache the others. Default: ``'lru'``.
+        draft_size (int, optional): If given, JPEG images are decoded at 1/2, 1/4 or 1/8 of their
+            resolution (PIL's ``Image.draft``) as long as their shorter side stays at least
+            ``draft_size`` pixels long, which cuts decoding time when the transforms shrink the
+            images anyway. Use the size of the first resize, e.g. 256 for ``Resize(256)``; with
+            ``RandomResizedCrop(size)``, crops smaller than ``draft_size`` are upsampled from fewer
+            pixels. Applies to the default loader and to the zip, tar and mytar formats.
+            Default: None, full resolution.
+        decode_backend (string, optional): ``'PIL'`` to load images as PIL images, or ``'tensor'`` to
+            load them as CHW ``uint8`` RGB tensors, ready for the tensor transforms, decoded by
+            ``torchvision.io.decode_image`` (PIL is used for the formats it does not support).
+            Applies to the default loader and to the zip, tar and mytar formats. Default: ``'PIL'``.
+        profiler (LoaderProfiler, optional): If given, the time spent reading, extracting, decoding
+            and transforming every item is counted in it, per DataLoader worker; images of a folder
+            are timed as a whole around the loader (``load``). See
+            :class:`~torchvision.datasets.LoaderProfiler`. Default: None, nothing is timed.
+        scan_cache_dir (string, optional): Directory where the list of images found in ``root`` is
+            cached, e.g. ``~/.torch/vision/datasets/scan_index``, so that building the dataset
+            again (other ranks, restarts) does not list every file. Not used with ``is_valid_file``.
+            Default: None, ``root`` is scanned every time.
+        scan_workers (int, optional): Number of threads listing the class folders of ``root``
+            concurrently when the dataset is built, e.g. 32 on network file systems where every
+            listing waits for the server. ``is_valid_file`` is then called from these threads.
+            Default: 0, the class folders are listed one after the other.
+        compact_samples (bool, optional): If True, the paths and classes of the images are stored
+            in numpy arrays (see :class:`~torchvision.datasets.sample_list.CompactSamples`) rather than
+            lists of Python objects, which every forked DataLoader worker slowly copies as it reads
+            them (reference counts are written to their pages). ``samples`` and ``imgs`` still
+            return (path, class_index) tuples and ``targets`` is an ``int32`` array. Recommended
+            with many workers and millions of images. Default: False.
+        archive_sidecars (bool, optional): Tar and zip archives are read through an index of the
+            offsets and sizes of their members, built by parsing the headers (the central directory
+            of zip archives) the first time an archive is read, so that stored members are read in
+            place and only compressed zip members go through ``zlib`` or ``zipfile``.
+            If True, that index is saved next to the archive (``<archive>.idx.npz``) and reused by
+            all workers and later runs, otherwise every worker builds and keeps its own. Default: True.
+        is_imgpack (bool, optional): If True, the items are ``.imgpack`` files, the successor of the
+            pickled files of ``is_meng``: each one holds the encoded bytes of a group of images behind
+            an offset table (see :mod:`torchvision.datasets.imgpack`, which also converts ``.pickle``
+            files). With the ``'PIL'`` backend, the images are returned as PIL images decoded when a
+            transform first reads their pixels, and every image is released once transformed.
+            Default: False.
+        direct_io (bool, optional): If True, mytar groups and tar, zip and imgpack archives are read
+            with ``O_DIRECT``, around the page cache, into an aligned buffer reused by every read of
+            a worker (see :class:`~torchvision.datasets.shards.ShardCache`). For datasets much larger
+            than memory, whose shards would otherwise evict everything else from the page cache every
+            epoch; ``benchmarks/bench_direct_io.py`` compares it with buffered reads on a given
+            storage. Cannot be used with ``use_mmap``. Default: False.
 
      Attributes:
         classes (list): List of the class names sorted alphabetically.
@@ -719,22 +1217,75 @@ class ImageFolder(DatasetFolder):
             is_mytar: bool = False,
             group_size: int = 1,
             read_group_size: int = 0,
+            per_sample: bool = False,
+            use_mmap: bool = False,
+            max_open_shards: int = 64,
+            decode_threads: int = 0,
+            cache_bytes: int = 0,
+            cache_policy: str = 'lru',
+            draft_size: Optional[int] = None,
+            decode_backend: str = 'PIL',
+            profiler: Optional[LoaderProfiler] = None,
+            scan_cache_dir: Optional[str] = None,
+            scan_workers: int = 0,
+            compact_samples: bool = False,
+            archive_sidecars: bool = True,
+            is_imgpack: bool = False,
+            direct_io: bool = False,
     ):
         self.is_meng = is_meng
         self.is_zip = is_zip
         self.is_tar = is_tar
         self.is_mytar = is_mytar
         self.is_async = is_async
+        self.is_imgpack = is_imgpack
         self.group_size = group_size
         if read_group_size == 0:
             self.read_group_size = group_size
         else:
             self.read_group_size = read_group_size
+        self.per_sample = per_sample
+        is_archive = is_tar or is_zip or is_imgpack
+        self.shard_cache = ShardCache(max_open_shards, use_mmap=use_mmap, direct_io=direct_io) \
+            if is_mytar or is_archive else None
+        if is_imgpack:
+            self.archive_indexes = ArchiveIndexCache(load_imgpack_index)
+        elif is_archive:
+            load_index = load_tar_index if is_tar else load_zip_index
+            self.archive_indexes = ArchiveIndexCache(functools.partial(load_index, sidecar=archive_sidecars))
+        self.decode_pool = _DecodePool(decode_threads)
+        if decode_backend not in IMAGE_DECODE_BACKENDS:
+            raise ValueError("decode_backend should be one of {}, got {!r}".format(IMAGE_DECODE_BACKENDS,
+                                                                                decode_backend))
+        self.draft_size = draft_size
+        self.decode_backend = decode_backend
+        self.profiler = profiler
+        if decode_backend == 'tensor' and loader is default_loader:
+            loader = functools.partial(tensor_loader, draft_size=draft_size)
+        elif draft_size is not None and loader is default_loader:
+            loader = functools.partial(default_loader, draft_size=draft_size)
+        if cache_bytes > 0:
+            if is_meng or ((is_archive or is_mytar) and not per_sample):
+                raise ValueError("cache_bytes needs items made of a single image: an image folder "
+                                 "or a per_sample mytar, tar, zip or imgpack dataset")
+            if not (is_mytar or is_archive) and _bytes_loader(loader) is None:
+                raise ValueError("cache_bytes needs a loader that can decode cached bytes: default_loader "
+                                 "(without the accimage backend), pil_loader or tensor_loader")
 
         super(ImageFolder, self).__init__(root, loader, IMG_EXTENSIONS if is_valid_file is None else None,
                                           transform=transform,
                                           target_transform=target_transform,
-                                          is_valid_file=is_valid_file)
+                                          is_valid_file=is_valid_file,
+                                          scan_cache_dir=scan_cache_dir,
+                                          scan_workers=scan_workers,
+                                          compact_samples=compact_samples)
+        if not is_mytar:
+            self.imgs = self.samples
+        if per_sample and is_archive:
+            counts = [len(self.archive_indexes.get(path)) for path, _ in self.samples]
+            self.member_offsets = np.cumsum([0] + counts, dtype=np.int64)
+        if cache_bytes > 0:
+            self.bytes_cache = SharedBytesCache(len(self), cache_bytes, policy=cache_policy)
 
         if(is_meng):
             print("meng's image folder!")
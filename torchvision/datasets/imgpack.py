@@ -0,0 +1,146 @@
+"""Container of encoded images, the successor of the pickled ``is_meng`` files.
+
+An ``.imgpack`` file stores the encoded bytes of its images (JPEG, PNG, ...) back to back behind
+an offset table, so a reader fetches the table with one small read and then any image, or the
+whole file, without decoding anything it does not use. Layout, little-endian::
+
+    magic        8 bytes, b'IMGPACK1'
+    count        uint64, number of images
+    names_size   uint64, size of the names
+    offsets      int64 * count, offset of every image in the file
+    sizes        int64 * count, size of every image
+    names        names_size bytes, the utf-8 image names joined by '\\0'
+    data         the encoded images
+
+Existing ``.pickle`` files of decoded images are converted with::
+
+    python -m torchvision.datasets.imgpack /data/imagenet-pickle/train /data/imagenet-imgpack/train
+"""
+import argparse
+import io
+import os
+import pickle
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+from .archive_index import ArchiveIndex
+
+
+IMGPACK_MAGIC = b'IMGPACK1'
+IMGPACK_EXTENSION = '.imgpack'
+_HEADER = struct.Struct('<8sQQ')
+
+
+def write_imgpack(path: str, buffers: Sequence[Any], names: Optional[Sequence[str]] = None) -> None:
+    """Writes the encoded images ``buffers`` (bytes-like objects) to an ``.imgpack`` file.
+
+    Args:
+        path (string): File to write, replaced atomically.
+        buffers (sequence): Encoded images, stored as is.
+        names (sequence of strings, optional): Name of every image. Default: ``0``, ``1``, ...
+    """
+    if names is None:
+        names = [str(i) for i in range(len(buffers))]
+    if len(names) != len(buffers):
+        raise ValueError("Got {} names for {} images".format(len(names), len(buffers)))
+    if any('\0' in name for name in names):
+        raise ValueError("Image names cannot contain NUL characters")
+    encoded_names = '\0'.join(names).encode('utf-8', 'surrogateescape')
+    sizes = np.array([memoryview(buffer).nbytes for buffer in buffers], dtype=np.int64)
+    offsets = np.full(len(buffers), _HEADER.size + 16 * len(buffers) + len(encoded_names), dtype=np.int64)
+    offsets[1:] += np.cumsum(sizes)[:-1]
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(IMGPACK_MAGIC, len(buffers), len(encoded_names)))
+        f.write(offsets.astype('<i8').tobytes())
+        f.write(sizes.astype('<i8').tobytes())
+        f.write(encoded_names)
+        for buffer in buffers:
+            f.write(buffer)
+    os.replace(tmp_path, path)
+
+
+def load_imgpack_index(path: str) -> ArchiveIndex:
+    """Reads the offset table of an ``.imgpack`` file, with two small reads."""
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) != _HEADER.size or header[:len(IMGPACK_MAGIC)] != IMGPACK_MAGIC:
+            raise ValueError("{} is not an imgpack file".format(path))
+        _, count, names_size = _HEADER.unpack(header)
+        table = f.read(16 * count + names_size)
+    if len(table) != 16 * count + names_size:
+        raise ValueError("{}: truncated offset table".format(path))
+    offsets = np.frombuffer(table, dtype='<i8', count=count).astype(np.int64)
+    sizes = np.frombuffer(table, dtype='<i8', count=count, offset=8 * count).astype(np.int64)
+    names = table[16 * count:].decode('utf-8', 'surrogateescape').split('\0') if count else []
+    return ArchiveIndex(names, offsets, sizes)
+
+
+def convert_pickle(src: str, dst: str, image_format: str = 'JPEG', quality: int = 95) -> int:
+    """Converts a pickled list of decoded PIL images into an ``.imgpack`` file.
+
+    The pickled images were decoded, so their original encoding is lost: they are encoded again
+    with ``image_format`` (``'PNG'`` keeps them lossless, at the cost of larger files).
+
+    Returns:
+        int: Number of images converted.
+    """
+    with open(src, 'rb') as f:
+        imgs = pickle.load(f)
+    extension = '.' + image_format.lower()
+    buffers = []
+    for img in imgs:
+        out = io.BytesIO()
+        if image_format.upper() == 'JPEG':
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(out, format='JPEG', quality=quality)
+        else:
+            img.save(out, format=image_format)
+        buffers.append(out.getbuffer())
+    write_imgpack(dst, buffers, ["{:06d}{}".format(i, extension) for i in range(len(buffers))])
+    return len(buffers)
+
+
+def convert_pickle_tree(root: str, output_dir: str, image_format: str = 'JPEG', quality: int = 95,
+                        num_workers: int = 8) -> List[str]:
+    """Converts every ``.pickle`` file under ``root`` into an ``.imgpack`` file at the same relative
+    path under ``output_dir``, e.g. ``root/class_x/group0.pickle`` to ``output_dir/class_x/group0.imgpack``.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    root = os.path.expanduser(root)
+    output_dir = os.path.expanduser(output_dir)
+    jobs = []
+    for dirpath, _, fnames in sorted(os.walk(root, followlinks=True)):
+        for fname in sorted(fnames):
+            if fname.endswith('.pickle'):
+                out_dir = os.path.join(output_dir, os.path.relpath(dirpath, root))
+                os.makedirs(out_dir, exist_ok=True)
+                jobs.append((os.path.join(dirpath, fname),
+                             os.path.join(out_dir, fname[:-len('.pickle')] + IMGPACK_EXTENSION)))
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        list(pool.map(lambda job: convert_pickle(job[0], job[1], image_format, quality), jobs))
+    return [dst for _, dst in jobs]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Convert pickled image groups into imgpack files")
+    parser.add_argument("root", help="root of the tree of .pickle files")
+    parser.add_argument("output_dir", help="directory the .imgpack files are written to, with the same layout")
+    parser.add_argument("--format", default='JPEG', help="encoding of the images (default: JPEG)")
+    parser.add_argument("--quality", default=95, type=int, help="JPEG quality (default: 95)")
+    parser.add_argument("-j", "--workers", default=8, type=int, help="number of converting threads")
+    args = parser.parse_args(argv)
+
+    paths = convert_pickle_tree(args.root, args.output_dir, args.format, args.quality, args.workers)
+    print("Wrote {} imgpack files to {}".format(len(paths), args.output_dir))
+
+
+if __name__ == "__main__":
+    main()
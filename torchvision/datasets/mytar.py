@@ -0,0 +1,208 @@
+import os
+import os.path
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# one record per image, field names match the keys used by the mytar loaders
+MYTAR_SAMPLE_DTYPE = np.dtype([('start', '<i8'), ('img_size', '<i4'), ('img_class_idx', '<i4')])
+
+_INDEX_FILES = {
+    'classes': "metadata_classes.npy",
+    'group_names': "metadata_groups.npy",
+    'group_offsets': "metadata_group_offsets.npy",
+    'samples': "metadata_samples.npy",
+}
+# size and modification time of the metadata.txt the index was built from
+_SOURCE_FILE = "metadata_source.npy"
+
+
+def _metadata_fingerprint(root: str) -> Optional[np.ndarray]:
+    try:
+        stat = os.stat(os.path.join(root, "metadata.txt"))
+    except OSError:
+        return None
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+class MytarIndex(object):
+    """Binary index of a mytar directory.
+
+    The index is made of flat numpy arrays stored as ``.npy`` files next to the group files, so it
+    can be opened with ``np.memmap`` instead of parsing ``metadata.txt``. Memory-mapped arrays are
+    shared by all DataLoader workers through the page cache and hold no Python objects, so forked
+    workers do not copy them.
+
+    Args:
+        classes (list): Class names sorted alphabetically.
+        group_names (np.ndarray): File name of every group, relative to the mytar root.
+        group_offsets (np.ndarray): ``int64`` array of ``len(group_names) + 1`` entries; the samples of
+            group ``g`` are ``samples[group_offsets[g]:group_offsets[g + 1]]``.
+        samples (np.ndarray): Array of ``MYTAR_SAMPLE_DTYPE`` records holding the byte offset of every
+            image inside its group file, its size and its class index.
+    """
+
+    def __init__(
+            self,
+            classes: List[str],
+            group_names: np.ndarray,
+            group_offsets: np.ndarray,
+            samples: np.ndarray,
+    ) -> None:
+        self.classes = list(classes)
+        self.group_names = group_names
+        self.group_offsets = group_offsets
+        self.samples = samples
+        self._root: Optional[str] = None
+        self._sample_groups: Optional[np.ndarray] = None
+        self._source: Optional[np.ndarray] = None
+
+    @property
+    def class_to_idx(self) -> Dict[str, int]:
+        return {cls_name: i for i, cls_name in enumerate(self.classes)}
+
+    @property
+    def num_samples(self) -> int:
+        return len(self.samples)
+
+    def __len__(self) -> int:
+        return len(self.group_names)
+
+    def group(self, group_index: int) -> np.ndarray:
+        return self.samples[self.group_offsets[group_index]:self.group_offsets[group_index + 1]]
+
+    def group_name(self, group_index: int) -> str:
+        return self.group_names[group_index].decode()
+
+    @property
+    def sample_groups(self) -> np.ndarray:
+        """Group index of every sample, so that samples are located in O(1)."""
+        if self._sample_groups is None:
+            self._sample_groups = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.group_offsets))
+        return self._sample_groups
+
+    def locate(self, sample_index: int) -> Tuple[int, np.void]:
+        """Returns the group index and the record of a sample."""
+        return int(self.sample_groups[sample_index]), self.samples[sample_index]
+
+    @staticmethod
+    def exists(root: str) -> bool:
+        """Whether ``root`` holds a complete index that is up to date with its ``metadata.txt``."""
+        root = os.path.expanduser(root)
+        # the samples file is replaced last by save(), so its presence means the index is complete
+        if not os.path.exists(os.path.join(root, _INDEX_FILES['samples'])):
+            return False
+        fingerprint = _metadata_fingerprint(root)
+        if fingerprint is None:
+            return True
+        try:
+            source = np.load(os.path.join(root, _SOURCE_FILE))
+        except (OSError, ValueError):
+            return False
+        return np.array_equal(source, fingerprint)
+
+    @staticmethod
+    def remove(root: str) -> None:
+        """Deletes the index files of ``root``, so that ``metadata.txt`` is parsed instead."""
+        root = os.path.expanduser(root)
+        # the samples file first, so that an interrupted removal leaves an incomplete index
+        for fname in [_INDEX_FILES['samples'], _SOURCE_FILE] + list(_INDEX_FILES.values()):
+            try:
+                os.remove(os.path.join(root, fname))
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def load(cls, root: str, mmap: bool = True) -> "MytarIndex":
+        root = os.path.expanduser(root)
+        mmap_mode = 'r' if mmap else None
+        arrays = {key: np.load(os.path.join(root, fname), mmap_mode=mmap_mode)
+                  for key, fname in _INDEX_FILES.items()}
+        index = cls(arrays['classes'].tolist(), arrays['group_names'], arrays['group_offsets'], arrays['samples'])
+        if mmap:
+            index._root = root
+        return index
+
+    @classmethod
+    def from_metadata_txt(cls, root: str, group_size: int) -> "MytarIndex":
+        """Parses the ``metadata.txt`` of a mytar directory.
+
+        Groups whose header line does not record an image count are assumed to hold ``group_size`` images.
+        """
+        root = os.path.expanduser(root)
+        source = _metadata_fingerprint(root)
+        group_names = []
+        group_offsets = [0]
+        starts: List[int] = []
+        sizes: List[int] = []
+        class_idx: List[int] = []
+        with open(os.path.join(root, "metadata.txt"), 'r') as reader:
+            class_count = int(reader.readline().strip())
+            classes = sorted(reader.readline().strip() for _ in range(class_count))
+            class_to_idx = {cls_name: i for i, cls_name in enumerate(classes)}
+            while True:
+                header = reader.readline().strip().split(',')
+                if header[0] == '':
+                    break
+                count = int(header[1]) if len(header) > 1 and header[1] != '' else group_size
+                for _ in range(count):
+                    _, img_class, start, img_size = reader.readline().strip().split(',')
+                    starts.append(int(start))
+                    sizes.append(int(img_size))
+                    class_idx.append(class_to_idx[img_class])
+                group_names.append(header[0])
+                group_offsets.append(len(starts))
+
+        samples = np.empty(len(starts), dtype=MYTAR_SAMPLE_DTYPE)
+        samples['start'] = starts
+        samples['img_size'] = sizes
+        samples['img_class_idx'] = class_idx
+        index = cls(classes, np.array(group_names, dtype=np.bytes_),
+                    np.array(group_offsets, dtype=np.int64), samples)
+        index._source = source
+        return index
+
+    def save(self, root: str) -> None:
+        """Writes the index next to the group files, recording the ``metadata.txt`` it matches: the
+        one it was parsed from, or the current one of ``root``."""
+        root = os.path.expanduser(root)
+        source = self._source if self._source is not None else _metadata_fingerprint(root)
+        if source is not None:
+            with open(os.path.join(root, _SOURCE_FILE + ".tmp"), 'wb') as f:
+                np.save(f, source)
+            os.replace(os.path.join(root, _SOURCE_FILE + ".tmp"), os.path.join(root, _SOURCE_FILE))
+        arrays = {
+            'classes': np.array(self.classes, dtype=np.str_),
+            'group_names': np.asarray(self.group_names, dtype=np.bytes_),
+            'group_offsets': np.asarray(self.group_offsets, dtype=np.int64),
+            'samples': np.asarray(self.samples, dtype=MYTAR_SAMPLE_DTYPE),
+        }
+        for key, fname in _INDEX_FILES.items():
+            path = os.path.join(root, fname)
+            with open(path + ".tmp", 'wb') as f:
+                np.save(f, arrays[key])
+            os.replace(path + ".tmp", path)
+
+    def __getstate__(self):
+        if self._root is not None:
+            # memory-mapped indices are reopened by spawned workers instead of being copied
+            return {'_root': self._root}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if '_root' in state and len(state) == 1:
+            state = MytarIndex.load(state['_root']).__dict__
+        self.__dict__.update(state)
+
+
+def load_mytar_index(root: str, group_size: int) -> MytarIndex:
+    """Opens the binary index of a mytar directory, or parses ``metadata.txt`` if there is none."""
+    if MytarIndex.exists(root):
+        return MytarIndex.load(root)
+    if os.path.exists(os.path.join(os.path.expanduser(root), _INDEX_FILES['samples'])):
+        warnings.warn("The binary index of {} does not match its metadata.txt, which is parsed instead; "
+                      "rebuild the index with `python -m torchvision.datasets.pack {} --convert-metadata`".format(
+                          root, root))
+    return MytarIndex.from_metadata_txt(root, group_size)
@@ -0,0 +1,189 @@
+"""Pack an ``ImageFolder`` tree into the grouped "mytar" layout.
+
+The produced directory can be read with ``ImageFolder(root, is_mytar=True, group_size=...)``::
+
+    python -m torchvision.datasets.pack /data/imagenet/train /data/imagenet-mytar/train --group-size 64
+"""
+import argparse
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .folder import make_dataset
+from .mytar import MYTAR_SAMPLE_DTYPE, MytarIndex
+
+
+PACK_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+
+
+def _group_name(group_index: int) -> str:
+    return "group{:07d}.mytar".format(group_index)
+
+
+def _write_group(
+    output_dir: str,
+    group_name: str,
+    members: List[Tuple[str, str]],
+) -> List[Tuple[str, str, int, int]]:
+    """Concatenates the encoded bytes of ``members`` into one group file.
+
+    Returns:
+        list: (file name, class name, start, size) for every image of the group
+    """
+    entries = []
+    start = 0
+    group_path = os.path.join(output_dir, group_name)
+    tmp_path = group_path + ".tmp"
+    with open(tmp_path, 'wb') as out:
+        for path, class_name in members:
+            with open(path, 'rb') as f:
+                data = f.read()
+            out.write(data)
+            entries.append((os.path.basename(path), class_name, start, len(data)))
+            start += len(data)
+    os.replace(tmp_path, group_path)
+    return entries
+
+
+def write_mytar_shards(
+    root: str,
+    output_dir: str,
+    group_size: int,
+    num_workers: int = 8,
+    shuffle: bool = True,
+    seed: int = 0,
+    extensions: Optional[Tuple[str, ...]] = PACK_EXTENSIONS,
+    is_valid_file: Optional[Callable[[str], bool]] = None,
+    write_index: bool = True,
+) -> List[str]:
+    """Packs a ``root/class_x/xxx.ext`` tree into mytar group files plus ``metadata.txt``.
+
+    Every group file is the plain concatenation of the encoded images it holds. ``metadata.txt``
+    lists the classes, followed by one ``groupname,count`` header per group and one
+    ``name,class,start,size`` line per image, which is the format read by
+    :func:`~torchvision.datasets.folder.get_metadata_mytar`. All groups hold ``group_size``
+    images except the last one, which holds the remainder. Unless ``write_index`` is False, the
+    binary :class:`~torchvision.datasets.mytar.MytarIndex` is written as well, otherwise the index
+    of a previous run is deleted.
+
+    Args:
+        root (string): Root directory of the image folder tree.
+        output_dir (string): Directory the group files and ``metadata.txt`` are written to.
+        group_size (int): Number of images per group file.
+        num_workers (int, optional): Number of threads used to scan the class folders and
+            to write the group files. Default: 8.
+        shuffle (bool, optional): If True, images are shuffled across groups so that a group
+            mixes several classes. Default: True.
+        seed (int, optional): Seed of the shuffle, so that packing is reproducible. Default: 0.
+        extensions (tuple[string], optional): Allowed image extensions.
+        is_valid_file (callable, optional): A function that takes the path of a file and checks
+            if it should be packed. Overrides ``extensions``.
+        write_index (bool, optional): If True, also writes the binary index that ``ImageFolder``
+            memory-maps instead of parsing ``metadata.txt``. Default: True.
+
+    Returns:
+        list: Names of the written group files, in metadata order.
+    """
+    if group_size < 1:
+        raise ValueError("group_size should be a positive integer, got {}".format(group_size))
+    if is_valid_file is not None:
+        extensions = None
+    root = os.path.expanduser(root)
+    output_dir = os.path.expanduser(output_dir)
+
+    classes = sorted(d.name for d in os.scandir(root) if d.is_dir())
+    if len(classes) == 0:
+        raise RuntimeError("Found no class folders in: {}".format(root))
+    for class_name in classes:
+        if ',' in class_name or '\n' in class_name:
+            raise ValueError("Class name {!r} cannot be stored in metadata.txt".format(class_name))
+
+    samples = make_dataset(root, {class_name: i for i, class_name in enumerate(classes)},
+                           extensions=extensions, is_valid_file=is_valid_file, num_workers=num_workers)
+    members = [(path, classes[class_index]) for path, class_index in samples]
+    if len(members) == 0:
+        raise RuntimeError("Found 0 files in subfolders of: {}".format(root))
+    for path, _ in members:
+        name = os.path.basename(path)
+        if ',' in name or '\n' in name:
+            raise ValueError("File name {!r} cannot be stored in metadata.txt".format(name))
+
+    if shuffle:
+        random.Random(seed).shuffle(members)
+    groups = [members[i:i + group_size] for i in range(0, len(members), group_size)]
+    group_names = [_group_name(i) for i in range(len(groups))]
+
+    os.makedirs(output_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        entries = list(pool.map(lambda args: _write_group(output_dir, *args), zip(group_names, groups)))
+
+    if not write_index:
+        # an index left by a previous run would be used in place of the new metadata.txt
+        MytarIndex.remove(output_dir)
+    metadata_path = os.path.join(output_dir, "metadata.txt")
+    with open(metadata_path + ".tmp", 'w') as writer:
+        writer.write("{}\n".format(len(classes)))
+        for class_name in classes:
+            writer.write("{}\n".format(class_name))
+        for group_name, group_entries in zip(group_names, entries):
+            writer.write("{},{}\n".format(group_name, len(group_entries)))
+            for name, class_name, start, size in group_entries:
+                writer.write("{},{},{},{}\n".format(name, class_name, start, size))
+    os.replace(metadata_path + ".tmp", metadata_path)
+
+    if write_index:
+        class_to_idx = {cls_name: i for i, cls_name in enumerate(classes)}
+        group_offsets = np.cumsum([0] + [len(group_entries) for group_entries in entries], dtype=np.int64)
+        samples = np.array([(start, size, class_to_idx[class_name])
+                            for group_entries in entries for _, class_name, start, size in group_entries],
+                           dtype=MYTAR_SAMPLE_DTYPE)
+        MytarIndex(classes, np.array(group_names, dtype=np.bytes_), group_offsets, samples).save(output_dir)
+    return group_names
+
+
+def convert_metadata(root: str, group_size: int) -> MytarIndex:
+    """Writes the binary index of an existing mytar directory from its ``metadata.txt``.
+
+    Args:
+        root (string): Directory holding the group files and ``metadata.txt``.
+        group_size (int): Number of images of the groups whose header does not record it.
+
+    Returns:
+        MytarIndex: The index that was written.
+    """
+    index = MytarIndex.from_metadata_txt(root, group_size)
+    index.save(root)
+    return index
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pack an ImageFolder tree into mytar group files")
+    parser.add_argument("root", help="root of the root/class_x/xxx.ext image tree")
+    parser.add_argument("output_dir", nargs='?', default=None,
+                        help="directory the group files and metadata.txt are written to")
+    parser.add_argument("--group-size", default=64, type=int, help="number of images per group file")
+    parser.add_argument("-j", "--workers", default=8, type=int, help="number of scanning/writing threads")
+    parser.add_argument("--no-shuffle", dest="shuffle", action="store_false",
+                        help="keep images in class order instead of mixing classes across groups")
+    parser.add_argument("--seed", default=0, type=int, help="seed of the shuffle across groups")
+    parser.add_argument("--convert-metadata", action="store_true",
+                        help="only write the binary index of the existing mytar directory given as root")
+    args = parser.parse_args(argv)
+
+    if args.convert_metadata:
+        index = convert_metadata(args.root, args.group_size)
+        print("Indexed {} images in {} groups of {}".format(index.num_samples, len(index), args.root))
+        return
+    if args.output_dir is None:
+        parser.error("output_dir is required unless --convert-metadata is given")
+
+    group_names = write_mytar_shards(args.root, args.output_dir, args.group_size, num_workers=args.workers,
+                                     shuffle=args.shuffle, seed=args.seed)
+    print("Wrote {} groups to {}".format(len(group_names), args.output_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import os.path
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import torch.utils.data
+
+from .vision import VisionDataset
+
+
+_IMAGES_FILE = "images.npy"
+_TARGETS_FILE = "targets.npy"
+
+
+def write_preprocessed_tensors(
+        dataset: torch.utils.data.Dataset,
+        root: str,
+        batch_size: int = 64,
+        num_workers: int = 0,
+) -> None:
+    """Runs a dataset once and stores its images in ``root`` for :class:`PreprocessedTensorDataset`.
+
+    The transform of ``dataset`` has to be deterministic and to return ``uint8`` tensors of the same
+    shape for every image, e.g. ``Compose([Resize(256), CenterCrop(224), PILToTensor()])``. The
+    images are written to a single ``N x C x H x W`` memory-mapped ``.npy`` file and the targets to
+    another one, which is renamed last so that an interrupted build is never mistaken for a
+    complete one.
+
+    Args:
+        dataset (Dataset): Dataset returning ``(image, target)`` with ``image`` a ``uint8`` tensor
+            and ``target`` an integer.
+        root (string): Directory the files are written to.
+        batch_size (int, optional): Number of images loaded at once. Default: 64.
+        num_workers (int, optional): DataLoader workers loading and transforming the images.
+            Default: 0.
+    """
+    root = os.path.expanduser(root)
+    os.makedirs(root, exist_ok=True)
+    num_samples = len(dataset)  # type: ignore[arg-type]
+    if num_samples == 0:
+        raise ValueError("Cannot preprocess an empty dataset")
+    first, _ = dataset[0]
+    if not isinstance(first, torch.Tensor) or first.dtype != torch.uint8:
+        raise TypeError("The transform of the dataset should return uint8 tensors, got {}".format(
+            first.dtype if isinstance(first, torch.Tensor) else type(first)))
+    shape = tuple(first.shape)
+
+    images_path = os.path.join(root, _IMAGES_FILE)
+    targets_path = os.path.join(root, _TARGETS_FILE)
+    images = np.lib.format.open_memmap(images_path + ".tmp", mode='w+', dtype=np.uint8,
+                                       shape=(num_samples,) + shape)
+    targets = np.zeros(num_samples, dtype=np.int64)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    start = 0
+    for batch_images, batch_targets in loader:
+        if tuple(batch_images.shape[1:]) != shape:
+            raise ValueError("All the images should have the shape {}, got {}".format(
+                shape, tuple(batch_images.shape[1:])))
+        stop = start + len(batch_images)
+        images[start:stop] = batch_images.numpy()
+        targets[start:stop] = batch_targets.numpy()
+        start = stop
+    images.flush()
+    del images
+    os.replace(images_path + ".tmp", images_path)
+    np.save(targets_path + ".tmp.npy", targets)
+    os.replace(targets_path + ".tmp.npy", targets_path)
+
+
+class PreprocessedTensorDataset(VisionDataset):
+    """Images preprocessed once by :func:`write_preprocessed_tensors`, read from a memory map.
+
+    Meant for evaluation, whose transforms are deterministic: decoding, resizing and cropping are
+    done once, and every later epoch only copies ``uint8`` tensors out of the page cache. The
+    memory map is shared by all DataLoader workers.
+
+    Indexing with an integer returns ``(image, target)``. Indexing with a list of indices (or a
+    slice) returns a whole batch ``(images, targets)`` read with one slice of the map when the
+    indices are consecutive, so a DataLoader created with ``batch_size=None`` and a
+    ``BatchSampler`` as ``sampler`` gets ready-made batches without collating::
+
+        dataset = PreprocessedTensorDataset(root, transform=transforms.Compose([
+            transforms.ConvertImageDtype(torch.float), transforms.Normalize(mean, std)]))
+        sampler = torch.utils.data.BatchSampler(SequentialSampler(dataset), 256, drop_last=False)
+        loader = DataLoader(dataset, batch_size=None, sampler=sampler, num_workers=2)
+
+    Args:
+        root (string): Directory written by :func:`write_preprocessed_tensors`.
+        transform (callable, optional): A function/transform applied to the ``uint8`` image tensors,
+            ``C x H x W`` ones or ``N x C x H x W`` batches, e.g. ``ConvertImageDtype`` and
+            ``Normalize``.
+        target_transform (callable, optional): A function/transform that takes in the target
+            (an integer, or an ``int64`` tensor for batches) and transforms it.
+
+     Attributes:
+        images (np.ndarray): Memory-mapped ``uint8`` array of all the images, ``N x C x H x W``.
+        targets (np.ndarray): ``int64`` class index of every image.
+    """
+
+    def __init__(
+            self,
+            root: str,
+            transform: Optional[Callable] = None,
+            target_transform: Optional[Callable] = None,
+    ) -> None:
+        super(PreprocessedTensorDataset, self).__init__(root, transform=transform,
+                                                        target_transform=target_transform)
+        if not self.exists(self.root):
+            raise RuntimeError("No preprocessed images found in {}, see write_preprocessed_tensors".format(self.root))
+        self.images = np.load(os.path.join(self.root, _IMAGES_FILE), mmap_mode='r')
+        self.targets = np.load(os.path.join(self.root, _TARGETS_FILE))
+
+    @staticmethod
+    def exists(root: str) -> bool:
+        return os.path.exists(os.path.join(os.path.expanduser(root), _TARGETS_FILE))
+
+    def __getitem__(self, index: Union[int, slice, Sequence[int]]) -> Tuple[Any, Any]:
+        """
+        Args:
+            index (int, slice or list): Index, or indices of a batch.
+
+        Returns:
+            tuple: (image, target), or (images, targets) for a batch.
+        """
+        if isinstance(index, (slice, list, tuple)):
+            return self.get_batch(index)
+        image = torch.from_numpy(np.array(self.images[index]))
+        target = int(self.targets[index])
+        if self.transform is not None:
+            image = self.transform(image)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return image, target
+
+    def get_batch(self, indices: Union[slice, Sequence[int]]) -> Tuple[Any, Any]:
+        """Returns the images of ``indices`` as one ``N x C x H x W`` tensor and their targets."""
+        if not isinstance(indices, slice):
+            indices = _as_slice(indices)
+        # a slice is one sequential copy out of the map, a list of indices gathers the images one by one
+        images = torch.from_numpy(np.array(self.images[indices]))
+        targets = torch.from_numpy(self.targets[indices].copy())
+        if self.transform is not None:
+            images = self.transform(images)
+        if self.target_transform is not None:
+            targets = self.target_transform(targets)
+        return images, targets
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def extra_repr(self) -> str:
+        return "Image shape: {}".format(tuple(self.images.shape[1:]))
+
+
+def _as_slice(indices: Sequence[int]) -> Union[slice, List[int]]:
+    # consecutive increasing indices, as given by a SequentialSampler, are read as a slice
+    indices = list(indices)
+    if len(indices) > 0 and indices[0] >= 0 and indices == list(range(indices[0], indices[0] + len(indices))):
+        return slice(indices[0], indices[0] + len(indices))
+    return indices
@@ -0,0 +1,207 @@
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import get_worker_info
+from torch.utils.data._utils.collate import default_collate
+
+
+# read: fetching encoded bytes (files, archives, group slices, shared cache lookups)
+# extract: splitting an archive or a group into the encoded images
+# decode: decoding images (or unpickling them)
+# load: loading an image file with the loader of an image folder, which reads and decodes it at once
+# transform: transform and target_transform
+# collate: merging samples into a batch
+STAGES = ('read', 'extract', 'decode', 'load', 'transform', 'collate')
+
+# durations are counted in logarithmic bins from 1 microsecond, _BINS_PER_OCTAVE bins per doubling
+_BINS_PER_OCTAVE = 8
+_NUM_BINS = 28 * _BINS_PER_OCTAVE
+
+# guards the creation of the row of a process, which decode threads may time concurrently
+_ROW_LOCK = threading.Lock()
+
+
+def _reset_row_lock() -> None:
+    # a fork taken while another thread held the lock would leave it locked in the child
+    global _ROW_LOCK
+    _ROW_LOCK = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_row_lock)
+
+
+def _bin(seconds: float) -> int:
+    us = seconds * 1e6
+    if us <= 1.0:
+        return 0
+    return min(_NUM_BINS - 1, int(math.log2(us) * _BINS_PER_OCTAVE))
+
+
+def _summarize(hist: np.ndarray, totals: np.ndarray) -> Dict[str, Dict[str, float]]:
+    stats = {}
+    # upper edge of every bin, in seconds
+    edges = np.exp2((np.arange(_NUM_BINS) + 1) / _BINS_PER_OCTAVE) * 1e-6
+    for i, stage in enumerate(STAGES):
+        count = int(hist[i].sum())
+        if count == 0:
+            continue
+        cumulative = np.cumsum(hist[i])
+        stats[stage] = {
+            'count': count,
+            'total': float(totals[i]),
+            'mean': float(totals[i]) / count,
+            'p50': float(edges[np.searchsorted(cumulative, 0.5 * count)]),
+            'p99': float(edges[np.searchsorted(cumulative, 0.99 * count)]),
+        }
+    return stats
+
+
+class _StageTimer(object):
+    __slots__ = ('profiler', 'stage', 'start')
+
+    def __init__(self, profiler: "LoaderProfiler", stage: int) -> None:
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args: Any) -> None:
+        self.profiler._record(self.stage, time.perf_counter() - self.start)
+
+
+class _NoTiming(object):
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+NO_TIMING = _NoTiming()
+
+
+class _TimedCollate(object):
+    def __init__(self, profiler: "LoaderProfiler", collate_fn: Callable[[List[Any]], Any]) -> None:
+        self.profiler = profiler
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch: List[Any]) -> Any:
+        with self.profiler.time('collate'):
+            return self.collate_fn(batch)
+
+
+class LoaderProfiler(object):
+    """Per-stage timings of the data loading path, collected in every DataLoader worker.
+
+    Each process (the main process and every worker) counts the durations of the stages it runs in
+    its own row of histograms held in shared memory, so the main process can read the statistics of
+    all workers while they run, without any message passing. Durations are counted in logarithmic
+    bins (8 per doubling), which bounds the error of the reported percentiles to about 9%.
+
+    A dataset without a profiler only checks that it has none at every stage::
+
+        profiler = LoaderProfiler(num_workers=8)
+        dataset = ImageFolder(root, transform=transform, profiler=profiler)
+        loader = DataLoader(dataset, batch_size=256, num_workers=8,
+                            collate_fn=profiler.timed_collate())
+        for images, targets in loader:
+            ...
+        print(profiler.summary())
+
+    Stages are ``read``, ``extract``, ``decode``, ``load``, ``transform`` and ``collate`` (see
+    ``STAGES``); other code can time its own steps with :meth:`time` or :meth:`record`.
+
+    Args:
+        num_workers (int): Number of DataLoader workers the profiler is shared with, 0 when the data
+            is only loaded in the main process (workers then fail on their first timing). Workers
+            whose id is not below ``num_workers`` share the rows of the others.
+    """
+
+    def __init__(self, num_workers: int = 0) -> None:
+        self.num_workers = num_workers
+        # row 0 is the main process, row i + 1 is worker i
+        self._hist = torch.zeros(num_workers + 1, len(STAGES), _NUM_BINS, dtype=torch.int64).share_memory_()
+        self._totals = torch.zeros(num_workers + 1, len(STAGES), dtype=torch.float64).share_memory_()
+        self._pid: Optional[int] = None
+
+    def _row(self) -> None:
+        # numpy views of this process' rows, recomputed after fork or spawn; _pid is set last, so
+        # that other threads only use the row once it is complete
+        with _ROW_LOCK:
+            if self._pid == os.getpid():
+                return
+            worker_info = get_worker_info()
+            if worker_info is not None and self.num_workers == 0:
+                # the rows are allocated before the workers start, there is none for them
+                raise ValueError("LoaderProfiler is used by DataLoader workers but was built with num_workers=0, "
+                                 "build it with the num_workers of the DataLoader ({})".format(
+                                     worker_info.num_workers))
+            row = 0 if worker_info is None else 1 + worker_info.id % self.num_workers
+            self._row_hist = self._hist[row].numpy()
+            self._row_totals = self._totals[row].numpy()
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+    def _record(self, stage: int, seconds: float) -> None:
+        if self._pid != os.getpid():
+            self._row()
+        b = _bin(seconds)
+        with self._lock:
+            self._row_hist[stage, b] += 1
+            self._row_totals[stage] += seconds
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Counts one duration of ``seconds`` for ``stage``."""
+        self._record(STAGES.index(stage), seconds)
+
+    def time(self, stage: str) -> _StageTimer:
+        """Returns a context manager that records the duration of its block for ``stage``."""
+        return _StageTimer(self, STAGES.index(stage))
+
+    def timed_collate(self, collate_fn: Callable[[List[Any]], Any] = default_collate) -> Callable[[List[Any]], Any]:
+        """Wraps a ``collate_fn`` of a DataLoader so that it is timed as the ``collate`` stage."""
+        return _TimedCollate(self, collate_fn)
+
+    def stats(self, worker: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+        """Statistics of every stage that was timed at least once.
+
+        Args:
+            worker (int, optional): Id of a DataLoader worker, or -1 for the main process. Default:
+                None, all the processes together.
+
+        Returns:
+            dict: for every stage, ``count``, ``total``, ``mean``, ``p50`` and ``p99`` (in seconds).
+        """
+        if worker is None:
+            return _summarize(self._hist.sum(0).numpy(), self._totals.sum(0).numpy())
+        row = 0 if worker < 0 else 1 + worker % max(1, self.num_workers)
+        return _summarize(self._hist[row].numpy(), self._totals[row].numpy())
+
+    def summary(self) -> str:
+        """Table of the statistics of all the processes together."""
+        lines = ["{:<10}{:>10}{:>12}{:>12}{:>12}{:>12}".format(
+            'stage', 'count', 'total (s)', 'mean (ms)', 'p50 (ms)', 'p99 (ms)')]
+        for stage, s in self.stats().items():
+            lines.append("{:<10}{:>10}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}".format(
+                stage, s['count'], s['total'], 1e3 * s['mean'], 1e3 * s['p50'], 1e3 * s['p99']))
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        self._hist.zero_()
+        self._totals.zero_()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'num_workers': self.num_workers, '_hist': self._hist, '_totals': self._totals}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._pid = None
@@ -0,0 +1,71 @@
+import os
+from typing import Any, Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class CompactSamples(Sequence):
+    """List of (path, class_index) samples held in three numpy arrays.
+
+    The paths are encoded one after the other in a single ``uint8`` buffer, delimited by an
+    ``int64`` offsets array, and the class indices are an ``int32`` array. Unlike a list of tuples,
+    these arrays hold no Python objects, so reading them from forked DataLoader workers does not
+    write reference counts to their pages and the workers keep sharing them with the main process
+    instead of slowly copying them.
+
+    Items are built on access and compare equal to the tuples of a list of samples::
+
+        samples = CompactSamples.from_list(make_dataset(root, class_to_idx, IMG_EXTENSIONS))
+        path, target = samples[0]
+
+    Args:
+        paths (np.ndarray): ``uint8`` buffer of the paths encoded with :func:`os.fsencode`.
+        offsets (np.ndarray): ``int64`` array of ``len(targets) + 1`` entries; path ``i`` is
+            ``paths[offsets[i]:offsets[i + 1]]``.
+        targets (np.ndarray): ``int32`` class index of every sample.
+    """
+
+    def __init__(self, paths: np.ndarray, offsets: np.ndarray, targets: np.ndarray) -> None:
+        if len(offsets) != len(targets) + 1:
+            raise ValueError("offsets should have {} entries, got {}".format(len(targets) + 1, len(offsets)))
+        self.paths = paths
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_list(cls, samples: List[Tuple[str, int]]) -> "CompactSamples":
+        encoded = [os.fsencode(path) for path, _ in samples]
+        offsets = np.zeros(len(samples) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in encoded], out=offsets[1:])
+        paths = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        targets = np.array([target for _, target in samples], dtype=np.int32)
+        return cls(paths, offsets, targets)
+
+    def path(self, index: int) -> str:
+        return os.fsdecode(self.paths[self.offsets[index]:self.offsets[index + 1]].tobytes())
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sample index {} out of range".format(index))
+        return self.path(index), int(self.targets[index])
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return "{}({} samples)".format(type(self).__name__, len(self))
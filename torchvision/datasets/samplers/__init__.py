@@ -1,3 +1,6 @@
 from .clip_sampler import DistributedSampler, UniformClipSampler, RandomClipSampler
+from .group_sampler import DistributedGroupSampler, GroupShuffleSampler
+from .readahead import ReadaheadSampler
 
-__all__ = ('DistributedSampler', 'UniformClipSampler', 'RandomClipSampler')
+__all__ = ('DistributedSampler', 'UniformClipSampler', 'RandomClipSampler', 'GroupShuffleSampler',
+           'DistributedGroupSampler', 'ReadaheadSampler')
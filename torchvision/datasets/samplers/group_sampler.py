@@ -0,0 +1,264 @@
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+
+def _get_group_offsets(data_source: Any, group_offsets: Optional[Sequence[int]]) -> torch.Tensor:
+    if group_offsets is None:
+        group_offsets = getattr(data_source, "group_offsets", None)
+    if group_offsets is None:
+        # every sample is its own group
+        group_offsets = range(len(data_source) + 1)
+    offsets = torch.from_numpy(np.array(group_offsets, dtype=np.int64))
+    if offsets.dim() != 1 or len(offsets) < 1 or offsets[0] != 0 or bool((offsets[1:] < offsets[:-1]).any()):
+        raise ValueError("group_offsets should be a non-decreasing sequence starting at 0")
+    return offsets
+
+
+def _buffered_order(groups: List[int], group_offsets: torch.Tensor, buffer_groups: int,
+                    g: Optional[torch.Generator]) -> torch.Tensor:
+    # samples of `groups`, taken buffer_groups groups at a time and shuffled within every buffer
+    # (kept in order without a generator)
+    chunks = []
+    for start in range(0, len(groups), buffer_groups):
+        buffer = torch.cat([torch.arange(int(group_offsets[i]), int(group_offsets[i + 1]))
+                            for i in groups[start:start + buffer_groups]])
+        chunks.append(buffer if g is None else buffer[torch.randperm(len(buffer), generator=g)])
+    if len(chunks) == 0:
+        return torch.empty(0, dtype=torch.int64)
+    return torch.cat(chunks)
+
+
+class GroupShuffleSampler(Sampler):
+    """
+    Shuffles a grouped dataset while keeping the reads of neighbouring samples local.
+
+    Group order is shuffled, then groups are taken ``buffer_groups`` at a time and the samples of
+    those groups are shuffled together before being emitted. A larger buffer gives a more random
+    order at the cost of spreading consecutive reads over more group files.
+
+    The groups are read from ``data_source.group_offsets`` (see :class:`~torchvision.datasets.DatasetFolder`)
+    unless ``group_offsets`` is given: the samples of group ``g`` are the indices
+    ``group_offsets[g]`` to ``group_offsets[g + 1] - 1``.
+
+    Example:
+        group_offsets: [0, 3, 6, 9]  (groups [0, 1, 2], [3, 4, 5], [6, 7, 8])
+        buffer_groups: 2
+
+        one epoch could be [4, 1, 5, 0, 3, 2, 8, 6, 7]: the groups are visited in the
+        order (1, 0), (2) and each buffer is shuffled on its own.
+
+    Args:
+        data_source (Dataset): dataset to sample from
+        buffer_groups (int): number of groups whose samples are shuffled together
+        shuffle (bool): if False, samples are emitted in index order
+        seed (int): seed of the shuffle, which is combined with the epoch set by :meth:`set_epoch`
+        group_offsets (sequence of int, optional): explicit group boundaries of ``data_source``
+
+    Attributes:
+        last_epoch_stats (dict): locality of the last order returned by ``__iter__``:
+            ``samples``, ``groups``, ``buffer_groups``, ``group_switches`` (number of times two
+            consecutive samples come from different groups, i.e. how many times a reader moves
+            to another group file) and ``requests_per_sample`` (``group_switches / samples``).
+    """
+
+    def __init__(
+            self,
+            data_source: Any,
+            buffer_groups: int = 8,
+            shuffle: bool = True,
+            seed: int = 0,
+            group_offsets: Optional[Sequence[int]] = None,
+    ) -> None:
+        if buffer_groups < 1:
+            raise ValueError("buffer_groups should be a positive integer, got {}".format(buffer_groups))
+        self.data_source = data_source
+        self.group_offsets = _get_group_offsets(data_source, group_offsets)
+        self.buffer_groups = buffer_groups
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.last_epoch_stats: Dict[str, Union[int, float]] = {}
+
+    @property
+    def num_groups(self) -> int:
+        return len(self.group_offsets) - 1
+
+    @property
+    def io_requests_per_sample(self) -> float:
+        return self.last_epoch_stats.get("requests_per_sample", 0.0)
+
+    def __iter__(self) -> Iterator[int]:
+        indices = self._order()
+        self.last_epoch_stats = self._locality_stats(indices)
+        return iter(indices.tolist())
+
+    def _order(self) -> torch.Tensor:
+        if not self.shuffle:
+            return torch.arange(int(self.group_offsets[-1]))
+        # deterministically shuffle based on seed and epoch
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        group_order = torch.randperm(self.num_groups, generator=g)
+        return _buffered_order(group_order.tolist(), self.group_offsets, self.buffer_groups, g)
+
+    def _locality_stats(self, indices: torch.Tensor) -> Dict[str, Union[int, float]]:
+        num_samples = len(indices)
+        if num_samples > 0:
+            sample_groups = torch.bucketize(indices, self.group_offsets[1:], right=True)
+            group_switches = 1 + int((sample_groups[1:] != sample_groups[:-1]).sum())
+        else:
+            group_switches = 0
+        return {
+            "samples": num_samples,
+            "groups": self.num_groups,
+            "buffer_groups": self.buffer_groups,
+            "group_switches": group_switches,
+            "requests_per_sample": group_switches / num_samples if num_samples > 0 else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return int(self.group_offsets[-1])
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+
+class DistributedGroupSampler(Sampler):
+    """
+    Splits a grouped dataset between distributed ranks by whole groups, balanced by bytes.
+
+    A sampler that deals the samples out with a stride, like :class:`~torch.utils.data.DistributedSampler`,
+    makes every rank read every group file, so the page cache of every node ends up holding the
+    whole dataset. Here every epoch shuffles the groups and cuts them into ``num_replicas``
+    consecutive runs holding about the same number of bytes: a rank only reads its own groups, a
+    node ``1 / num_nodes`` of the data. Within a rank, samples are ordered as by
+    :class:`GroupShuffleSampler`. Ranks whose groups hold fewer samples are padded with their own
+    first samples up to the largest one, so all ranks run the same number of steps; the length
+    of the sampler can thus change from one epoch to the next (:meth:`set_epoch` updates it).
+
+    The groups are read from ``data_source.group_offsets`` and their sizes from
+    ``data_source.group_bytes`` (see :class:`~torchvision.datasets.DatasetFolder`) unless
+    ``group_offsets`` and ``group_bytes`` are given; without sizes, groups are balanced by their
+    number of samples. Groups without samples are left out and every rank gets at least one of the
+    others, so there have to be at least ``num_replicas`` non-empty groups.
+
+    Example:
+        group_offsets: [0, 3, 6, 9, 10]  (groups [0, 1, 2], [3, 4, 5], [6, 7, 8], [9])
+        group_bytes: [30, 30, 30, 10]
+        num_replicas: 2
+
+        one epoch could give groups (2, 0) to rank 0 and (3, 1) to rank 1, e.g.
+        rank 0: [7, 8, 1, 6, 0, 2] and rank 1: [5, 9, 3, 4, 5, 9] (padded to 6 samples).
+
+    Args:
+        data_source (Dataset): dataset to sample from
+        num_replicas (int, optional): number of ranks, the world size by default
+        rank (int, optional): rank of the current process, the distributed rank by default
+        shuffle (bool): if False, groups are assigned in order and samples emitted in index order
+        seed (int): seed of the shuffle, which is combined with the epoch set by :meth:`set_epoch`;
+            it has to be the same on all ranks
+        buffer_groups (int): number of groups whose samples are shuffled together
+        group_offsets (sequence of int, optional): explicit group boundaries of ``data_source``
+        group_bytes (sequence of int, optional): explicit size of every group
+    """
+
+    def __init__(
+            self,
+            data_source: Any,
+            num_replicas: Optional[int] = None,
+            rank: Optional[int] = None,
+            shuffle: bool = True,
+            seed: int = 0,
+            buffer_groups: int = 8,
+            group_offsets: Optional[Sequence[int]] = None,
+            group_bytes: Optional[Sequence[int]] = None,
+    ) -> None:
+        if num_replicas is None:
+            if not dist.is_available():
+                raise RuntimeError("Requires distributed package to be available")
+            num_replicas = dist.get_world_size()
+        if rank is None:
+            if not dist.is_available():
+                raise RuntimeError("Requires distributed package to be available")
+            rank = dist.get_rank()
+        if not 0 <= rank < num_replicas:
+            raise ValueError("rank should be in [0, {}), got {}".format(num_replicas, rank))
+        if buffer_groups < 1:
+            raise ValueError("buffer_groups should be a positive integer, got {}".format(buffer_groups))
+        self.group_offsets = _get_group_offsets(data_source, group_offsets)
+        # groups without samples are left out, so that every rank gets samples
+        self._groups = torch.nonzero(self.group_offsets[1:] > self.group_offsets[:-1]).flatten()
+        if len(self._groups) < num_replicas:
+            raise ValueError("Cannot split {} non-empty groups between {} ranks".format(
+                len(self._groups), num_replicas))
+        if group_bytes is None and group_offsets is None:
+            group_bytes = getattr(data_source, "group_bytes", None)
+        if group_bytes is None:
+            group_bytes = (self.group_offsets[1:] - self.group_offsets[:-1]).tolist()
+        self.group_bytes = torch.from_numpy(np.array(group_bytes, dtype=np.int64))
+        if len(self.group_bytes) != self.num_groups:
+            raise ValueError("Got {} group sizes for {} groups".format(len(self.group_bytes), self.num_groups))
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.buffer_groups = buffer_groups
+        self.epoch = 0
+        self._assign()
+
+    @property
+    def num_groups(self) -> int:
+        return len(self.group_offsets) - 1
+
+    def _generator(self) -> torch.Generator:
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        return g
+
+    def _group_order(self, g: torch.Generator) -> torch.Tensor:
+        if not self.shuffle:
+            return self._groups
+        return self._groups[torch.randperm(len(self._groups), generator=g)]
+
+    def _assign(self) -> None:
+        # groups of every rank for the current epoch, and the padded number of samples per rank
+        group_order = self._group_order(self._generator())
+        num_groups = len(group_order)
+        cumulative = torch.cumsum(self.group_bytes[group_order], 0)
+        total = int(cumulative[-1])
+        # the runs are cut at the group boundaries closest to multiples of total / num_replicas
+        bounds = [0]
+        for r in range(1, self.num_replicas):
+            target = total * r / self.num_replicas
+            i = min(int(np.searchsorted(cumulative.numpy(), target)), num_groups - 1)
+            before = int(cumulative[i - 1]) if i > 0 else 0
+            bounds.append(i if target - before <= int(cumulative[i]) - target else i + 1)
+        bounds.append(num_groups)
+        # every rank gets at least one group
+        for r in range(1, self.num_replicas + 1):
+            bounds[r] = min(max(bounds[r], bounds[r - 1] + 1), num_groups - (self.num_replicas - r))
+        sizes = self.group_offsets[1:] - self.group_offsets[:-1]
+        self.rank_groups = [group_order[bounds[r]:bounds[r + 1]].tolist() for r in range(self.num_replicas)]
+        self.num_samples = max(int(sizes[groups].sum()) for groups in self.rank_groups)
+
+    def __iter__(self) -> Iterator[int]:
+        g = self._generator()
+        # the generator of the assignment is advanced alike on every rank, then shuffles the buffers
+        self._group_order(g)
+        indices = _buffered_order(self.rank_groups[self.rank], self.group_offsets, self.buffer_groups,
+                                  g if self.shuffle else None)
+        if len(indices) < self.num_samples:
+            # padded with its own samples, which are in the groups this rank already reads
+            repeats = -(-self.num_samples // len(indices))
+            indices = indices.repeat(repeats)[:self.num_samples]
+        return iter(indices.tolist())
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self._assign()
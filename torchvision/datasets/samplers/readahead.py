@@ -0,0 +1,199 @@
+import collections
+import os
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from torch.utils.data import Sampler
+
+
+_READ_CHUNK = 1 << 20
+
+
+def _willneed(path: str, offset: int, size: int) -> None:
+    # asks the kernel to start reading the range into the page cache; size 0 is up to the end of the file
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, offset, size, os.POSIX_FADV_WILLNEED)
+            return
+        # without fadvise, the pages are brought in by reading them
+        while True:
+            n = _READ_CHUNK if size == 0 else min(_READ_CHUNK, size)
+            if n == 0 or len(os.pread(fd, n, offset)) < n:
+                break
+            offset += n
+            size = 0 if size == 0 else size - n
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _dontneed(path: str, offset: int, size: int) -> None:
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, offset, size, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _hint(hinted: Dict[str, Tuple[int, Optional[int]]], path: str, offset: int, size: int) -> None:
+    # hints the range unless the ranges already hinted for the file cover it, and adds it to their union
+    end = None if size == 0 else offset + size
+    covered = hinted.get(path)
+    if covered is not None and offset >= covered[0] and (covered[1] is None or (end is not None and end <= covered[1])):
+        return
+    _willneed(path, offset, size)
+    if covered is not None:
+        offset = min(offset, covered[0])
+        end = None if end is None or covered[1] is None else max(end, covered[1])
+    hinted[path] = (offset, end)
+
+
+class _Progress(object):
+    # position of the consumer in the epoch, shared with the readahead thread
+    def __init__(self) -> None:
+        self.position = 0
+        self.stop = False
+        self.cond = threading.Condition()
+
+
+class ReadaheadSampler(Sampler):
+    """Wraps a sampler and prefetches the files of the samples it is about to return into the page cache.
+
+    The order of an epoch is known as soon as it starts, so a background thread walks it ahead of
+    the consumer: it maps every index to the byte range it reads with ``locate`` and asks the kernel
+    to read the ranges of the next ``lookahead`` files with ``posix_fadvise(POSIX_FADV_WILLNEED)``
+    (or by reading them where fadvise is not available). Cold reads of shards on slow disks then
+    overlap with training instead of stalling the DataLoader workers. With ``drop_behind``, the
+    ranges of a file are also dropped from the page cache (``POSIX_FADV_DONTNEED``) once the
+    sampler is ``drop_behind`` samples past its last index, which keeps the page cache close to
+    the working set when the dataset does not fit in memory::
+
+        sampler = ReadaheadSampler(GroupShuffleSampler(dataset), dataset.byte_range, lookahead=16)
+        loader = DataLoader(dataset, batch_size=256, sampler=sampler, num_workers=8)
+
+    The DataLoader takes indices from the sampler ahead of the workers, by up to
+    ``prefetch_factor * num_workers`` batches: ``drop_behind`` has to be at least that many samples,
+    otherwise ranges are dropped before the workers read them. Hints are best effort, errors are
+    ignored.
+
+    Args:
+        sampler (Sampler or iterable): Sampler of the indices.
+        locate (callable): Function returning the ``(path, offset, size)`` read by the sample at an
+            index, with ``size`` 0 for a whole file, e.g. :meth:`~torchvision.datasets.DatasetFolder.byte_range`.
+        lookahead (int): Number of distinct files prefetched ahead of the sampler. Default: 16.
+        drop_behind (int, optional): Number of samples after which the ranges of a file that is not
+            used anymore are dropped from the page cache. Default: None, nothing is dropped.
+    """
+
+    def __init__(
+            self,
+            sampler: Iterable[int],
+            locate: Callable[[int], Tuple[str, int, int]],
+            lookahead: int = 16,
+            drop_behind: Optional[int] = None,
+    ) -> None:
+        if lookahead < 1:
+            raise ValueError("lookahead should be a positive integer, got {}".format(lookahead))
+        if drop_behind is not None and drop_behind < 0:
+            raise ValueError("drop_behind should be a non-negative integer, got {}".format(drop_behind))
+        self.sampler = sampler
+        self.locate = locate
+        self.lookahead = lookahead
+        self.drop_behind = drop_behind
+
+    def __len__(self) -> int:
+        return len(self.sampler)  # type: ignore[arg-type]
+
+    def set_epoch(self, epoch: int) -> None:
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)  # type: ignore[union-attr]
+
+    def __iter__(self) -> Iterator[int]:
+        indices = list(self.sampler)
+        progress = _Progress()
+        thread = threading.Thread(target=self._run, args=(indices, progress), daemon=True)
+        thread.start()
+        try:
+            for position, index in enumerate(indices):
+                with progress.cond:
+                    progress.position = position
+                    progress.cond.notify()
+                yield index
+        finally:
+            with progress.cond:
+                progress.stop = True
+                progress.cond.notify()
+            thread.join()
+
+    def _run(self, indices: List[int], progress: _Progress) -> None:
+        # indices walked but not returned yet, and the number of them per file
+        ahead: "collections.deque[Tuple[int, str]]" = collections.deque()
+        counts: Dict[str, int] = {}
+        # union of the ranges hinted for every file, (offset, end) with end None up to the end of the file
+        hinted: Dict[str, Tuple[int, Optional[int]]] = {}
+        # files no index ahead reads anymore, with the position of their last index
+        retiring: "collections.OrderedDict[str, int]" = collections.OrderedDict()
+
+        def advance() -> List[Tuple[str, int, int]]:
+            # forgets the indices returned by the sampler, called with progress.cond held
+            while len(ahead) > 0 and ahead[0][0] < progress.position:
+                last, done = ahead.popleft()
+                counts[done] -= 1
+                if counts[done] == 0:
+                    del counts[done]
+                    retiring[done] = last
+            return self._expired(retiring, hinted, progress.position)
+
+        for position, index in enumerate(indices):
+            path, offset, size = self.locate(index)
+            with progress.cond:
+                drops = advance()
+                while not progress.stop and path not in counts and len(counts) >= self.lookahead:
+                    progress.cond.wait()
+                    drops.extend(advance())
+                if progress.stop:
+                    return
+            for drop in drops:
+                _dontneed(*drop)
+
+            retiring.pop(path, None)
+            ahead.append((position, path))
+            counts[path] = counts.get(path, 0) + 1
+            _hint(hinted, path, offset, size)
+
+        # the files of the end of the epoch are dropped as well
+        while self.drop_behind is not None and (len(ahead) > 0 or len(retiring) > 0):
+            with progress.cond:
+                drops = advance()
+                if len(drops) == 0:
+                    if progress.stop:
+                        return
+                    progress.cond.wait()
+            for drop in drops:
+                _dontneed(*drop)
+
+    def _expired(self, retiring: "collections.OrderedDict[str, int]", hinted: Dict[str, Tuple[int, Optional[int]]],
+                 position: int) -> List[Tuple[str, int, int]]:
+        # ranges of the retired files to drop from the page cache
+        drops = []
+        while len(retiring) > 0:
+            path, last = next(iter(retiring.items()))
+            if self.drop_behind is not None and last + self.drop_behind >= position:
+                break
+            del retiring[path]
+            offset, end = hinted.pop(path, (0, None))
+            if self.drop_behind is not None:
+                drops.append((path, offset, 0 if end is None else end - offset))
+        return drops
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import os.path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+_VERSION = 1
+# directories modified less than that before a scan started may have changed during the scan
+# without their modification time changing again (coarse timestamps, e.g. 2s on FAT, 1s on NFS)
+_RACY_NS = 2 * 10 ** 9
+
+
+def _join(strings: List[str]) -> np.ndarray:
+    return np.frombuffer('\0'.join(strings).encode('utf-8', 'surrogateescape'), dtype=np.uint8)
+
+
+def _split(array: np.ndarray) -> List[str]:
+    if len(array) == 0:
+        return []
+    return array.tobytes().decode('utf-8', 'surrogateescape').split('\0')
+
+
+def scan_cache_path(cache_dir: str, directory: str, extensions: Tuple[str, ...]) -> str:
+    """Path of the cached scan of ``directory`` for ``extensions`` inside ``cache_dir``."""
+    key = repr((os.path.realpath(os.path.expanduser(directory)), tuple(extensions)))
+    return os.path.join(os.path.expanduser(cache_dir), hashlib.sha1(key.encode()).hexdigest()[:16] + ".npz")
+
+
+def load_scan_index(path: str, directory: str, class_to_idx: Dict[str, int]) -> Optional[List[Tuple[str, int]]]:
+    """Returns the samples saved by :func:`save_scan_index`, or None if the cache is missing or stale.
+
+    The cache is stale when the classes differ or when any directory listed by the scan has been
+    modified since, or was modified shortly before the scan started.
+    """
+    try:
+        with np.load(path) as index:
+            if int(index['version']) != _VERSION or _split(index['directory']) != [directory]:
+                return None
+            if _split(index['classes']) != sorted(class_to_idx) or \
+                    index['class_indices'].tolist() != [class_to_idx[c] for c in sorted(class_to_idx)]:
+                return None
+            scan_time = int(index['scan_time'])
+            for d, mtime in zip(_split(index['dirs']), index['dir_mtimes'].tolist()):
+                if mtime >= scan_time - _RACY_NS or os.stat(d).st_mtime_ns != mtime:
+                    return None
+            paths = _split(index['paths'])
+            targets = index['targets'].tolist()
+    except (OSError, KeyError, ValueError):
+        return None
+    return list(zip(paths, targets))
+
+
+def save_scan_index(
+        path: str,
+        directory: str,
+        class_to_idx: Dict[str, int],
+        samples: List[Tuple[str, int]],
+        dirs: List[Tuple[str, int]],
+        scan_time: int,
+) -> None:
+    """Saves the result of a scan started at ``scan_time`` (ns) that listed ``dirs`` ((path, mtime_ns) pairs).
+
+    The file is written under a temporary name and renamed, so processes scanning the same root
+    at once (e.g. the ranks of a distributed job) never read a partial cache. Errors are ignored,
+    the cache is only an optimization.
+    """
+    classes = sorted(class_to_idx)
+    arrays = {
+        'version': np.array(_VERSION),
+        'directory': _join([directory]),
+        'classes': _join(classes),
+        'class_indices': np.array([class_to_idx[c] for c in classes], dtype=np.int64),
+        'scan_time': np.array(scan_time, dtype=np.int64),
+        'dirs': _join([d for d, _ in dirs]),
+        'dir_mtimes': np.array([mtime for _, mtime in dirs], dtype=np.int64),
+        'paths': _join([p for p, _ in samples]),
+        'targets': np.array([t for _, t in samples], dtype=np.int32),
+    }
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
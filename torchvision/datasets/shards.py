@@ -0,0 +1,293 @@
+import errno
+import io
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+# maximum number of buffers of a single preadv call (IOV_MAX on Linux)
+_IOV_MAX = 1024
+# offsets, sizes and buffers of O_DIRECT reads are multiples of this, the largest logical block size
+# of common devices (and the page size, so anonymous maps are aligned)
+DIRECT_IO_ALIGNMENT = 4096
+
+
+def plan_reads(ranges: Sequence[Tuple[int, int]], max_gap: int = 0) -> List[List[Tuple[int, int]]]:
+    """Groups byte ranges into runs that can each be fetched with one sequential read.
+
+    Args:
+        ranges (sequence of (offset, size)): non-overlapping ranges sorted by offset.
+        max_gap (int): largest hole between two ranges that is read (and dropped) to merge them.
+
+    Returns:
+        list: runs of ranges; the ranges of a run are at most ``max_gap`` bytes apart.
+    """
+    runs: List[List[Tuple[int, int]]] = []
+    end = None
+    for offset, size in ranges:
+        if end is not None and 0 <= offset - end <= max_gap and len(runs[-1]) < _IOV_MAX // 2:
+            runs[-1].append((offset, size))
+        else:
+            runs.append([(offset, size)])
+        end = offset + size
+    return runs
+
+
+class MemoryViewReader(io.RawIOBase):
+    """Read-only, seekable file object over a buffer that does not copy it.
+
+    ``io.BytesIO`` copies any buffer that is not a ``bytes`` object, so slices of a memory map
+    handed to PIL through it would be copied once more before decoding.
+    """
+
+    def __init__(self, buffer: Any) -> None:
+        super(MemoryViewReader, self).__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        n = min(len(b), len(self._view) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError("invalid whence ({}, should be 0, 1 or 2)".format(whence))
+        if pos < 0:
+            raise ValueError("negative seek position {}".format(pos))
+        self._pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+        super(MemoryViewReader, self).close()
+
+
+def _open_direct(path: str) -> int:
+    flags = getattr(os, 'O_DIRECT', 0)
+    if flags:
+        try:
+            return os.open(path, os.O_RDONLY | flags)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+    # O_DIRECT is not supported by the file system
+    return os.open(path, os.O_RDONLY)
+
+
+class ShardCache(object):
+    """Keeps the most recently used shard files of a worker open.
+
+    Shards are opened lazily, either as a read-only memory map or as a plain file descriptor read
+    with ``os.pread``, and the least recently used one is closed once more than ``max_open``
+    shards are open. The cache belongs to the process that filled it: a forked DataLoader worker
+    starts from an empty cache, and pickling the cache drops the open shards.
+
+    With ``direct_io``, shards are opened with ``O_DIRECT`` and read around the page cache: every
+    read covers the requested bytes rounded out to ``DIRECT_IO_ALIGNMENT``, lands in a page-aligned
+    buffer reused by the following reads, and the requested ranges are copied out of it. Reading a
+    dataset much larger than memory then does not evict the rest of the page cache (checkpoints,
+    validation set) every epoch, at the cost of losing the cache and the kernel readahead for the
+    shards themselves. On file systems that do not support ``O_DIRECT`` (e.g. tmpfs) and platforms
+    that do not have it, the same aligned reads go through the page cache.
+
+    Args:
+        max_open (int): Maximum number of shards kept open at once.
+        use_mmap (bool): If True, shards are memory-mapped, otherwise they are read with ``os.pread``.
+        direct_io (bool): If True, shards are read with ``O_DIRECT``. Needs ``use_mmap=False``.
+    """
+
+    def __init__(self, max_open: int = 64, use_mmap: bool = True, direct_io: bool = False) -> None:
+        if max_open < 1:
+            raise ValueError("max_open should be a positive integer, got {}".format(max_open))
+        if use_mmap and direct_io:
+            raise ValueError("direct_io reads cannot be used with use_mmap=True")
+        self.max_open = max_open
+        self.use_mmap = use_mmap
+        self.direct_io = direct_io
+        self._shards: "OrderedDict[str, Any]" = OrderedDict()
+        self._pid = os.getpid()
+        self._direct_buffer = None
+        self._direct_lock = threading.Lock()
+
+    def view(self, path: str) -> memoryview:
+        """Returns a memoryview over the whole content of ``path``, which is memory-mapped."""
+        if not self.use_mmap:
+            raise RuntimeError("view() needs a ShardCache created with use_mmap=True")
+        return self._get(path)[1]
+
+    def read(self, path: str, offset: int, size: int) -> memoryview:
+        """Returns ``size`` bytes of ``path`` starting at ``offset``, with a single ``pread`` or a map slice."""
+        if self.use_mmap:
+            return self._get(path)[1][offset:offset + size]
+        if self.direct_io:
+            return self._read_direct(path, [(offset, size)])[0]
+        return memoryview(os.pread(self._get(path), size, offset))
+
+    def read_ranges(self, path: str, ranges: Sequence[Tuple[int, int]], max_gap: int = 0) -> List[memoryview]:
+        """Reads several byte ranges of ``path``, merging neighbouring ranges into single reads.
+
+        Every run of ranges returned by :func:`plan_reads` is fetched with one ``os.preadv`` that
+        scatters the bytes straight into one buffer per range (or one ``pread`` sliced afterwards
+        where ``preadv`` is not available).
+
+        Args:
+            path (string): shard to read from.
+            ranges (sequence of (offset, size)): non-overlapping ranges sorted by offset.
+            max_gap (int): largest hole between two ranges that is read to merge them.
+
+        Returns:
+            list: one memoryview per range, in the order of ``ranges``.
+        """
+        if self.use_mmap:
+            view = self._get(path)[1]
+            return [view[offset:offset + size] for offset, size in ranges]
+        if self.direct_io:
+            views = []
+            for run in plan_reads(ranges, max_gap):
+                views.extend(self._read_direct(path, run))
+            return views
+        fd = self._get(path)
+        views = []
+        for run in plan_reads(ranges, max_gap):
+            run_offset = run[0][0]
+            run_size = run[-1][0] + run[-1][1] - run_offset
+            if hasattr(os, 'preadv'):
+                buffers = []
+                outputs = []
+                end = run_offset
+                for offset, size in run:
+                    if offset > end:
+                        buffers.append(bytearray(offset - end))
+                    buffer = bytearray(size)
+                    buffers.append(buffer)
+                    outputs.append(memoryview(buffer))
+                    end = offset + size
+                read = os.preadv(fd, buffers, run_offset)
+            else:
+                data = memoryview(os.pread(fd, run_size, run_offset))
+                read = len(data)
+                outputs = [data[offset - run_offset:offset - run_offset + size] for offset, size in run]
+            if read != run_size:
+                raise EOFError("{}: expected {} bytes at offset {}, got {}".format(path, run_size, run_offset, read))
+            views.extend(outputs)
+        return views
+
+    def _read_direct(self, path: str, run: Sequence[Tuple[int, int]]) -> List[memoryview]:
+        # reads the aligned span of a run of ranges with one read into the reused buffer, and copies
+        # every range out of it
+        fd = self._get(path)
+        run_offset = run[0][0]
+        run_end = run[-1][0] + run[-1][1]
+        start = run_offset - run_offset % DIRECT_IO_ALIGNMENT
+        size = -(-(run_end - start) // DIRECT_IO_ALIGNMENT) * DIRECT_IO_ALIGNMENT
+        with self._direct_lock:
+            if self._direct_buffer is None or len(self._direct_buffer) < size:
+                if self._direct_buffer is not None:
+                    self._direct_buffer.close()
+                # anonymous maps are page-aligned, as O_DIRECT needs; sizes are rounded up to a power
+                # of two so that the buffer is not reallocated for every slightly larger read
+                self._direct_buffer = mmap.mmap(-1, 1 << (size - 1).bit_length())
+            buffer = memoryview(self._direct_buffer)
+            try:
+                # the last block of the file is short, reads stop at its end
+                if hasattr(os, 'preadv'):
+                    read = os.preadv(fd, [buffer[:size]], start)
+                else:
+                    data = os.pread(fd, size, start)
+                    read = len(data)
+                    buffer[:read] = data
+                if read < run_end - start:
+                    raise EOFError("{}: expected {} bytes at offset {}, got {}".format(
+                        path, run_end - run_offset, run_offset, max(0, read - (run_offset - start))))
+                return [memoryview(bytearray(buffer[offset - start:offset - start + n])) for offset, n in run]
+            finally:
+                buffer.release()
+
+    def fileno(self, path: str) -> int:
+        """Returns the cached file descriptor of ``path``."""
+        if self.use_mmap:
+            raise RuntimeError("fileno() needs a ShardCache created with use_mmap=False")
+        return self._get(path)
+
+    def close(self) -> None:
+        while self._shards:
+            self._close(self._shards.popitem()[1])
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def _get(self, path: str) -> Any:
+        self._check_pid()
+        entry = self._shards.get(path)
+        if entry is not None:
+            self._shards.move_to_end(path)
+            return entry
+        if self.use_mmap:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return None, memoryview(b'')
+                mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            entry = (mapped, memoryview(mapped))
+        elif self.direct_io:
+            entry = _open_direct(path)
+        else:
+            entry = os.open(path, os.O_RDONLY)
+        self._shards[path] = entry
+        while len(self._shards) > self.max_open:
+            self._close(self._shards.popitem(last=False)[1])
+        return entry
+
+    @staticmethod
+    def _close(entry: Any) -> None:
+        if isinstance(entry, int):
+            os.close(entry)
+            return
+        mapped, view = entry
+        try:
+            view.release()
+            mapped.close()
+        except BufferError:
+            # slices of the map are still referenced by a decoder, the map is closed
+            # once they are garbage collected
+            pass
+
+    def _check_pid(self) -> None:
+        if self._pid != os.getpid():
+            # shards inherited through fork belong to the parent, which keeps using them;
+            # the child only drops its copies of the descriptors
+            for entry in self._shards.values():
+                if isinstance(entry, int):
+                    os.close(entry)
+            self._shards = OrderedDict()
+            self._pid = os.getpid()
+            # the lock may have been held by another thread of the parent
+            self._direct_buffer = None
+            self._direct_lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'max_open': self.max_open, 'use_mmap': self.use_mmap, 'direct_io': self.direct_io}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
@@ -0,0 +1,254 @@
+import multiprocessing
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None  # type: ignore[assignment]
+
+
+# slots of the int64 header shared by every process using the cache
+_CLOCK, _FREE_TOP, _CACHED_BYTES, _CACHED_SAMPLES, _HITS, _MISSES, _EVICTIONS = range(7)
+_HEADER_SIZE = 8
+
+CACHE_POLICIES = ('lru', 'pin')
+
+
+def _layout(num_samples: int, num_blocks: int, block_size: int) -> Tuple[Dict[str, Any], int]:
+    # (offset, dtype, count) of every array stored in the segment, 8-byte aligned, and its total size
+    fields = [
+        ('header', np.int64, _HEADER_SIZE),
+        ('heads', np.int32, num_samples),
+        ('sizes', np.int32, num_samples),
+        ('stamps', np.int64, num_samples),
+        ('next_blocks', np.int32, num_blocks),
+        ('free_blocks', np.int32, num_blocks),
+        ('data', np.uint8, num_blocks * block_size),
+    ]
+    layout = {}
+    offset = 0
+    for name, dtype, count in fields:
+        layout[name] = (offset, dtype, count)
+        offset += (np.dtype(dtype).itemsize * count + 7) // 8 * 8
+    return layout, offset
+
+
+class SharedBytesCache(object):
+    """Cache of the encoded bytes of the samples of a dataset, shared by the DataLoader workers of one
+    dataset instance.
+
+    The bytes live in one POSIX shared memory segment (``multiprocessing.shared_memory``) cut into
+    fixed-size blocks: a sample takes a chain of blocks and is looked up by its index, so DataLoader
+    workers fill and read the same cache and an image read once by any of them is not read from disk
+    again in the next epochs. The segment is created by the process building the cache and removed
+    when that process closes it; workers attach to it when they are forked or spawned. Other
+    processes do not: every distributed rank of a node that builds its own dataset allocates its
+    own cache of ``capacity`` bytes, and the ranks do not share hits.
+
+    Two eviction policies are supported once the byte budget is used up:
+
+    - ``'lru'``: the least recently used samples are evicted, a few at a time (``evict_fraction`` of
+      the cache) so that the eviction scan is amortized over many insertions.
+    - ``'pin'``: nothing is evicted; the first samples read stay cached and the others are always
+      read from disk. For a dataset slightly larger than the budget, this keeps a fixed share of it
+      in memory every epoch where LRU would evict every sample before it is used again.
+
+    Args:
+        num_samples (int): Number of samples of the dataset, the valid indices are ``0`` to ``num_samples - 1``.
+        capacity (int): Byte budget of the cached images.
+        policy (string, optional): Eviction policy, ``'lru'`` or ``'pin'``. Default: ``'lru'``.
+        block_size (int, optional): Allocation unit of the cache in bytes. Default: 16 KiB.
+        evict_fraction (float, optional): Share of the blocks freed by one LRU eviction. Default: 1/32.
+        multiprocessing_context (string or context, optional): Context of the lock guarding the cache,
+            which has to match the ``multiprocessing_context`` of the DataLoader. Default: the default context.
+    """
+
+    def __init__(
+            self,
+            num_samples: int,
+            capacity: int,
+            policy: str = 'lru',
+            block_size: int = 16 * 1024,
+            evict_fraction: float = 1 / 32,
+            multiprocessing_context: Optional[Any] = None,
+    ) -> None:
+        if shared_memory is None:
+            raise RuntimeError("SharedBytesCache needs multiprocessing.shared_memory (Python 3.8 or later)")
+        if policy not in CACHE_POLICIES:
+            raise ValueError("policy should be one of {}, got {!r}".format(CACHE_POLICIES, policy))
+        if capacity < block_size or block_size < 1:
+            raise ValueError("capacity should hold at least one block of {} bytes, got {}".format(block_size, capacity))
+        self.num_samples = num_samples
+        self.capacity = capacity
+        self.policy = policy
+        self.block_size = block_size
+        self.evict_fraction = evict_fraction
+        self.num_blocks = capacity // block_size
+        if multiprocessing_context is None or isinstance(multiprocessing_context, str):
+            multiprocessing_context = multiprocessing.get_context(multiprocessing_context)
+        self._lock = multiprocessing_context.Lock()
+        self._shm = shared_memory.SharedMemory(create=True, size=self._layout()[1])
+        self._owner_pid = os.getpid()
+        self._map_arrays()
+        self._heads[:] = -1
+        self._header[:] = 0
+        # blocks are popped from the end, so a fresh cache hands out consecutive blocks
+        self._free_blocks[:] = np.arange(self.num_blocks - 1, -1, -1, dtype=np.int32)
+        self._header[_FREE_TOP] = self.num_blocks
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _layout(self) -> Tuple[Dict[str, Any], int]:
+        return _layout(self.num_samples, self.num_blocks, self.block_size)
+
+    def _map_arrays(self) -> None:
+        buf = self._shm.buf
+        for key, (offset, dtype, count) in self._layout()[0].items():
+            setattr(self, '_' + key, np.frombuffer(buf, dtype=dtype, count=count, offset=offset))
+
+    def get(self, index: int) -> Optional[memoryview]:
+        """Returns a copy of the cached bytes of sample ``index``, or None if it is not cached."""
+        block_size = self.block_size
+        with self._lock:
+            block = int(self._heads[index])
+            if block < 0:
+                self._header[_MISSES] += 1
+                return None
+            size = int(self._sizes[index])
+            out = np.empty(size, dtype=np.uint8)
+            pos = 0
+            while pos < size:
+                n = min(block_size, size - pos)
+                out[pos:pos + n] = self._data[block * block_size:block * block_size + n]
+                block = int(self._next_blocks[block])
+                pos += n
+            self._stamps[index] = self._header[_CLOCK]
+            self._header[_CLOCK] += 1
+            self._header[_HITS] += 1
+        return memoryview(out)
+
+    def put(self, index: int, data: Any) -> bool:
+        """Stores the bytes of sample ``index``.
+
+        Returns:
+            bool: True if the sample is cached, False if it does not fit (``'pin'`` policy with a
+            full cache, or a sample larger than the cache).
+        """
+        data = np.frombuffer(data, dtype=np.uint8)
+        size = len(data)
+        needed = max(1, -(-size // self.block_size))
+        if needed > self.num_blocks:
+            return False
+        block_size = self.block_size
+        with self._lock:
+            if self._heads[index] >= 0:
+                return True
+            free_top = int(self._header[_FREE_TOP])
+            if free_top < needed:
+                if self.policy == 'pin':
+                    return False
+                self._evict(needed)
+                free_top = int(self._header[_FREE_TOP])
+            blocks = self._free_blocks[free_top - needed:free_top][::-1].copy()
+            self._header[_FREE_TOP] = free_top - needed
+            for i, block in enumerate(blocks.tolist()):
+                self._data[block * block_size:block * block_size + min(block_size, size - i * block_size)] = \
+                    data[i * block_size:(i + 1) * block_size]
+            self._next_blocks[blocks[:-1]] = blocks[1:]
+            self._next_blocks[blocks[-1]] = -1
+            self._heads[index] = blocks[0]
+            self._sizes[index] = size
+            self._stamps[index] = self._header[_CLOCK]
+            self._header[_CLOCK] += 1
+            self._header[_CACHED_BYTES] += size
+            self._header[_CACHED_SAMPLES] += 1
+        return True
+
+    def _evict(self, needed: int) -> None:
+        # called with the lock held: frees the least recently used samples, at least `needed` blocks
+        target = max(needed - int(self._header[_FREE_TOP]), int(self.num_blocks * self.evict_fraction))
+        cached = np.flatnonzero(self._heads >= 0)
+        stamps = self._stamps[cached]
+        sample_blocks = np.maximum(1, -(-self._sizes[cached].astype(np.int64) // self.block_size))
+        k = min(len(cached), 2 * target * len(cached) // max(1, int(sample_blocks.sum())) + 1)
+        order = np.argpartition(stamps, k - 1)[:k] if k < len(cached) else np.arange(len(cached))
+        order = order[np.argsort(stamps[order], kind='stable')]
+        freed = np.cumsum(sample_blocks[order])
+        if freed[-1] < target and k < len(cached):
+            order = np.argsort(stamps, kind='stable')
+            freed = np.cumsum(sample_blocks[order])
+        victims = cached[order[:int(np.searchsorted(freed, target)) + 1]]
+
+        free_top = int(self._header[_FREE_TOP])
+        for index in victims.tolist():
+            block = int(self._heads[index])
+            while block >= 0:
+                self._free_blocks[free_top] = block
+                free_top += 1
+                block = int(self._next_blocks[block])
+            self._header[_CACHED_BYTES] -= int(self._sizes[index])
+        self._heads[victims] = -1
+        self._header[_FREE_TOP] = free_top
+        self._header[_CACHED_SAMPLES] -= len(victims)
+        self._header[_EVICTIONS] += len(victims)
+
+    def __contains__(self, index: int) -> bool:
+        return bool(self._heads[index] >= 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters shared by all the processes using the cache."""
+        with self._lock:
+            header = self._header.tolist()
+        return {
+            'capacity': self.num_blocks * self.block_size,
+            'policy': self.policy,
+            'cached_bytes': header[_CACHED_BYTES],
+            'cached_samples': header[_CACHED_SAMPLES],
+            'hits': header[_HITS],
+            'misses': header[_MISSES],
+            'evictions': header[_EVICTIONS],
+        }
+
+    def close(self) -> None:
+        """Detaches from the segment; the process that created the cache also removes it."""
+        if getattr(self, '_shm', None) is None:
+            return
+        # the arrays export the buffer of the segment, which cannot be closed while they exist
+        for key in self._layout()[0]:
+            self.__dict__.pop('_' + key, None)
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
+        self._shm = None
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # spawned workers attach to the segment of the parent; the lock can only be pickled
+        # while spawning a process
+        return {
+            'name': self.name, 'num_samples': self.num_samples, 'capacity': self.capacity,
+            'policy': self.policy, 'block_size': self.block_size, 'evict_fraction': self.evict_fraction,
+            'lock': self._lock,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.num_samples = state['num_samples']
+        self.capacity = state['capacity']
+        self.policy = state['policy']
+        self.block_size = state['block_size']
+        self.evict_fraction = state['evict_fraction']
+        self.num_blocks = self.capacity // self.block_size
+        self._lock = state['lock']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner_pid = None
+        self._map_arrays()